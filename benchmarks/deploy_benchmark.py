@@ -0,0 +1,420 @@
+'''Benchmarks a whole milldeploy run against a local moto server.
+
+Each scenario seeds an account with a number of foreign autoscale groups,
+launch configs and alarms, applies the sample config from scratch and then
+plans again against the converged account.  Every run is a separate
+milldeploy process; its wall time, peak memory and the AWS calls in its
+trace are compared with baseline.json.
+
+    pip install "moto[server]"
+    python benchmarks/deploy_benchmark.py
+    python benchmarks/deploy_benchmark.py --update_baseline
+'''
+
+import click
+import collections
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import boto3
+from moto.autoscaling.responses import AutoScalingResponse
+from moto.core.responses import ActionResult, EmptyResult
+from moto.server import DomainDispatcherApplication, ThreadedMotoServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+SAMPLE_CONFIG_DIR = os.path.join(REPO_DIR, 'sample-config')
+
+REGION = 'us-east-1'
+PROFILE = 'benchmark'
+MILL_INIT_REF = 'benchmark'
+
+# environment-account.properties values the sample leaves as placeholders
+PROPERTIES = dict(jarVersion='7.0.0', awsRegion=REGION,
+                  millInitRef=MILL_INIT_REF, efsDnsName='efs.example.org',
+                  githubKeyName='github-key')
+
+# stands in for mill-init's generator: one small script per role, sized by
+# the config files it is given like the real ones
+GENERATOR = '''#!/usr/bin/env python3
+import argparse, os
+parser = argparse.ArgumentParser()
+for flag in ['-m', '-e', '-bx', '-bi', '-sx', '-si', '-o']:
+    parser.add_argument(flag)
+args = parser.parse_args()
+os.makedirs(args.o, exist_ok=True)
+size = sum(os.path.getsize(f) for f in
+           [args.m, args.e, args.bx, args.bi, args.sx, args.si])
+for role in ['sentinel', 'storage-stats-worker', 'audit-worker',
+             'dup-worker', 'bit-worker', 'bit-report-worker']:
+    with open(os.path.join(args.o, 'cloud-init-%s.txt' % role), 'w') as f:
+        f.write('#cloud-config\\nruncmd:\\n  - echo %s %d\\n' % (role, size))
+'''
+
+# runs milldeploy and records its peak resident memory in kilobytes.  On
+# linux a child's ru_maxrss includes the memory of the process it forked
+# from, here the one running moto, so VmHWM is read instead.
+RUN_MILLDEPLOY = '''
+import atexit, resource, sys
+memory_file = sys.argv.pop(1)
+
+def record_peak_memory():
+    try:
+        with open('/proc/self/status') as f:
+            peak = next(int(line.split()[1]) for line in f
+                        if line.startswith('VmHWM:'))
+    except (IOError, StopIteration):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak //= 1024
+    with open(memory_file, 'w') as f:
+        f.write(str(peak))
+
+atexit.register(record_peak_memory)
+import milldeploy
+milldeploy.cli()
+'''
+
+
+class MotoServer:
+    '''A moto server on a free local port, reset between scenarios.'''
+
+    def __init__(self):
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        patch_moto()
+        self.server = ThreadedMotoServer(ip_address='127.0.0.1', port=0,
+                                         verbose=False)
+        self.server.start()
+        self.url = 'http://%s:%d' % self.server.get_host_and_port()
+
+    def reset(self):
+        request = urllib.request.Request(self.url + '/moto-api/reset',
+                                         method='POST')
+        urllib.request.urlopen(request).close()
+
+    def session(self):
+        return boto3.Session(aws_access_key_id='testing',
+                             aws_secret_access_key='testing',
+                             region_name=REGION)
+
+    def stop(self):
+        self.server.stop()
+
+
+def patch_moto():
+    # auto scaling calls milldeploy makes that moto gets wrong or lacks
+    put_scaling_policy = AutoScalingResponse.put_scaling_policy
+
+    def put_scaling_policy_arn(self):
+        # moto keys policies by name alone, where auto scaling keeps one per
+        # group and name, and answers PolicyArn where it answers PolicyARN
+        result = put_scaling_policy(self).result
+        policies = self.autoscaling_backend.policies
+        name = self._get_param("PolicyName")
+        policies[(self._get_param("AutoScalingGroupName"), name)] = \
+            policies.pop(name)
+        return ActionResult(dict(PolicyARN=result["PolicyArn"]))
+
+    def delete_policy(self):
+        self.autoscaling_backend.policies.pop(
+            (self._get_param("AutoScalingGroupName"),
+             self._get_param("PolicyName")), None)
+        return EmptyResult()
+
+    # notification configurations are kept on the backend, which a reset
+    # clears
+    def put_notification_configuration(self):
+        configs = self.autoscaling_backend.__dict__.setdefault(
+            'milldeploy_notifications', collections.OrderedDict())
+        for notification_type in self._get_param("NotificationTypes", []):
+            key = (self._get_param("AutoScalingGroupName"),
+                   self._get_param("TopicARN"), notification_type)
+            configs[key] = dict(AutoScalingGroupName=key[0],
+                                TopicARN=key[1], NotificationType=key[2])
+        return EmptyResult()
+
+    def describe_notification_configurations(self):
+        configs = self.autoscaling_backend.__dict__.get(
+            'milldeploy_notifications', {})
+        names = self._get_param("AutoScalingGroupNames", [])
+        return ActionResult(dict(NotificationConfigurations=[
+            config for key, config in configs.items()
+            if not names or key[0] in names]))
+
+    # moto's backends are not thread safe (two groups launching instances
+    # into one subnet at once fail), so requests are handled one at a time
+    dispatch = DomainDispatcherApplication.__call__
+    lock = threading.Lock()
+
+    def dispatch_serially(self, environ, start_response):
+        with lock:
+            return dispatch(self, environ, start_response)
+
+    DomainDispatcherApplication.__call__ = dispatch_serially
+    AutoScalingResponse.put_scaling_policy = put_scaling_policy_arn
+    AutoScalingResponse.delete_policy = delete_policy
+    AutoScalingResponse.put_notification_configuration = \
+        put_notification_configuration
+    AutoScalingResponse.describe_notification_configurations = \
+        describe_notification_configurations
+
+
+class RunResult:
+    def __init__(self, name, wall_seconds, peak_rss_mb, calls, log_file):
+        self.name = name
+        self.log_file = log_file
+        self.wall_seconds = wall_seconds
+        self.peak_rss_mb = peak_rss_mb
+        self.calls = calls
+
+    def to_dict(self):
+        return dict(wall_seconds=round(self.wall_seconds, 2),
+                    peak_rss_mb=round(self.peak_rss_mb, 1),
+                    calls=collections.OrderedDict(sorted(self.calls.items())))
+
+
+@click.command()
+@click.option('--sizes', default='10,100,1000', show_default=True,
+              help="Comma separated numbers of foreign autoscale groups, "
+                   "launch configs and alarms to seed the account with.")
+@click.option('--call_budget', default=0.0, show_default=True,
+              type=click.FloatRange(min=0),
+              help="Fraction by which a run's AWS calls may exceed the "
+                   "baseline.")
+@click.option('--time_budget', default=0.5, show_default=True,
+              type=click.FloatRange(min=0),
+              help="Fraction by which a run's wall time may exceed the "
+                   "baseline.")
+@click.option('--baseline', default=BASELINE_FILE, show_default=True,
+              type=click.Path(dir_okay=False),
+              help="Baseline to compare with.")
+@click.option('--update_baseline', is_flag=True, default=False,
+              help="Record this run as the baseline instead of comparing.")
+@click.option('--keep', is_flag=True, default=False,
+              help="Keep the work directory with the logs and traces.")
+def benchmark(sizes, call_budget, time_budget, baseline, update_baseline,
+              keep):
+    '''Runs the deploy benchmarks and checks them against the baseline.'''
+    work_dir = tempfile.mkdtemp(prefix='milldeploy-benchmark-')
+    server = MotoServer()
+    try:
+        results = run_scenarios(server, work_dir,
+                                [int(s) for s in sizes.split(',')])
+    finally:
+        server.stop()
+        if keep:
+            click.echo("work directory: %s" % work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report(results)
+    if update_baseline:
+        write_baseline(baseline, results)
+        return
+    if not os.path.exists(baseline):
+        raise click.ClickException("no baseline at %s; run with "
+                                   "--update_baseline first" % baseline)
+    with open(baseline) as f:
+        expected = json.load(f)
+    regressions = check_budgets(results, expected, call_budget, time_budget)
+    for message in regressions:
+        click.echo("REGRESSION %s" % message)
+    if regressions:
+        raise click.ClickException("%d benchmark budgets exceeded" %
+                                   len(regressions))
+    click.echo("all runs within budget")
+
+def run_scenarios(server, work_dir, sizes):
+    mill_init_url = create_mill_init_repo(os.path.join(work_dir, 'mill-init'))
+    env = create_aws_environment(work_dir, server.url)
+    results = []
+    for size in sizes:
+        server.reset()
+        click.echo("seeding an account with %d foreign groups" % size)
+        ami_id = seed_account(server.session(), server.url, size)
+        config_dir = create_config_dir(
+            os.path.join(work_dir, 'config-%d' % size), ami_id)
+        cache_dir = os.path.join(work_dir, 'cache-%d' % size)
+        for command in ('apply', 'plan'):
+            name = '%s-%d' % (command, size)
+            click.echo("running %s" % name)
+            result = run_milldeploy(name, command, config_dir, cache_dir,
+                                    mill_init_url, env, work_dir)
+            if command == 'plan':
+                check_converged(result)
+            results.append(result)
+    return results
+
+def create_mill_init_repo(path):
+    os.makedirs(path)
+    script = os.path.join(path, 'generate-all-cloud-init.py')
+    with open(script, 'w') as f:
+        f.write(GENERATOR)
+    os.chmod(script, 0o755)
+    for args in (['init', '-q'], ['add', '.'],
+                 ['-c', 'user.name=benchmark', '-c',
+                  'user.email=benchmark@example.org', 'commit', '-q', '-m',
+                  'benchmark generator'],
+                 ['tag', MILL_INIT_REF]):
+        subprocess.run(['git'] + args, cwd=path, check=True)
+    return 'file://%s' % path
+
+def create_aws_environment(work_dir, endpoint_url):
+    # a profile of its own, so no real credentials or config are read
+    config_file = os.path.join(work_dir, 'aws-config')
+    with open(config_file, 'w') as f:
+        f.write('[profile %s]\nregion = %s\n' % (PROFILE, REGION))
+    credentials_file = os.path.join(work_dir, 'aws-credentials')
+    with open(credentials_file, 'w') as f:
+        f.write('[%s]\naws_access_key_id = testing\n'
+                'aws_secret_access_key = testing\n' % PROFILE)
+    env = dict((k, v) for k, v in os.environ.items()
+               if not k.startswith('AWS_'))
+    env.update(AWS_CONFIG_FILE=config_file,
+               AWS_SHARED_CREDENTIALS_FILE=credentials_file,
+               AWS_ENDPOINT_URL=endpoint_url,
+               PYTHONPATH=REPO_DIR)
+    return env
+
+def create_config_dir(path, ami_id):
+    shutil.copytree(SAMPLE_CONFIG_DIR, path)
+    props_file = os.path.join(path, 'environment-account.properties')
+    values = dict(PROPERTIES, amiId=ami_id)
+    lines = []
+    with open(props_file) as f:
+        for line in f:
+            key = line.split('=', 1)[0].strip()
+            if key in values and not line.lstrip().startswith('#'):
+                line = '%s=%s\n' % (key, values[key])
+            lines.append(line)
+    with open(props_file, 'w') as f:
+        f.writelines(lines)
+    return path
+
+def seed_account(session, endpoint_url, size):
+    ec2 = session.client('ec2', endpoint_url=endpoint_url)
+    autoscaling = session.client('autoscaling', endpoint_url=endpoint_url)
+    cloudwatch = session.client('cloudwatch', endpoint_url=endpoint_url)
+
+    vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+    ec2.create_tags(Resources=[vpc_id],
+                    Tags=[dict(Key='Name', Value='duracloud')])
+    subnet_ids = []
+    for n, zone in enumerate(['a', 'b', 'c']):
+        subnet_ids.append(ec2.create_subnet(
+            VpcId=vpc_id, CidrBlock='10.0.%d.0/24' % n,
+            AvailabilityZone=REGION + zone)['Subnet']['SubnetId'])
+    ec2.create_security_group(GroupName='mill-vpc',
+                              Description='mill instances', VpcId=vpc_id)
+    ami_id = ec2.describe_images(MaxResults=5)['Images'][0]['ImageId']
+
+    # what other applications in the account leave for the inventory to
+    # page through
+    for n in range(size):
+        name = 'foreign-%04d' % n
+        autoscaling.create_launch_configuration(
+            LaunchConfigurationName=name, ImageId=ami_id,
+            InstanceType='t3.micro')
+        autoscaling.create_auto_scaling_group(
+            AutoScalingGroupName=name, LaunchConfigurationName=name,
+            MinSize=0, MaxSize=1, DesiredCapacity=0,
+            VPCZoneIdentifier=subnet_ids[n % len(subnet_ids)])
+        cloudwatch.put_metric_alarm(
+            AlarmName=name, MetricName='CPUUtilization',
+            Namespace='AWS/EC2', Statistic='Average', Period=300,
+            EvaluationPeriods=1, Threshold=80,
+            ComparisonOperator='GreaterThanThreshold',
+            Dimensions=[dict(Name='AutoScalingGroupName', Value=name)])
+    return ami_id
+
+def run_milldeploy(name, command, config_dir, cache_dir, mill_init_url, env,
+                   work_dir):
+    trace_file = os.path.join(work_dir, '%s-trace.json' % name)
+    log_file = os.path.join(work_dir, '%s.log' % name)
+    memory_file = os.path.join(work_dir, '%s-memory' % name)
+    args = [sys.executable, '-c', RUN_MILLDEPLOY, memory_file,
+            command, '--config_dir', config_dir, '--aws_profile', PROFILE,
+            '--cache_dir', cache_dir, '--mill_init_url', mill_init_url,
+            '--trace_file', trace_file]
+    with open(log_file, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.run(args, env=env, stdout=log,
+                                 stderr=subprocess.STDOUT)
+        wall_seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise click.ClickException("%s failed with exit code %d, see %s" %
+                                   (name, process.returncode, log_file))
+
+    with open(trace_file) as f:
+        events = json.load(f)['traceEvents']
+    calls = collections.Counter(e['name'] for e in events
+                                if e['cat'] == 'aws')
+    with open(memory_file) as f:
+        peak_rss_mb = int(f.read()) / 1024.0
+    return RunResult(name, wall_seconds, peak_rss_mb, calls, log_file)
+
+def check_converged(result):
+    # a plan after apply that still has changes would time work a converged
+    # account does not do
+    with open(result.log_file) as f:
+        output = f.read()
+    if "No changes." not in output:
+        plans = [line for line in output.splitlines()
+                 if line.startswith("Plan:")]
+        raise click.ClickException(
+            "%s did not find the account converged (%s), see %s" %
+            (result.name, plans[-1] if plans else "no plan",
+             result.log_file))
+
+def report(results):
+    click.echo("%-12s %9s %8s %12s" % ("run", "wall s", "calls",
+                                       "peak rss MB"))
+    for result in results:
+        click.echo("%-12s %9.2f %8d %12.1f" %
+                   (result.name, result.wall_seconds,
+                    sum(result.calls.values()), result.peak_rss_mb))
+
+def write_baseline(path, results):
+    baseline = collections.OrderedDict(
+        (result.name, result.to_dict()) for result in results)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+        f.write('\n')
+    click.echo("wrote baseline for %d runs to %s" % (len(results), path))
+
+def check_budgets(results, baseline, call_budget, time_budget):
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            click.echo("%s has no baseline" % result.name)
+            continue
+        calls = sum(result.calls.values())
+        expected_calls = sum(expected['calls'].values())
+        if calls > expected_calls * (1 + call_budget):
+            increases = ["%s %d -> %d" % (op, expected['calls'].get(op, 0),
+                                          count)
+                         for op, count in sorted(result.calls.items())
+                         if count > expected['calls'].get(op, 0)]
+            regressions.append("%s made %d AWS calls, baseline %d (%s)" %
+                               (result.name, calls, expected_calls,
+                                ", ".join(increases)))
+        limit = expected['wall_seconds'] * (1 + time_budget)
+        if result.wall_seconds > limit:
+            regressions.append("%s took %.2fs, baseline %.2fs" %
+                               (result.name, result.wall_seconds,
+                                expected['wall_seconds']))
+    return regressions
+
+
+if __name__ == '__main__':
+    benchmark()
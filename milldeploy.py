@@ -1,9 +1,32 @@
 import click
-from git import Repo
+from git import (GitCommandError, InvalidGitRepositoryError,
+                 NoSuchPathError, Repo)
 import os
 import boto3
+import botocore.config
+import botocore.exceptions
 import shutil
+import collections
+import concurrent.futures
+import json
+import time
+import hashlib
+import tarfile
+import tempfile
+import subprocess
+import base64
+import contextlib
+import csv
+import re
 import datetime
+import email.charset
+import email.mime.multipart
+import email.mime.text
+import gzip
+import heapq
+import math
+import threading
+import yaml
 
 
 class QueueNames():
@@ -22,260 +45,3410 @@ class QueueNames():
     def format(self, prefix, queue_name):
         return "%s-%s" % (prefix, queue_name)
 
+DEFAULT_MILL_INIT_URL = "https://github.com/duracloud/mill-init.git"
+
+DEFAULT_MILL_INIT_REF = "release-2.1.7"
+
+# instance refresh statuses that end a rollout
+INSTANCE_REFRESH_DONE = ['Successful', 'Failed', 'Cancelled',
+                         'RollbackSuccessful', 'RollbackFailed']
+
+# generate-all-cloud-init.py arguments and the config dir files they name
+CLOUD_INIT_INPUTS = [
+    ('-m', 'mill-config.properties'),
+    ('-e', 'environment-account.properties'),
+    ('-bx', 'bit-exclusion-list.txt'),
+    ('-bi', 'bit-inclusion-list.txt'),
+    ('-sx', 'storage-stats-exclusion-list.txt'),
+    ('-si', 'storage-stats-inclusion-list.txt'),
+]
+
+CLOUD_INIT_ROLES = ['sentinel', 'storage-stats-worker', 'audit-worker',
+                    'dup-worker', 'bit-worker', 'bit-report-worker']
+
+# instance type[:weight] pools worker fleets may draw from when they run
+# from launch templates
+DEFAULT_INSTANCE_POOLS = ("m5.large:1,m5a.large:1,m6i.large:1,m6a.large:1,"
+                          "m5.xlarge:2,m5a.xlarge:2,m6i.xlarge:2,m6a.xlarge:2")
+
+SCALING_MODES = ['simple', 'step', 'target-tracking']
+
+# scale up bands added above a fleet's own scale up threshold in step mode,
+# as threshold:adjustment[:warmup]
+DEFAULT_SCALE_UP_STEPS = "10000:3,100000:50%"
+
+WARM_POOL_STATES = ['Stopped', 'Running', 'Hibernated']
+
+# launch hook holding instances until cloud-init has bootstrapped them
+BOOTSTRAP_HOOK = 'mill-bootstrap'
+
+# the looping task producers of mill-config.properties and the queue each
+# one fills
+LOOPING_PRODUCERS = [('dup', QueueNames.DUP_LOW), ('bit', QueueNames.BIT),
+                     ('storagestats', QueueNames.STORAGE_STATS)]
+
+# scheduled actions named with this prefix belong to milldeploy
+SCHEDULED_ACTION_PREFIX = 'looping-'
+
+# ways of fitting the fleets into dbMaxConnections: cap worker fleet max
+# sizes, or lower max-workers on every instance
+DB_BUDGET_STRATEGIES = ['max-size', 'max-workers']
+
+# worker fleets most important first; max-size capping starts at the end
+DEFAULT_DB_BUDGET_PRIORITY = [QueueNames.DUP_HIGH, QueueNames.AUDIT,
+                              QueueNames.DUP_LOW, QueueNames.BIT,
+                              QueueNames.BIT_REPORT, QueueNames.STORAGE_STATS]
+
+# mill's max-workers when mill-config.properties does not set it
+DEFAULT_MAX_WORKERS = 5
+
+# group settings that go out with any other update of the group but are never
+# a reason for one: not every endpoint reports them, or changes them after
+# the group is created (moto only sets CapacityRebalance on create)
+SECONDARY_ATTRIBUTES = ['CapacityRebalance']
+
+COMPARISON_OPERATORS = ['GreaterThanThreshold', 'GreaterThanOrEqualToThreshold',
+                        'LessThanThreshold', 'LessThanOrEqualToThreshold']
+
+FLEET_SPEC_FILE = 'fleet-spec.json'
+
+# config dir templates for baked images: the provisioning run on the
+# builder instance, and the user data instances boot the image with
+BAKE_SCRIPT_FILE = 'bake.sh'
+FIRST_BOOT_FILE = 'first-boot.sh'
+
+# EC2's limit on the user data of an instance, before base64
+USER_DATA_LIMIT = 16384
+
+# compressed user data above this size (bytes) is moved to bootstrapBucket
+DEFAULT_USER_DATA_OFFLOAD_THRESHOLD = 12288
+
+# cloud-init part types by the first line of a user data script
+USER_DATA_TYPES = [('#!', 'x-shellscript'), ('#cloud-config', 'cloud-config'),
+                   ('#cloud-boothook', 'cloud-boothook'),
+                   ('#include', 'x-include-url')]
+
+# user data left in place of a script stored in bootstrapBucket: fetch it
+# with the instance profile, check it against its hash and run it.  A
+# cloud-config is run through every module cloud-init is configured with,
+# apart from the ones running user scripts, which would run this one again
+USER_DATA_FETCH_STUB = '''#!/bin/bash
+set -euo pipefail
+dir=/var/lib/milldeploy
+mkdir -p $dir
+command -v aws >/dev/null || (apt-get update && apt-get install -y awscli)
+aws s3 cp --region %(region)s s3://%(bucket)s/%(key)s $dir/user-data
+echo "%(digest)s  $dir/user-data" | sha256sum -c -
+if [ "$(head -c 2 $dir/user-data)" = "#!" ]; then
+    chmod +x $dir/user-data
+    exec $dir/user-data
+fi
+modules=$(python3 - <<'EOF'
+from cloudinit import stages
+init = stages.Init()
+init.read_cfg()
+for section in ('cloud_init_modules', 'cloud_config_modules',
+                'cloud_final_modules'):
+    for module in init.cfg.get(section) or []:
+        name = module if isinstance(module, str) else module[0]
+        name = name.replace('-', '_')
+        if not name.startswith('scripts_') and name != 'final_message':
+            print(name)
+EOF
+)
+for module in $modules; do
+    cloud-init --file $dir/user-data single --name $module \\
+        --frequency always
+done
+# runcmd only writes its script; scripts_user would have run it
+if [ -f /var/lib/cloud/instance/scripts/runcmd ]; then
+    sh /var/lib/cloud/instance/scripts/runcmd
+fi
+'''
+
+# user data part of warm pool fleets completing the bootstrap hook once
+# cloud-init is done, for each lifecycle state the instance is sent to until
+# it is in service; it runs again on every boot of a warm pool instance
+BOOTSTRAP_HOOK_SCRIPT = '''#!/bin/bash
+cat > /usr/local/bin/milldeploy-complete-bootstrap <<'EOF'
+#!/bin/bash
+cloud-init status --wait >/dev/null || true
+command -v aws >/dev/null || (apt-get update && apt-get install -y awscli)
+imds() {
+    token=$(curl -sf -X PUT -H "X-aws-ec2-metadata-token-ttl-seconds: 300" \\
+        http://169.254.169.254/latest/api/token)
+    curl -sf -H "X-aws-ec2-metadata-token: $token" \\
+        http://169.254.169.254/latest/meta-data/$1
+}
+instance=$(imds instance-id)
+completed=
+while [ "$completed" != "InService" ]; do
+    state=$(imds autoscaling/target-lifecycle-state || true)
+    if [ -n "$state" ] && [ "$state" != "$completed" ]; then
+        aws autoscaling complete-lifecycle-action --region %(region)s \\
+            --auto-scaling-group-name "%(group)s" \\
+            --lifecycle-hook-name %(hook)s --instance-id $instance \\
+            --lifecycle-action-result CONTINUE || true
+        completed=$state
+    fi
+    sleep 10
+done
+EOF
+chmod +x /usr/local/bin/milldeploy-complete-bootstrap
+mkdir -p /var/lib/cloud/scripts/per-boot
+cat > /var/lib/cloud/scripts/per-boot/milldeploy-complete-bootstrap <<'EOF'
+#!/bin/bash
+setsid /usr/local/bin/milldeploy-complete-bootstrap \\
+    >>/var/log/milldeploy-bootstrap.log 2>&1 </dev/null &
+EOF
+chmod +x /var/lib/cloud/scripts/per-boot/milldeploy-complete-bootstrap
+exec /var/lib/cloud/scripts/per-boot/milldeploy-complete-bootstrap
+'''
+
+# image tags a bake is found by
+BAKE_TAGS = ['milldeploy:jar-version', 'milldeploy:puppet-branch',
+             'milldeploy:bake-key', 'milldeploy:base-image',
+             'milldeploy:bake-script']
+
+# how each mill queue differs from the defaults in QueueSpec, in the form
+# the queues section of fleet-spec.json declares them
+DEFAULT_QUEUES = collections.OrderedDict([
+    (QueueNames.AUDIT, dict(visibilityTimeout=300)),
+    (QueueNames.BIT, dict(visibilityTimeout=3600)),
+    (QueueNames.BIT_ERROR, dict()),
+    (QueueNames.BIT_REPORT, dict()),
+    (QueueNames.DUP_LOW, dict()),
+    (QueueNames.DUP_HIGH, dict()),
+    (QueueNames.DEAD_LETTER, dict(deadLetterQueue=None)),
+    (QueueNames.STORAGE_STATS, dict()),
+])
+
+# cloudwatch statistics tune-queues reads for every mill queue
+QUEUE_METRICS = [
+    ('NumberOfMessagesReceived', 'Sum'),
+    ('NumberOfMessagesDeleted', 'Sum'),
+    ('ApproximateNumberOfMessagesNotVisible', 'Average'),
+    ('ApproximateAgeOfOldestMessage', 'Maximum'),
+]
+
+# the fleets mill runs, in the form fleet-spec.json declares them; the
+# file in the config dir overrides any of these values or adds fleets.
+# launchConfigRole prefixes launch config names, so changing it orphans
+# the launch configs already deployed.
+DEFAULT_FLEETS = collections.OrderedDict([
+    ('sentinel', dict(
+        name='Sentinel',
+        launchConfigRole='sentinel',
+        cloudInit='sentinel',
+        instanceType='t3.medium',
+        minSize=1,
+        maxSize=1)),
+    (QueueNames.STORAGE_STATS, dict(
+        name='Storage Stats Worker',
+        launchConfigRole='storage stats worker',
+        cloudInit='storage-stats-worker',
+        queue=QueueNames.STORAGE_STATS,
+        minSize=0,
+        maxSize=1,
+        throughput=1,
+        targetBacklogPerInstance=10,
+        scaleUp=dict(alarmName='non-empty-storage-stats-queue',
+                     description='storage stats queue is not empty',
+                     comparison='GreaterThanThreshold', threshold=0,
+                     period=60, evaluationPeriods=30, cooldown=300),
+        scaleDown=dict(alarmName='empty-storage-stats-queue',
+                       description='storage stats are empty',
+                       comparison='LessThanOrEqualToThreshold', threshold=0,
+                       period=300, evaluationPeriods=6, cooldown=300))),
+    (QueueNames.AUDIT, dict(
+        name='Audit Worker',
+        launchConfigRole='audit worker',
+        cloudInit='audit-worker',
+        queue=QueueNames.AUDIT,
+        volumeSize=60,
+        minSize=1,
+        maxSize=10,
+        throughput=600,
+        targetBacklogPerInstance=1000,
+        scaleUp=dict(alarmName='large-audit-queue',
+                     description='large audit queue',
+                     comparison='GreaterThanThreshold', threshold=1000,
+                     period=300, evaluationPeriods=2, cooldown=900),
+        scaleDown=dict(alarmName='small-audit-queue',
+                       description='small audit queue',
+                       comparison='LessThanOrEqualToThreshold', threshold=500,
+                       period=300, evaluationPeriods=4, cooldown=900))),
+    (QueueNames.DUP_LOW, dict(
+        name='Low Priority Dup Worker',
+        launchConfigRole='low priority dup worker',
+        cloudInit='dup-worker',
+        queue=QueueNames.DUP_LOW,
+        volumeSize=60,
+        minSize=0,
+        maxSize=10,
+        throughput=60,
+        targetBacklogPerInstance=1000,
+        scaleUp=dict(alarmName='large-low-priority-dup-queue',
+                     description='large low priority dup queue',
+                     comparison='GreaterThanOrEqualToThreshold',
+                     threshold=5000, period=300, evaluationPeriods=2,
+                     cooldown=300),
+        scaleDown=dict(alarmName='small-low-priority-dup-queue',
+                       description='small low priority dup queue',
+                       comparison='LessThanOrEqualToThreshold', threshold=100,
+                       period=300, evaluationPeriods=4, cooldown=900))),
+    (QueueNames.DUP_HIGH, dict(
+        name='High Priority Dup Worker',
+        launchConfigRole='high priority dup worker',
+        cloudInit='dup-worker',
+        queue=QueueNames.DUP_HIGH,
+        volumeSize=60,
+        minSize=0,
+        maxSize=10,
+        throughput=60,
+        targetBacklogPerInstance=100,
+        scaleUp=dict(alarmName='large-high-priority-dup-queue',
+                     description='large high priority dup queue',
+                     comparison='GreaterThanThreshold', threshold=500,
+                     period=300, evaluationPeriods=2, cooldown=300,
+                     latencySlo=600),
+        scaleDown=dict(alarmName='small-high-priority-dup-queue',
+                       description='small high priority dup queue',
+                       comparison='LessThanOrEqualToThreshold', threshold=100,
+                       period=300, evaluationPeriods=4, cooldown=900,
+                       latencySlo=600))),
+    (QueueNames.BIT, dict(
+        name='Bit Worker',
+        launchConfigRole='bit worker worker',
+        cloudInit='bit-worker',
+        queue=QueueNames.BIT,
+        volumeSize=60,
+        minSize=0,
+        maxSize=10,
+        throughput=30,
+        targetBacklogPerInstance=100,
+        scaleUp=dict(alarmName='non-empty-bit-queue',
+                     description='non-empty-bit-queue',
+                     comparison='GreaterThanOrEqualToThreshold', threshold=1,
+                     period=300, evaluationPeriods=2, cooldown=300),
+        scaleDown=dict(alarmName='small-bit-queue',
+                       description='small bit queue',
+                       metric='ApproximateNumberOfMessagesNotVisible',
+                       comparison='LessThanThreshold', threshold=1,
+                       period=900, evaluationPeriods=4, cooldown=900))),
+    (QueueNames.BIT_REPORT, dict(
+        name='Bit Report Worker',
+        launchConfigRole='bit report worker',
+        cloudInit='bit-report-worker',
+        queue=QueueNames.BIT_REPORT,
+        volumeSize=20,
+        minSize=0,
+        maxSize=1,
+        throughput=1,
+        targetBacklogPerInstance=1,
+        scaleUp=dict(alarmName='non-empty-bit-report-queue',
+                     description='non-empty-bit-report-queue',
+                     comparison='GreaterThanOrEqualToThreshold', threshold=1,
+                     period=300, evaluationPeriods=1, cooldown=300),
+        scaleDown=dict(alarmName='bit-report-queue-empty',
+                       description='empty bit report queue',
+                       comparison='LessThanOrEqualToThreshold', threshold=0,
+                       period=3600, evaluationPeriods=6, cooldown=300))),
+])
+
+NOTIFICATION_TOPIC = 'mill-notification'
+
+NOTIFICATION_TYPES = [
+    'autoscaling:EC2_INSTANCE_LAUNCH',
+    'autoscaling:EC2_INSTANCE_TERMINATE',
+    'autoscaling:EC2_INSTANCE_LAUNCH_ERROR',
+    'autoscaling:EC2_INSTANCE_TERMINATE_ERROR',
+]
+
+class MillInitCheckout:
+    def __init__(self, path, ref, commit):
+        self.path = path
+        self.ref = ref
+        self.commit = commit
+
+    def script(self, name):
+        return os.path.join(self.path, name)
+
+
+class Environment:
+    '''One mill stack: a config dir, the aws profile (and optionally region)
+    that deploys it and the cloud-init scripts built for it.
+
+    Named after its instancePrefix, and its region when one is given as
+    profile:region.
+    '''
+
+    def __init__(self, config_dir, aws_profile):
+        self.config_dir = config_dir
+        self.aws_profile, _, region = aws_profile.partition(':')
+        self.region = region or None
+        self.props = read_properties_files_into_dict(
+            os.path.join(config_dir, 'environment-account.properties'))
+        self.mill_props = read_properties_files_into_dict(
+            os.path.join(config_dir, 'mill-config.properties'))
+        self.name = self.props["instancePrefix"]
+        if self.region:
+            self.name = "%s-%s" % (self.name, self.region)
+        self.fleets = load_fleet_specs(config_dir)
+        self.queue_specs = load_queue_specs(config_dir)
+        # the config dir cloud-init is generated from, a staged copy when
+        # the connection budget lowers max-workers
+        self.cloud_init_config_dir = config_dir
+        self.connection_budget = None
+        self.cloud_init = None
+
+
+class EnvironmentOutcome:
+    def __init__(self, ok, status, seconds):
+        self.ok = ok
+        self.status = status
+        self.seconds = seconds
+
+
+class AwsClients:
+    '''The AWS clients of a run, sharing one tuned botocore config.
+
+    Adaptive retries rate limit each client once AWS starts throttling it;
+    calls, retries and throttled attempts are counted per service.
+    '''
+
+    SERVICES = ['ec2', 'sns', 'sqs', 'autoscaling', 'cloudwatch', 's3']
+
+    THROTTLE_CODES = set(['Throttling', 'ThrottlingException',
+                          'ThrottledException', 'RequestThrottled',
+                          'RequestThrottledException', 'RequestLimitExceeded',
+                          'TooManyRequestsException', 'SlowDown'])
+
+    # request parameters naming the resource a call acts on
+    RESOURCE_PARAMS = ['AutoScalingGroupName', 'LaunchConfigurationName',
+                       'LaunchTemplateName', 'PolicyName', 'AlarmName',
+                       'QueueName', 'QueueUrl', 'TopicArn', 'Key']
+
+    def __init__(self, session, max_pool_connections=10, max_attempts=10,
+                 connect_timeout=10, read_timeout=60, tracer=None,
+                 endpoint_url=None):
+        config = botocore.config.Config(
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries=dict(mode='adaptive', total_max_attempts=max_attempts))
+        self.stats = collections.OrderedDict()
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        for service in self.SERVICES:
+            client = session.client(service, config=config,
+                                    endpoint_url=endpoint_url)
+            self.stats[service] = collections.Counter()
+            client.meta.events.register(
+                'before-parameter-build', self._before_call)
+            client.meta.events.register(
+                'after-call', lambda service=service, **kwargs:
+                    self._after_call(service, **kwargs))
+            client.meta.events.register(
+                'after-call-error', lambda service=service, **kwargs:
+                    self._after_call_error(service, **kwargs))
+            client.meta.events.register(
+                'needs-retry', lambda service=service, **kwargs:
+                    self._needs_retry(service, **kwargs))
+            setattr(self, service, client)
+
+    def _before_call(self, params=None, model=None, context=None, **kwargs):
+        if context is None:
+            return
+        context['milldeploy_start'] = time.perf_counter()
+        context['milldeploy_operation'] = model.name
+        context['milldeploy_resource'] = next(
+            (str(params[k]) for k in self.RESOURCE_PARAMS
+             if k in (params or {})), None)
+
+    def _after_call(self, service, http_response=None, parsed=None,
+                    context=None, **kwargs):
+        metadata = (parsed or {}).get('ResponseMetadata', {})
+        retries = metadata.get('RetryAttempts', 0)
+        with self._lock:
+            self.stats[service]['calls'] += 1
+            self.stats[service]['retries'] += retries
+        content = getattr(http_response, 'content', None) or b''
+        self._trace(service, context, retries=retries, bytes=len(content),
+                    status=metadata.get('HTTPStatusCode'))
+
+    def _after_call_error(self, service, exception=None, context=None,
+                          **kwargs):
+        self._trace(service, context, error=type(exception).__name__)
+
+    def _trace(self, service, context, **args):
+        if self.tracer is None or 'milldeploy_start' not in (context or {}):
+            return
+        args['resource'] = context['milldeploy_resource']
+        self.tracer.record(
+            'aws', "%s.%s" % (service, context['milldeploy_operation']),
+            context['milldeploy_start'], time.perf_counter(), args)
+
+    def _needs_retry(self, service, response=None, **kwargs):
+        # called after every attempt; never decides on the retry itself
+        if response is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in self.THROTTLE_CODES:
+            with self._lock:
+                self.stats[service]['throttled'] += 1
+        return None
+
+    def report(self):
+        for service, counts in self.stats.items():
+            if counts['calls']:
+                click.echo("aws %s: %d calls, %d retries, %d throttled" %
+                           (service, counts['calls'], counts['retries'],
+                            counts['throttled']))
+
+class Tracer:
+    '''Timed spans of a deploy: AWS calls, the mill-init checkout, cloud-init
+    generation and deploy steps.
+
+    Spans may be recorded from any thread.  At the end of a run they are
+    summarized per operation and may be exported as a Chrome trace, which
+    chrome://tracing and Perfetto load directly.
+    '''
+
+    def __init__(self):
+        self.spans = []
+        self.origin = time.perf_counter()
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, category, name, **args):
+        start = time.perf_counter()
+        try:
+            yield args
+        except Exception as e:
+            args['error'] = type(e).__name__
+            raise
+        finally:
+            self.record(category, name, start, time.perf_counter(), args)
+
+    def record(self, category, name, start, end, args):
+        with self._lock:
+            thread = self._threads.setdefault(threading.get_ident(),
+                                              len(self._threads) + 1)
+            self.spans.append((category, name, start - self.origin,
+                               end - start, thread, args))
+
+    def report(self):
+        if not self.spans:
+            return
+        durations = collections.OrderedDict()
+        retries = collections.Counter()
+        for category, name, _, duration, _, args in sorted(
+                self.spans, key=lambda span: span[:2]):
+            durations.setdefault((category, name), []).append(duration)
+            retries[(category, name)] += args.get('retries', 0)
+        click.echo("%-52s %6s %8s %9s %9s" %
+                   ("operation", "count", "retries", "total ms", "p95 ms"))
+        for (category, name), values in durations.items():
+            click.echo("%-52s %6d %8d %9.0f %9.0f" %
+                       ("%s %s" % (category, name), len(values),
+                        retries[(category, name)], sum(values) * 1000,
+                        get_percentile(values, 95) * 1000))
+
+    def export(self, path):
+        events = [dict(name=name, cat=category, ph='X', pid=1, tid=thread,
+                       ts=round(start * 1e6), dur=round(duration * 1e6),
+                       args=args)
+                  for category, name, start, duration, thread, args
+                  in self.spans]
+        write_json_atomically(path, dict(traceEvents=events,
+                                         displayTimeUnit='ms'),
+                              sort_keys=False)
+        click.echo("wrote %d trace spans to %s" % (len(events), path))
+
 class AutoScaleGroupConfig:
     def __init__(self, autoscale_group, launch_config, scale_up_policy,
-                 scale_up_alarm, scale_down_policy, scale_down_alarm):
+                 scale_up_alarm, scale_down_policy, scale_down_alarm,
+                 role=None):
         self.autoscale_group = autoscale_group
         self.launch_config = launch_config
+        self.launch_template = None
+        self.role = role
+        self.enabled_metrics = []
         self.scale_up_policy = scale_up_policy
         self.scale_up_alarm = scale_up_alarm
         self.scale_down_policy = scale_down_policy
         self.scale_down_alarm = scale_down_alarm
+        self.scale_up_steps = []
+        self.warm_pool = None
+        self.lifecycle_hooks = []
+        self.user_data_upload = None
+        self.scheduled_actions = []
 
+    def scaling_policies(self):
+        # (policy, alarm) pairs in the order they should be applied
+        pairs = [(self.scale_down_policy, self.scale_down_alarm),
+                 (self.scale_up_policy, self.scale_up_alarm)]
+        pairs.extend(self.scale_up_steps)
+        return [(p, a) for p, a in pairs if p is not None]
 
-@click.command()
-@click.option('--config_dir', required=True,help="Directory of mill " \
-                                              "configuration files")
-@click.option('--aws_profile', required=True, help="The aws profile "
-                                                   "configured in your "
-                                                   "environment that you "
-                                                   "would like to use." )
-def cli(aws_profile, config_dir):
-    '''Deploys mill in a production environment.'''
 
-    click.echo('MillDeploy')
-    click.echo('AWS Profile: %s' % aws_profile)
-    click.echo('Config Directory: %s' % config_dir)
+class FleetSimulation:
+    '''Replays queue traffic through one fleet's scaling policies.
 
-    # validate existence of version in maven central
+    Between events the backlog drains at the combined throughput of the
+    in service instances; alarms see the average backlog of each period.
+    '''
+
+    TICK = 60
+
+    def __init__(self, group, throughput, boot_time, hourly_price):
+        asg = group.autoscale_group
+        self.name = asg["AutoScalingGroupName"]
+        self.min_size = asg["MinSize"]
+        self.max_size = asg["MaxSize"]
+        self.rate = throughput / 60.0
+        self.boot_time = boot_time
+        self.hourly_price = hourly_price
+        self.alarms = [(p, a, collections.deque(maxlen=a["EvaluationPeriods"]))
+                       for p, a in group.scaling_policies() if a is not None]
+        self.target_tracking = [p for p, a in group.scaling_policies()
+                                if p["PolicyType"] == 'TargetTrackingScaling']
+        self.samples = collections.deque(maxlen=60)
+        self.events = []
+        self.pushed = 0
+        self.now = 0
+        self.backlog = 0.0
+        self.area = 0.0
+        self.cooldown_until = 0
+        # launch times; the minimum size is running before the trace starts
+        self.instances = [float('-inf')] * self.min_size
+        self.messages = 0
+        self.peak_backlog = 0
+        self.max_instances = self.min_size
+        self.instance_seconds = 0.0
+        self.empty_since = 0
+
+    def run(self, arrivals, drain_limit):
+        for t, count in arrivals:
+            self.push(t, 0, count)
+        last_arrival = max([t for t, count in arrivals] + [0])
+        self.push(0, 1, None)
+        while self.events:
+            t, order, _, count = heapq.heappop(self.events)
+            self.advance(t)
+            if order == 0:
+                self.messages += count
+                self.backlog += count
+                self.peak_backlog = max(self.peak_backlog, self.backlog)
+                self.empty_since = None
+            elif order == 1:
+                self.tick()
+                done = (self.backlog == 0
+                        and len(self.instances) <= self.min_size)
+                if t >= last_arrival + drain_limit or \
+                        (t >= last_arrival and done):
+                    break
+                self.push(t + self.TICK, 1, None)
+        drain_time = None
+        if self.empty_since is not None:
+            drain_time = max(self.empty_since - last_arrival, 0)
+        return SimulationResult(self, drain_time)
+
+    def push(self, t, order, count):
+        # arrivals sort before the tick at the same time, instances
+        # becoming ready only split the drain
+        self.pushed += 1
+        heapq.heappush(self.events, (t, order, self.pushed, count))
+
+    def in_service(self, t, warmup=None):
+        if warmup is None:
+            warmup = self.boot_time
+        return len([l for l in self.instances if l + warmup <= t])
+
+    def advance(self, t):
+        dt = t - self.now
+        if dt <= 0:
+            return
+        self.instance_seconds += len(self.instances) * dt
+        rate = self.in_service(self.now) * self.rate
+        if self.backlog > 0 and rate * dt >= self.backlog:
+            drained = self.backlog / rate
+            self.area += self.backlog * drained / 2
+            self.backlog = 0.0
+            self.empty_since = self.now + drained
+        elif self.backlog > 0:
+            self.area += self.backlog * dt - rate * dt * dt / 2
+            self.backlog -= rate * dt
+        self.now = t
+
+    def tick(self):
+        t = self.now
+        self.samples.append(self.area / self.TICK)
+        self.area = 0.0
+
+        step_targets = []
+        for policy, alarm, datapoints in self.alarms:
+            # only the queue depth is simulated, not the age of its messages
+            period = get_alarm_period(alarm)
+            if t == 0 or t % period:
+                continue
+            samples = list(self.samples)[-(period // self.TICK):]
+            value = sum(samples) / len(samples)
+            datapoints.append(value)
+            # auto scaling actions repeat every period the alarm stays in
+            # alarm
+            if len(datapoints) < datapoints.maxlen or not all(
+                    compare_to_threshold(alarm, v) for v in datapoints):
+                continue
+            if policy["PolicyType"] == 'StepScaling':
+                step_targets.append(self.step_target(
+                    policy, value - alarm["Threshold"], t))
+            elif t >= self.cooldown_until:
+                self.set_desired(len(self.instances) +
+                                 policy["ScalingAdjustment"], t)
+                self.cooldown_until = t + policy.get("Cooldown", 300)
+        if step_targets and max(step_targets) > len(self.instances):
+            self.set_desired(max(step_targets), t)
+
+        for policy in self.target_tracking:
+            self.track_target(policy, t)
+
+    def step_target(self, policy, breach, t):
+        adjustment = 0
+        for step in policy["StepAdjustments"]:
+            lower = step.get("MetricIntervalLowerBound", float('-inf'))
+            upper = step.get("MetricIntervalUpperBound", float('inf'))
+            if lower <= breach < upper:
+                adjustment = step["ScalingAdjustment"]
+        # instances still warming up do not count towards the capacity a
+        # step is added to
+        capacity = self.in_service(t, policy.get("EstimatedInstanceWarmup",
+                                                 self.boot_time))
+        if policy["AdjustmentType"] == 'PercentChangeInCapacity':
+            change = capacity * adjustment / 100.0
+            change = int(change) if abs(change) >= 1 else \
+                int(math.copysign(1, change)) if change else 0
+            if abs(change) < policy.get("MinAdjustmentMagnitude", 0):
+                change = int(math.copysign(policy["MinAdjustmentMagnitude"],
+                                           adjustment))
+            adjustment = change
+        return capacity + adjustment
+
+    def track_target(self, policy, t):
+        # target tracking's own alarms: scale out after 3 one minute
+        # datapoints over the target, in after 15 below 90% of it
+        target = policy["TargetTrackingConfiguration"]["TargetValue"]
+        backlog = self.samples[-1]
+        values = [s / max(self.in_service(t), 1)
+                  for s in list(self.samples)[-15:]]
+        desired = int(math.ceil(backlog / target))
+        if len(values) >= 3 and all(v > target for v in values[-3:]):
+            if desired > len(self.instances):
+                self.set_desired(desired, t)
+        elif len(values) == 15 and all(v < target * 0.9 for v in values):
+            if desired < len(self.instances):
+                self.set_desired(desired, t)
+
+    def set_desired(self, desired, t):
+        desired = max(self.min_size, min(self.max_size, desired))
+        while len(self.instances) < desired:
+            self.instances.append(t)
+            self.push(t + self.boot_time, 2, None)
+        # scale in terminates the newest instances first
+        self.instances.sort()
+        del self.instances[desired:]
+        self.max_instances = max(self.max_instances, len(self.instances))
+
+
+class SimulationResult:
+    def __init__(self, fleet, drain_time):
+        self.name = fleet.name
+        self.messages = fleet.messages
+        self.peak_backlog = fleet.peak_backlog
+        self.drain_time = drain_time
+        self.max_instances = fleet.max_instances
+        self.instance_hours = fleet.instance_seconds / 3600.0
+        self.cost = self.instance_hours * fleet.hourly_price
+
+
+class FleetSpec:
+    '''An autoscale group as declared in fleet-spec.json.'''
+
+    __slots__ = ('role', 'name', 'launch_config_role', 'cloud_init', 'queue',
+                 'instance_type', 'spot_price', 'volume_size', 'min_size',
+                 'max_size', 'scale_up', 'scale_down', 'scaling_mode',
+                 'scale_up_steps', 'target_backlog_per_instance',
+                 'instance_warmup', 'instance_pools',
+                 'on_demand_base_capacity', 'throughput', 'warm_pool')
+
+    def __init__(self, role, values):
+        spec = SpecValues(values, "fleets.%s" % role)
+        self.role = role
+        self.name = spec.get('name', str)
+        self.launch_config_role = spec.get('launchConfigRole', str, role)
+        self.cloud_init = spec.get('cloudInit', str, choices=CLOUD_INIT_ROLES)
+        self.queue = spec.get('queue', str, None, choices=QueueNames.ALL)
+        self.instance_type = spec.get('instanceType', str, 'm5.large')
+        # workers run on spot instances, the sentinel on demand
+        self.spot_price = spec.get('spotPrice', str,
+                                   '0.08' if self.queue else None)
+        self.volume_size = spec.get('volumeSize', int, None, minimum=1)
+        self.min_size = spec.get('minSize', int, minimum=0)
+        self.max_size = spec.get('maxSize', int, minimum=self.min_size)
+        self.scale_up = None
+        self.scale_down = None
+        if self.queue is not None:
+            self.scale_up = AlarmSpec(spec.get('scaleUp', dict),
+                                      "%s.scaleUp" % spec.path)
+            self.scale_down = AlarmSpec(spec.get('scaleDown', dict),
+                                        "%s.scaleDown" % spec.path)
+        self.scaling_mode = spec.get('scalingMode', str, 'simple',
+                                     choices=SCALING_MODES)
+        self.scale_up_steps = parse_scale_up_steps(
+            spec.get('scaleUpSteps', list, None), "%s.scaleUpSteps" %
+            spec.path, self.scale_up)
+        self.target_backlog_per_instance = spec.get(
+            'targetBacklogPerInstance', float, 100.0, minimum=0)
+        self.instance_warmup = spec.get('instanceWarmup', int, 300, minimum=0)
+        self.instance_pools = parse_instance_pools(
+            spec.get('instancePools', list, DEFAULT_INSTANCE_POOLS.split(",")),
+            "%s.instancePools" % spec.path)
+        self.on_demand_base_capacity = spec.get('onDemandBaseCapacity', int,
+                                                0, minimum=0)
+        self.throughput = spec.get('throughput', float, None, minimum=0)
+        self.warm_pool = None
+        warm_pool = spec.get('warmPool', dict, None)
+        if warm_pool is not None:
+            # warm pools cannot hold spot instances
+            if self.spot_price is not None:
+                spec.fail('warmPool', "cannot be used with spot instances; "
+                          "set spotPrice to null")
+            self.warm_pool = WarmPoolSpec(warm_pool, "%s.warmPool" %
+                                          spec.path)
+        spec.check_unused()
+
+
+class AlarmSpec:
+    '''A queue size alarm and the +1/-1 simple policy it triggers.
+
+    With latencySlo the alarm also sees the age of the queue's oldest
+    message, scaled so that an age of latencySlo seconds counts as a queue
+    of threshold messages.
+    '''
+
+    __slots__ = ('alarm_name', 'description', 'metric', 'comparison',
+                 'threshold', 'period', 'evaluation_periods', 'cooldown',
+                 'latency_slo')
+
+    def __init__(self, values, path):
+        spec = SpecValues(values, path)
+        self.alarm_name = spec.get('alarmName', str)
+        self.description = spec.get('description', str, self.alarm_name)
+        self.metric = spec.get('metric', str,
+                               'ApproximateNumberOfMessagesVisible')
+        self.comparison = spec.get('comparison', str,
+                                   choices=COMPARISON_OPERATORS)
+        self.threshold = spec.get('threshold', int, minimum=0)
+        self.period = spec.get('period', int, minimum=10)
+        self.evaluation_periods = spec.get('evaluationPeriods', int,
+                                           minimum=1)
+        self.cooldown = spec.get('cooldown', int, minimum=0)
+        self.latency_slo = spec.get('latencySlo', int, None, minimum=1)
+        if self.latency_slo is not None and self.threshold < 1:
+            spec.fail('latencySlo', "needs a threshold of at least 1")
+        spec.check_unused()
+
+
+class WarmPoolSpec:
+    '''Instances a worker fleet keeps bootstrapped ahead of scale out.'''
+
+    __slots__ = ('pool_state', 'min_size', 'max_prepared_capacity',
+                 'reuse_on_scale_in', 'bootstrap_timeout')
+
+    def __init__(self, values, path):
+        spec = SpecValues(values, path)
+        self.pool_state = spec.get('poolState', str, 'Stopped',
+                                   choices=WARM_POOL_STATES)
+        self.min_size = spec.get('minSize', int, 0, minimum=0)
+        self.max_prepared_capacity = spec.get('maxPreparedCapacity', int,
+                                              None, minimum=self.min_size)
+        self.reuse_on_scale_in = spec.get('reuseOnScaleIn', bool, False)
+        # seconds the launch hook holds a new instance for cloud-init
+        self.bootstrap_timeout = spec.get('bootstrapTimeout', int, 1800,
+                                          minimum=30, maximum=7200)
+        spec.check_unused()
+
+
+class QueueSpec:
+    '''The SQS attributes of a mill queue as declared in fleet-spec.json.'''
+
+    __slots__ = ('queue', 'visibility_timeout', 'wait_time', 'retention',
+                 'dead_letter_queue', 'max_receive_count')
+
+    def __init__(self, queue, values):
+        spec = SpecValues(values, "queues.%s" % queue)
+        self.queue = queue
+        self.visibility_timeout = spec.get('visibilityTimeout', int, 1200,
+                                           minimum=0, maximum=43200)
+        # long polling, so idle workers do not spin on empty receives
+        self.wait_time = spec.get('waitTimeSeconds', int, 20, minimum=0,
+                                  maximum=20)
+        self.retention = spec.get('retentionPeriod', int, 1209600,
+                                  minimum=60, maximum=1209600)
+        self.dead_letter_queue = spec.get(
+            'deadLetterQueue', str, QueueNames.DEAD_LETTER,
+            choices=[q for q in QueueNames.ALL if q != queue])
+        self.max_receive_count = spec.get('maxReceiveCount', int, 10,
+                                          minimum=1, maximum=1000)
+        spec.check_unused()
+
+
+class QueueConfig:
+    def __init__(self, attributes, dead_letter_queue=None,
+                 max_receive_count=None):
+        self.attributes = attributes
+        self.dead_letter_queue = dead_letter_queue
+        self.max_receive_count = max_receive_count
+
+    def redrive_attributes(self, dead_letter_arn):
+        attributes = dict(self.attributes)
+        attributes["RedrivePolicy"] = json.dumps(dict(
+            deadLetterTargetArn=dead_letter_arn,
+            maxReceiveCount=self.max_receive_count))
+        return attributes
+
+
+class SpecValues:
+    '''Typed, checked access to one object of fleet-spec.json.'''
+
+    REQUIRED = object()
+
+    def __init__(self, values, path):
+        self.values = values
+        self.path = path
+        self.used = set()
+
+    def get(self, key, kind, default=REQUIRED, minimum=None, maximum=None,
+            choices=None):
+        self.used.add(key)
+        if key not in self.values:
+            if default is self.REQUIRED:
+                self.fail(key, "is required")
+            return default
+        value = self.values[key]
+        # null turns off an optional setting
+        if value is None and default is not self.REQUIRED:
+            return None
+        if kind is float and isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, kind) or (isinstance(value, bool)
+                                           and kind is not bool):
+            self.fail(key, "must be a %s" % {
+                str: "string", int: "whole number", float: "number",
+                dict: "object", list: "list", bool: "boolean"}[kind])
+        if minimum is not None and value < minimum:
+            self.fail(key, "must be at least %s" % minimum)
+        if maximum is not None and value > maximum:
+            self.fail(key, "must be at most %s" % maximum)
+        if choices is not None and value not in choices:
+            self.fail(key, "must be one of %s" % ", ".join(choices))
+        return value
+
+    def check_unused(self):
+        for key in self.values:
+            if key not in self.used:
+                self.fail(key, "is not a known setting")
+
+    def fail(self, key, message):
+        name = "%s.%s" % (self.path, key) if self.path else key
+        raise click.ClickException("%s: %s %s" % (FLEET_SPEC_FILE, name,
+                                                  message))
+
+
+class BakePlan:
+    '''A mill AMI keyed by jar version, puppet branch and provisioning.
+
+    image_id is set when an image for the key already exists.
+    '''
+
+    def __init__(self, name, key, base_image_id, instance_type, user_data,
+                 tags, image_id=None):
+        self.name = name
+        self.key = key
+        self.base_image_id = base_image_id
+        self.instance_type = instance_type
+        self.user_data = user_data
+        self.tags = tags
+        self.image_id = image_id
+
+
+class ConnectionBudget:
+    '''The connections the fleets can open to the mill database server at
+    their max sizes, against the dbMaxConnections the server allows.
+
+    max_sizes (by role) and max_workers are the values that fit the limit;
+    original_max_sizes and original_max_workers are the configured ones.
+    Only the roles in worker_roles run max-workers worker threads.
+    '''
+
+    def __init__(self, limit, reserved, strategy, max_workers, databases,
+                 per_worker, extra, max_sizes, worker_roles):
+        self.limit = limit
+        self.worker_roles = set(worker_roles)
+        self.reserved = reserved
+        self.strategy = strategy
+        self.original_max_workers = max_workers
+        self.max_workers = max_workers
+        self.databases = databases
+        self.per_worker = per_worker
+        self.extra = extra
+        self.original_max_sizes = collections.OrderedDict(max_sizes)
+        self.max_sizes = collections.OrderedDict(max_sizes)
+
+    def per_instance(self, role, max_workers=None):
+        if max_workers is None:
+            max_workers = self.max_workers
+        workers = max_workers if role in self.worker_roles else 0
+        return self.databases * (workers * self.per_worker +
+                                 self.extra[role])
+
+    def fan_in(self, max_sizes=None, max_workers=None):
+        if max_sizes is None:
+            max_sizes = self.max_sizes
+        return self.reserved + sum(
+            size * self.per_instance(role, max_workers)
+            for role, size in max_sizes.items())
+
+    def original_fan_in(self):
+        return self.fan_in(self.original_max_sizes, self.original_max_workers)
+
+
+class VpcTopology:
+    '''The duracloud VPC, its subnets and the mill-vpc security group.'''
+
+    def __init__(self, vpc_id, subnet_ids, availability_zones,
+                 security_group_id):
+        self.vpc_id = vpc_id
+        self.subnet_ids = subnet_ids
+        self.availability_zones = availability_zones
+        self.security_group_id = security_group_id
+
+    def subnet_ids_as_string(self):
+        return ",".join(self.subnet_ids)
+
+    def to_dict(self):
+        return dict(vpc_id=self.vpc_id,
+                    subnet_ids=self.subnet_ids,
+                    availability_zones=self.availability_zones,
+                    security_group_id=self.security_group_id)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["vpc_id"], d["subnet_ids"], d["availability_zones"],
+                   d["security_group_id"])
+
+
+class AutoScaleInventory:
+    '''Name-keyed index of the autoscaling resources in the account.
+
+    Groups, launch configurations, scaling policies and alarms are each
+    fetched once per run with full pagination so that per-group deploy
+    steps can look things up without issuing their own describe calls.
+    '''
+
+    def __init__(self, groups, launch_configs, policies, alarms,
+                 notifications, launch_templates, scheduled_actions=()):
+        self.groups = dict((g["AutoScalingGroupName"], g) for g in groups)
+        self.launch_configs = dict((lc["LaunchConfigurationName"], lc)
+                                   for lc in launch_configs)
+        self.policies = dict(((p["AutoScalingGroupName"], p["PolicyName"]), p)
+                             for p in policies)
+        self.alarms = dict((a["AlarmName"], a) for a in alarms)
+        self.notifications = collections.defaultdict(list)
+        for n in notifications:
+            self.notifications[n["AutoScalingGroupName"]].append(n)
+        self.launch_templates = dict((lt["LaunchTemplateName"], lt)
+                                     for lt in launch_templates)
+        self.lifecycle_hooks = {}
+        self.user_data_objects = set()
+        self.scheduled_actions = dict(
+            ((a["AutoScalingGroupName"], a["ScheduledActionName"]), a)
+            for a in scheduled_actions)
+
+    @classmethod
+    def load(cls, autoscale_client, cloudwatch_client, ec2_client):
+        inventory = cls(
+            paginate(autoscale_client, 'describe_auto_scaling_groups',
+                     'AutoScalingGroups'),
+            paginate(autoscale_client, 'describe_launch_configurations',
+                     'LaunchConfigurations'),
+            paginate(autoscale_client, 'describe_policies',
+                     'ScalingPolicies'),
+            paginate(cloudwatch_client, 'describe_alarms', 'MetricAlarms'),
+            paginate(autoscale_client, 'describe_notification_configurations',
+                     'NotificationConfigurations'),
+            paginate(ec2_client, 'describe_launch_templates',
+                     'LaunchTemplates'),
+            paginate(autoscale_client, 'describe_scheduled_actions',
+                     'ScheduledUpdateGroupActions'))
+        click.echo("inventory: %d autoscale groups, %d launch configs, "
+                   "%d launch templates, %d scaling policies, %d alarms" %
+                   (len(inventory.groups), len(inventory.launch_configs),
+                    len(inventory.launch_templates), len(inventory.policies),
+                    len(inventory.alarms)))
+        return inventory
+
+    def load_lifecycle_hooks(self, autoscale_client, group_names):
+        # there is no account wide listing, so only the groups that have or
+        # will have a warm pool are described
+        for name in group_names:
+            if name not in self.groups:
+                continue
+            response = autoscale_client.describe_lifecycle_hooks(
+                AutoScalingGroupName=name)
+            for hook in response["LifecycleHooks"]:
+                self.lifecycle_hooks[(name, hook["LifecycleHookName"])] = hook
+
+    def load_user_data_objects(self, s3_client, uploads):
+        for bucket, key in set((u["Bucket"], u["Key"]) for u in uploads):
+            try:
+                s3_client.head_object(Bucket=bucket, Key=key)
+            except botocore.exceptions.ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                continue
+            self.user_data_objects.add((bucket, key))
+
+    def group_exists(self, name):
+        return name in self.groups
+
+    def get_group(self, name):
+        return self.groups.get(name)
+
+    def launch_config_exists(self, name):
+        return name in self.launch_configs
+
+    def get_launch_config(self, name):
+        return self.launch_configs.get(name)
+
+    def launch_template_exists(self, name):
+        return name in self.launch_templates
+
+    def get_policy(self, autoscale_group_name, policy_name):
+        return self.policies.get((autoscale_group_name, policy_name))
+
+    def get_policies(self, autoscale_group_name):
+        return [p for (group_name, name), p in self.policies.items()
+                if group_name == autoscale_group_name]
+
+    def get_alarm(self, name):
+        return self.alarms.get(name)
+
+    def user_data_object_exists(self, bucket, key):
+        return (bucket, key) in self.user_data_objects
+
+    def get_warm_pool(self, autoscale_group_name):
+        return self.groups.get(autoscale_group_name,
+                               {}).get("WarmPoolConfiguration")
+
+    def get_lifecycle_hook(self, autoscale_group_name, hook_name):
+        return self.lifecycle_hooks.get((autoscale_group_name, hook_name))
+
+    def get_scheduled_actions(self, autoscale_group_name):
+        return [a for (group_name, name), a in self.scheduled_actions.items()
+                if group_name == autoscale_group_name]
+
+    def get_notification_types(self, autoscale_group_name, topic_name):
+        return [n["NotificationType"]
+                for n in self.notifications.get(autoscale_group_name, [])
+                if n["TopicARN"].endswith(":" + topic_name)]
+
+
+class QueueInventory:
+    '''Urls and attributes of the mill queues that already exist.'''
+
+    def __init__(self, urls, attributes):
+        self.urls = urls
+        self.attributes = attributes
+
+    @classmethod
+    def load(cls, sqs_client, env_prefix, queue_names):
+        urls = {}
+        for url in paginate(sqs_client, 'list_queues', 'QueueUrls',
+                            QueueNamePrefix=env_prefix):
+            urls[url.rsplit('/', 1)[-1]] = url
+
+        # sqs has no read across queues, so the existing queues are read
+        # together, one call each
+        existing = [qname for qname in queue_names if qname in urls]
+        attributes = {}
+        if existing:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(existing)) as executor:
+                responses = executor.map(
+                    lambda qname: sqs_client.get_queue_attributes(
+                        QueueUrl=urls[qname], AttributeNames=['All']),
+                    existing)
+                for qname, response in zip(existing, responses):
+                    attributes[qname] = response.get("Attributes", {})
+        click.echo("inventory: %d of %d mill queues exist" %
+                   (len(attributes), len(queue_names)))
+        return cls(urls, attributes)
+
+    def get_url(self, qname):
+        return self.urls.get(qname)
+
+    def get_attributes(self, qname):
+        return self.attributes.get(qname)
+
+
+class Change:
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+
+    SYMBOLS = {CREATE: "+", UPDATE: "~", DELETE: "-"}
+
+    def __init__(self, action, resource_type, name, fn, deps=(), diffs=None):
+        self.node = "%s:%s" % (resource_type, name)
+        self.action = action
+        self.resource_type = resource_type
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.diffs = diffs or []
+
+
+class DeployPlan:
+    '''The changes needed to take the live state to the desired state.
+
+    Support steps (such as looking up the notification topic) are only
+    scheduled when a change depends on them and are not reported.
+    '''
+
+    def __init__(self):
+        self.changes = []
+        self.support_steps = []
+        self.unchanged_resources = []
+        self._nodes = set()
+
+    def add(self, change):
+        self._nodes.add(change.node)
+        self.changes.append(change)
+        return change.node
+
+    def create(self, resource_type, name, fn, deps=()):
+        return self.add(Change(Change.CREATE, resource_type, name, fn, deps))
+
+    def update(self, resource_type, name, fn, deps=(), diffs=None):
+        return self.add(Change(Change.UPDATE, resource_type, name, fn, deps,
+                               diffs))
+
+    def delete(self, resource_type, name, fn, deps=()):
+        return self.add(Change(Change.DELETE, resource_type, name, fn, deps))
+
+    def support(self, resource_type, name, fn, deps=()):
+        step = Change(None, resource_type, name, fn, deps)
+        self._nodes.add(step.node)
+        self.support_steps.append(step)
+        return step.node
+
+    def unchanged(self, resource_type, name):
+        self.unchanged_resources.append("%s:%s" % (resource_type, name))
+
+    def has(self, node):
+        return node in self._nodes
+
+    def report(self):
+        for change in self.changes:
+            click.echo("%s %s %s" % (Change.SYMBOLS[change.action],
+                                     change.resource_type, change.name))
+            for key, old, new in change.diffs:
+                click.echo("    %s: %s -> %s" % (key, old, new))
+
+        counts = collections.Counter(c.action for c in self.changes)
+        if not self.changes:
+            click.echo("No changes. %d resources are up to date." %
+                       len(self.unchanged_resources))
+        else:
+            click.echo("Plan: %d to create, %d to update, %d to delete, "
+                       "%d unchanged." % (counts[Change.CREATE],
+                                          counts[Change.UPDATE],
+                                          counts[Change.DELETE],
+                                          len(self.unchanged_resources)))
+
+    def to_graph(self):
+        graph = DeployGraph()
+        for step in self.support_steps + self.changes:
+            graph.add(step.node, step.fn,
+                      [d for d in step.deps if d in self._nodes])
+        return graph
+
+
+class DeployNode:
+    def __init__(self, name, fn, deps):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+
+
+class DeployResult:
+    def __init__(self, results, failures, skipped):
+        self.results = results
+        self.failures = failures
+        self.skipped = skipped
+
+    def report(self):
+        click.echo("deploy steps: %d succeeded, %d failed, %d skipped" %
+                   (len(self.results), len(self.failures), len(self.skipped)))
+        for name, error in self.failures.items():
+            click.echo("FAILED %s: %s" % (name, error), err=True)
+        for name, cause in self.skipped.items():
+            click.echo("SKIPPED %s (depends on failed step %s)" %
+                       (name, cause), err=True)
+
+
+class DeployGraph:
+    '''A set of deploy steps and the ordering constraints between them.
+
+    Each node's function is called with the dict of results from the nodes
+    that have already completed.  Independent nodes run concurrently on a
+    bounded thread pool; when a node fails its dependents are skipped while
+    unrelated branches carry on.
+    '''
+
+    def __init__(self):
+        self.nodes = collections.OrderedDict()
+
+    def add(self, name, fn, deps=()):
+        if name in self.nodes:
+            raise ValueError("duplicate deploy step: %s" % name)
+        self.nodes[name] = DeployNode(name, fn, deps)
+        return name
+
+    def _dependents(self):
+        dependents = dict((name, []) for name in self.nodes)
+        for node in self.nodes.values():
+            for dep in node.deps:
+                if dep not in self.nodes:
+                    raise ValueError("deploy step %s depends on unknown step "
+                                     "%s" % (node.name, dep))
+                dependents[dep].append(node.name)
+        return dependents
+
+    def _check_acyclic(self, dependents):
+        waiting = dict((n.name, len(n.deps)) for n in self.nodes.values())
+        ready = [name for name, count in waiting.items() if count == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for dependent in dependents[name]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        if visited != len(self.nodes):
+            cycle = [name for name, count in waiting.items() if count > 0]
+            raise ValueError("deploy steps form a cycle: %s" % cycle)
+
+    def run(self, parallelism=1, tracer=None):
+        dependents = self._dependents()
+        self._check_acyclic(dependents)
+
+        waiting = dict((n.name, set(n.deps)) for n in self.nodes.values())
+        results = {}
+        failures = collections.OrderedDict()
+        skipped = collections.OrderedDict()
+
+        def skip_dependents(name, cause):
+            for dependent in dependents[name]:
+                if dependent in waiting:
+                    del waiting[dependent]
+                    skipped[dependent] = cause
+                    skip_dependents(dependent, cause)
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=parallelism) as executor:
+            running = {}
+
+            def submit_ready():
+                for name in [n for n, deps in waiting.items() if not deps]:
+                    del waiting[name]
+                    fn = self.nodes[name].fn
+                    if tracer is not None:
+                        fn = traced(tracer, 'step', name, fn)
+                    future = executor.submit(fn, results)
+                    running[future] = name
+
+            submit_ready()
+            while running:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        failures[name] = e
+                        skip_dependents(name, name)
+                        continue
+                    for dependent in dependents[name]:
+                        if dependent in waiting:
+                            waiting[dependent].discard(name)
+                submit_ready()
+
+        return DeployResult(results, failures, skipped)
+
+
+def traced(tracer, category, step, fn):
+    # steps are summarized by kind, e.g. "queue" for "queue:prod-audit"
+    kind, _, resource = step.partition(':')
+    def run(*args):
+        with tracer.span(category, kind, resource=resource):
+            return fn(*args)
+    return run
+
+
+def deploy_options(required):
+    options = [
+        click.option('--config_dir', required=required, multiple=True,
+                     help="Directory of mill configuration files; repeat "
+                          "to deploy several environments at once."),
+        click.option('--aws_profile', required=required, multiple=True,
+                     help="The aws profile configured in your environment "
+                          "that you would like to use, as profile or "
+                          "profile:region; repeat to give one per "
+                          "--config_dir."),
+        click.option('--cache_dir',
+                     default=os.path.expanduser('~/.cache/milldeploy'),
+                     show_default=True,
+                     help="Directory for artifacts cached between runs."),
+        click.option('--mill_init_url', default=DEFAULT_MILL_INIT_URL,
+                     show_default=True,
+                     help="Git repository of mill-init."),
+        click.option('--mill_init_ref', default=None,
+                     help="Branch, tag or commit of mill-init to use.  "
+                          "Defaults to millInitRef in "
+                          "environment-account.properties, or %s." %
+                          DEFAULT_MILL_INIT_REF),
+        click.option('--mill_init_commit', default=None,
+                     help="Expected commit (or prefix) of the mill-init "
+                          "checkout; the deploy stops if it differs."),
+        click.option('--mill_init_seed', default=None,
+                     type=click.Path(exists=True),
+                     help="Directory or tarball of a mill-init clone used to "
+                          "populate an empty cache."),
+        click.option('--offline', is_flag=True, default=False,
+                     help="Never fetch mill-init; use the cache or seed."),
+        click.option('--topology_ttl', default=3600, show_default=True,
+                     type=click.IntRange(min=0),
+                     help="Seconds a cached VPC topology stays valid; 0 "
+                          "always looks it up."),
+        click.option('--launch_config_retention', default=2,
+                     show_default=True, type=click.IntRange(min=0),
+                     help="Unreferenced launch configs to keep per role; "
+                          "older ones are deleted."),
+        click.option('--parallelism', default=8, show_default=True,
+                     type=click.IntRange(min=1),
+                     help="Maximum number of AWS deploy steps to run "
+                          "concurrently."),
+        click.option('--max_pool_connections', default=None,
+                     type=click.IntRange(min=1),
+                     help="HTTP connections kept per AWS service; defaults "
+                          "to --parallelism, and at least 10."),
+        click.option('--max_attempts', default=10, show_default=True,
+                     type=click.IntRange(min=1),
+                     help="Attempts per AWS call, with adaptive client side "
+                          "rate limiting while throttled."),
+        click.option('--connect_timeout', default=10, show_default=True,
+                     type=click.IntRange(min=1),
+                     help="Seconds to wait for a connection to AWS."),
+        click.option('--read_timeout', default=60, show_default=True,
+                     type=click.IntRange(min=1),
+                     help="Seconds to wait for an AWS response."),
+        click.option('--trace_file', default=None, type=click.Path(),
+                     help="Write the timed spans of the run to this file "
+                          "as a Chrome trace."),
+        click.option('-v', '--verbose', count=True,
+                     help="Print AWS responses; repeat for more detail."),
+        click.option('--instance_refresh', is_flag=True, default=False,
+                     help="After deploying, replace instances running from "
+                          "an old launch config or template with a rolling "
+                          "instance refresh."),
+        click.option('--min_healthy_percentage', default=90,
+                     show_default=True, type=click.IntRange(0, 100),
+                     help="Capacity kept in service during an instance "
+                          "refresh, as a percentage of the desired "
+                          "capacity."),
+        click.option('--refresh_warmup', default=300, show_default=True,
+                     type=click.IntRange(min=0),
+                     help="Seconds a new instance warms up before an "
+                          "instance refresh counts it as healthy."),
+        click.option('--refresh_checkpoints', default=None,
+                     help="Comma separated percentages of each group to "
+                          "replace before pausing, e.g. 20,50."),
+        click.option('--checkpoint_delay', default=600, show_default=True,
+                     type=click.IntRange(min=0),
+                     help="Seconds an instance refresh pauses at each "
+                          "checkpoint."),
+        click.option('--refresh_poll_interval', default=30,
+                     show_default=True, type=click.IntRange(min=0),
+                     help="Seconds between instance refresh progress "
+                          "checks."),
+        click.option('--environment_parallelism', default=4,
+                     show_default=True, type=click.IntRange(min=1),
+                     help="Maximum number of environments deployed "
+                          "concurrently, each in its own process."),
+        click.option('--log_dir', default=None, type=click.Path(),
+                     help="Directory of the per environment logs when "
+                          "several are deployed; defaults to logs under "
+                          "--cache_dir."),
+    ]
+
+    def decorator(f):
+        for option in reversed(options):
+            f = option(f)
+        return f
+    return decorator
+
+
+@click.group(invoke_without_command=True)
+@deploy_options(required=False)
+@click.pass_context
+def cli(ctx, **options):
+    '''Deploys mill in a production environment.
+
+    Without a command the deploy is applied directly, as "apply" would.
+    Options given before a command are passed on to it.
+    '''
+    if ctx.invoked_subcommand is not None:
+        defaults = dict((k, v) for k, v in options.items()
+                        if v is not None and v != ())
+        command = cli.commands[ctx.invoked_subcommand]
+        ctx.default_map = {
+            ctx.invoked_subcommand: get_command_defaults(command, defaults)}
+        return
 
-    shutil.rmtree("mill-init", ignore_errors=True)
-    shutil.rmtree("output", ignore_errors=True)
+    for name in ('config_dir', 'aws_profile'):
+        if not options[name]:
+            raise click.UsageError("Missing option '--%s'." % name)
+    deploy(apply_changes=True, **options)
 
-    # download mill-init
-    os.mkdir("mill-init")
-    repo = Repo.clone_from("https://github.com/duracloud/mill-init.git",
-                         "mill-init")
+def get_command_defaults(command, defaults):
+    # commands taking a single --config_dir or --aws_profile get the one
+    # given before them
+    defaults = dict(defaults)
+    for param in command.params:
+        value = defaults.get(param.name)
+        if isinstance(value, tuple) and not param.multiple:
+            if len(value) > 1:
+                raise click.UsageError("%s takes a single --%s." %
+                                       (command.name, param.name))
+            defaults[param.name] = value[0]
+    return defaults
 
-    repo.git.checkout('release-2.1.7')
 
+@cli.command()
+@deploy_options(required=True)
+def plan(**options):
+    '''Shows the changes a deploy would make without making them.'''
+    deploy(apply_changes=False, **options)
 
-    # generate cloud init scripts
-    os.system('mill-init/generate-all-cloud-init.py -m '
-              '%s/mill-config.properties -e '
-              '%s/environment-account.properties -bx '
-              '%s/bit-exclusion-list.txt -bi '
-              '%s/bit-inclusion-list.txt  -sx '
-              '%s/storage-stats-exclusion-list.txt -si '
-              '%s/storage-stats-inclusion-list.txt   -o output' %
-              (config_dir,
-              config_dir,
-              config_dir,
-              config_dir,
-              config_dir,
-              config_dir))
+
+@cli.command()
+@deploy_options(required=True)
+def apply(**options):
+    '''Sends only the AWS calls needed to converge the deployment.'''
+    deploy(apply_changes=True, **options)
+
+
+@cli.command()
+@click.option('--config_dir', required=True,
+              help="Directory of mill configuration files")
+@click.option('--trace', multiple=True, type=click.Path(exists=True),
+              help="CSV of time,queue,messages rows: messages sent to a "
+                   "queue at a time given in seconds from the start or as "
+                   "an ISO 8601 timestamp.")
+@click.option('--burst', multiple=True,
+              help="Synthetic burst as queue=messages[@hours], e.g. "
+                   "audit=100000@2.")
+@click.option('--throughput', multiple=True,
+              help="Messages an instance works off per minute as "
+                   "queue=rate.")
+@click.option('--boot_time', default=300, show_default=True,
+              type=click.IntRange(min=0),
+              help="Seconds from launch until an instance takes work.")
+@click.option('--hourly_price', default=None, type=float,
+              help="Price of an instance hour; defaults to each fleet's "
+                   "spot price.")
+@click.option('--drain_limit', default=48, show_default=True,
+              type=click.FloatRange(min=0),
+              help="Hours after the last message to keep simulating.")
+def simulate(config_dir, trace, burst, throughput, boot_time, hourly_price,
+             drain_limit):
+    '''Replays queue traffic through the fleets' scaling policies offline.'''
+    props = read_properties_files_into_dict(
+        '%s/environment-account.properties' % config_dir)
+
+    mill_props = read_properties_files_into_dict(
+        '%s/mill-config.properties' % config_dir)
+
+    # fleets grow only as far as the database connection budget lets them
+    fleets = load_fleet_specs(config_dir)
+    budget = plan_connection_budget(props, mill_props, fleets)
+    if budget is not None:
+        for fleet in fleets:
+            fleet.max_size = budget.max_sizes[fleet.role]
+    fleets = [f for f in fleets if f.queue is not None]
+
+    # the policies only need the configuration, not AWS or mill-init
+    topology = VpcTopology(None, [], [], None)
+    cloud_init = dict((role, "") for role in CLOUD_INIT_ROLES)
+    groups = create_group_configs(props, props.get("awsRegion"), fleets,
+                                  topology, cloud_init)
+    roles = [g.role for g in groups]
+
+    arrivals = collections.defaultdict(list)
+    for path in trace:
+        for t, role, count in read_simulation_trace(path, roles):
+            arrivals[role].append((t, count))
+    for spec in burst:
+        role, count, t = parse_simulation_burst(spec, roles)
+        arrivals[role].append((t, count))
+    if not arrivals:
+        raise click.UsageError("Give at least one --trace or --burst.")
+
+    rates = dict((f.role, f.throughput or 1) for f in fleets)
+    for spec in throughput:
+        role, _, rate = spec.partition("=")
+        try:
+            rates[get_simulation_role(role, roles)] = float(rate)
+        except ValueError:
+            raise click.BadParameter("%s: %s" % (spec, rate),
+                                     param_hint="--throughput")
+
+    results = []
+    for group in groups:
+        if group.role not in arrivals:
+            continue
+        price = hourly_price
+        if price is None:
+            price = float(group.launch_config.get("SpotPrice", 0))
+        fleet = FleetSimulation(group, rates[group.role], boot_time, price)
+        results.append(fleet.run(sorted(arrivals[group.role]),
+                                 drain_limit * 3600))
+    report_simulation(results)
+
+def read_simulation_trace(path, roles):
+    rows = []
+    with open(path) as f:
+        for line, row in enumerate(csv.reader(f), 1):
+            if not row or row[0].startswith("#"):
+                continue
+            if line == 1 and row[0].strip() == "time":
+                continue
+            try:
+                t, queue, count = [v.strip() for v in row]
+                try:
+                    t = float(t)
+                except ValueError:
+                    t = datetime.datetime.fromisoformat(t).timestamp()
+                rows.append((t, queue, float(count)))
+            except ValueError:
+                raise click.ClickException("%s:%d: expected time,queue,"
+                                           "messages" % (path, line))
+    if not rows:
+        return []
+    # traces start at the first message
+    start = min(t for t, queue, count in rows)
+    trace = []
+    ignored = set()
+    for t, queue, count in rows:
+        try:
+            trace.append((t - start, get_simulation_role(queue, roles),
+                          count))
+        except ValueError:
+            ignored.add(queue)
+    for queue in sorted(ignored):
+        click.echo("%s: no fleet works off %s, ignoring it" % (path, queue))
+    return trace
+
+def parse_simulation_burst(spec, roles):
+    role, _, rest = spec.partition("=")
+    count, _, hours = rest.partition("@")
+    try:
+        return (get_simulation_role(role, roles), float(count),
+                float(hours or 0) * 3600)
+    except ValueError:
+        raise click.BadParameter(spec, param_hint="--burst")
+
+def get_simulation_role(queue, roles):
+    # accepts a queue with or without the environment prefix
+    for role in sorted(roles, key=len, reverse=True):
+        if queue == role or queue.endswith("-" + role):
+            return role
+    raise ValueError(queue)
+
+def compare_to_threshold(alarm, value):
+    threshold = alarm["Threshold"]
+    return {
+        'GreaterThanThreshold': value > threshold,
+        'GreaterThanOrEqualToThreshold': value >= threshold,
+        'LessThanThreshold': value < threshold,
+        'LessThanOrEqualToThreshold': value <= threshold,
+    }[alarm["ComparisonOperator"]]
+
+def format_duration(seconds):
+    if seconds is None:
+        return "not drained"
+    minutes = int(round(seconds / 60.0))
+    return "%dh%02dm" % (minutes // 60, minutes % 60)
+
+def report_simulation(results):
+    row = "%-24s %10s %12s %12s %9s %14s %10s"
+    click.echo(row % ("fleet", "messages", "peak backlog", "drain time",
+                      "max size", "instance-hours", "spot cost"))
+    for r in results:
+        click.echo(row % (r.name, "%d" % r.messages, "%d" % r.peak_backlog,
+                          format_duration(r.drain_time), r.max_instances,
+                          "%.1f" % r.instance_hours, "%.2f" % r.cost))
+
+@cli.command('tune-queues')
+@click.option('--config_dir', required=True,
+              help="Directory of mill configuration files")
+@click.option('--aws_profile', required=True,
+              help="The aws profile configured in your environment "
+                   "that you would like to use.")
+@click.option('--window', default=168, show_default=True,
+              type=click.IntRange(min=1),
+              help="Hours of CloudWatch statistics to look at.")
+@click.option('--safety_factor', default=2.0, show_default=True,
+              type=click.FloatRange(min=1),
+              help="Multiple of the p99 processing time to recommend.")
+@click.option('--apply', 'apply_changes', is_flag=True, default=False,
+              help="Set the recommended visibility timeouts on the queues "
+                   "and record them in %s." % FLEET_SPEC_FILE)
+def tune_queues(config_dir, aws_profile, window, safety_factor,
+                apply_changes):
+    '''Recommends visibility timeouts from observed processing times.'''
+    props = read_properties_files_into_dict(
+        '%s/environment-account.properties' % config_dir)
+    env_prefix = props["instancePrefix"]
+    queue_specs = load_queue_specs(config_dir)
+    queues = create_queue_configs(env_prefix, queue_specs)
 
     session = boto3.Session(profile_name=aws_profile)
+    clients = AwsClients(session)
+    queue_inventory = QueueInventory.load(clients.sqs, env_prefix, queues)
+
+    period = 300
+    end = datetime.datetime.now(datetime.timezone.utc)
+    start = end - datetime.timedelta(hours=window)
+    statistics = get_queue_statistics(clients.cloudwatch,
+                                      [q for q in queues
+                                       if queue_inventory.get_url(q)],
+                                      start, end, period)
+
+    row = "%-32s %8s %8s %8s %8s %11s %11s"
+    click.echo(row % ("queue", "current", "p50", "p99", "oldest",
+                      "redelivered", "recommended"))
+    changes = {}
+    for spec in queue_specs:
+        qname = QueueNames().format(env_prefix, spec.queue)
+        live = queue_inventory.get_attributes(qname)
+        if live is None:
+            continue
+        current = int(live.get("VisibilityTimeout", 0))
+        stats = statistics.get(qname, {})
+        times = estimate_processing_times(stats, period)
+        received = sum(stats.get('NumberOfMessagesReceived', {}).values())
+        deleted = sum(stats.get('NumberOfMessagesDeleted', {}).values())
+        oldest = max(stats.get('ApproximateAgeOfOldestMessage',
+                               {}).values() or [0])
+        redelivered = "-"
+        if received:
+            redelivered = "%.1f%%" % (max(received - deleted, 0) * 100.0 /
+                                      received)
+        if not times:
+            click.echo(row % (qname, current, "-", "-", "%d" % oldest,
+                              redelivered, "no traffic"))
+            continue
+        p99 = get_percentile(times, 99)
+        recommended = recommend_visibility_timeout(p99, safety_factor)
+        click.echo(row % (qname, current, "%d" % get_percentile(times, 50),
+                          "%d" % p99, "%d" % oldest, redelivered,
+                          recommended))
+        if recommended != current:
+            changes[spec.queue] = recommended
+
+    if not changes:
+        click.echo("Visibility timeouts are up to date.")
+        return
+    if not apply_changes:
+        click.echo("Run with --apply to set %d visibility timeouts." %
+                   len(changes))
+        return
 
+    for queue, timeout in changes.items():
+        update_sqs_queue(clients.sqs,
+                         queue_inventory.get_url(
+                             QueueNames().format(env_prefix, queue)),
+                         {'VisibilityTimeout': str(timeout)})
+    # later deploys keep the tuned values
+    record_visibility_timeouts(config_dir, changes)
 
+def get_queue_statistics(cloudwatch_client, qnames, start, end, period):
+    # {queue name: {metric name: {timestamp: value}}} in one batched read
+    queries = []
+    ids = {}
+    for n, qname in enumerate(qnames):
+        for m, (metric, stat) in enumerate(QUEUE_METRICS):
+            query_id = "q%d_%d" % (n, m)
+            ids[query_id] = (qname, metric)
+            queries.append(dict(
+                Id=query_id,
+                MetricStat=dict(
+                    Metric=dict(Namespace='AWS/SQS', MetricName=metric,
+                                Dimensions=[dict(Name='QueueName',
+                                                 Value=qname)]),
+                    Period=period,
+                    Stat=stat)))
+    statistics = collections.defaultdict(
+        lambda: collections.defaultdict(dict))
+    # get_metric_data takes at most 500 queries a call
+    for i in range(0, len(queries), 500):
+        for result in paginate(cloudwatch_client, 'get_metric_data',
+                               'MetricDataResults',
+                               MetricDataQueries=queries[i:i + 500],
+                               StartTime=start, EndTime=end):
+            qname, metric = ids[result["Id"]]
+            statistics[qname][metric].update(
+                zip(result["Timestamps"], result["Values"]))
+    return statistics
+
+def estimate_processing_times(stats, period):
+    # little's law per period: messages in flight / deletes per second is
+    # the time a worker held a message before deleting it
+    in_flight = stats.get('ApproximateNumberOfMessagesNotVisible', {})
+    times = []
+    for timestamp, deleted in stats.get('NumberOfMessagesDeleted',
+                                        {}).items():
+        if deleted > 0 and timestamp in in_flight:
+            times.append(in_flight[timestamp] * period / deleted)
+    return times
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    rank = int(math.ceil(percentile / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+def recommend_visibility_timeout(processing_time, safety_factor):
+    # whole minutes, within what sqs accepts
+    timeout = int(math.ceil(processing_time * safety_factor / 60.0)) * 60
+    return max(60, min(43200, timeout))
+
+def record_visibility_timeouts(config_dir, timeouts):
+    path = os.path.join(config_dir, FLEET_SPEC_FILE)
+    spec = read_fleet_spec(config_dir)
+    queues = spec.setdefault('queues', {})
+    for queue, timeout in sorted(timeouts.items()):
+        queues.setdefault(queue, {})['visibilityTimeout'] = timeout
+    write_json_atomically(path, spec, sort_keys=False)
+    click.echo("recorded %d visibility timeouts in %s" % (len(timeouts),
+                                                         path))
+
+@cli.command()
+@click.option('--config_dir', required=True,
+              help="Directory of mill configuration files")
+@click.option('--aws_profile', required=True,
+              help="The aws profile configured in your environment "
+                   "that you would like to use.")
+@click.option('--instance_type', default='m5.large', show_default=True,
+              help="Instance type of the builder instance.")
+@click.option('--endpoint_url', default=None,
+              help="AWS endpoint to bake against instead of AWS, such as a "
+                   "local stand-in.")
+@click.option('--timeout', default=3600, show_default=True,
+              type=click.IntRange(min=1),
+              help="Seconds to wait for provisioning and for the image.")
+@click.option('--poll_interval', default=15, show_default=True,
+              type=click.IntRange(min=0),
+              help="Seconds between builder and image state checks.")
+@click.option('--apply', 'apply_changes', is_flag=True, default=False,
+              help="Build the image; without it the bake is only planned.")
+def bake(config_dir, aws_profile, instance_type, endpoint_url, timeout,
+         poll_interval, apply_changes):
+    '''Bakes a mill AMI with puppet and the mill jars preinstalled.
+
+    The image is role agnostic and keyed by jarVersion,
+    puppetDuracloudMillBranch, amiId and the provisioning in bake.sh;
+    deploys with useBakedImage=true pick it up.
+    '''
     props = read_properties_files_into_dict(
-        '%s/environment-account.properties' %
-                                    config_dir)
-    jar_version = props["jarVersion"]
-    key_name = props["keyName"]
+        '%s/environment-account.properties' % config_dir)
+    bake_script = read_bake_template(config_dir, BAKE_SCRIPT_FILE)
+    if bake_script is None:
+        raise click.ClickException("%s not found in %s" %
+                                   (BAKE_SCRIPT_FILE, config_dir))
+
+    session = boto3.Session(profile_name=aws_profile)
+    clients = AwsClients(session, endpoint_url=endpoint_url)
+    images = describe_baked_images(clients.ec2, {
+        'milldeploy:jar-version': props["jarVersion"],
+        'milldeploy:puppet-branch': props["puppetDuracloudMillBranch"],
+        'milldeploy:base-image': props["amiId"]})
+    plan = plan_bake(props, bake_script, images, instance_type)
+
+    if plan.image_id is not None:
+        click.echo("%s is up to date: %s" % (plan.name, plan.image_id))
+        return
+    click.echo("+ image %s from %s on a %s builder" %
+               (plan.name, plan.base_image_id, plan.instance_type))
+    for tag in plan.tags:
+        click.echo("    %s: %s" % (tag["Key"], tag["Value"]))
+    if not apply_changes:
+        click.echo("Run with --apply to bake the image.")
+        return
+
+    topology = resolve_vpc_topology(clients.ec2)
+    image_id = run_bake(clients.ec2, plan, props, topology, timeout,
+                        poll_interval)
+    click.echo("baked %s: %s" % (plan.name, image_id))
+    clients.report()
+
+def read_bake_template(config_dir, filename):
+    path = os.path.join(config_dir, filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return f.read()
+
+def render_bake_template(template, values, source):
+    # {{name}} placeholders, so the shell's own $ and ${} are left alone
+    def value(match):
+        if match.group(1) not in values:
+            raise click.ClickException("%s: unknown property {{%s}}" %
+                                       (source, match.group(1)))
+        return values[match.group(1)]
+    return re.sub(r'\{\{(\w+)\}\}', value, template)
+
+def build_baked_user_data(cloud_init, first_boot, role):
+    # the mill-init cloud-init's files (mill-config.properties, the lists,
+    # credentials) still have to be written on a baked image; its install
+    # steps are what the bake already did, so first-boot.sh runs instead
+    try:
+        config = yaml.safe_load(cloud_init)
+    except yaml.YAMLError as e:
+        raise click.ClickException("cannot read the mill-init cloud-init "
+                                   "of %s: %s" % (role, e))
+    if not cloud_init.startswith("#cloud-config") or \
+            not isinstance(config, dict) or not config.get("write_files"):
+        raise click.ClickException(
+            "the mill-init cloud-init of %s writes no files to carry over "
+            "to a baked image" % role)
+    first_boot_path = "/var/lib/milldeploy/%s" % FIRST_BOOT_FILE
+    return "#cloud-config\n" + yaml.safe_dump(dict(
+        write_files=config["write_files"] + [dict(
+            path=first_boot_path, permissions='0755', content=first_boot)],
+        runcmd=[[first_boot_path]]), default_flow_style=False)
+
+def plan_bake(props, bake_script, images, instance_type):
+    # images are the existing bakes of this jar version and puppet branch;
+    # one is reused only if it has the same key and is available
+    user_data = render_bake_template(bake_script, props, BAKE_SCRIPT_FILE)
+    key = hashlib.sha256(json.dumps(
+        [props["amiId"], props["jarVersion"],
+         props["puppetDuracloudMillBranch"], user_data]).encode(
+             "utf-8")).hexdigest()[:12]
+    name = "mill-%s-%s-%s" % (props["jarVersion"],
+                              props["puppetDuracloudMillBranch"], key)
+    values = dict(get_bake_tags(props, user_data))
+    values['milldeploy:bake-key'] = key
+    tags = [dict(Key='Name', Value=name)]
+    tags.extend(dict(Key=k, Value=values[k]) for k in BAKE_TAGS)
+    existing = [image["ImageId"] for image in images
+                if image.get("State") == "available"
+                and get_image_tag(image, 'milldeploy:bake-key') == key]
+    return BakePlan(name, key, props["amiId"], instance_type, user_data, tags,
+                    existing[0] if existing else None)
+
+def run_bake(ec2_client, plan, props, topology, timeout, poll_interval):
+    # the builder runs the provisioning as user data and powers itself off
+    # when done; the image is taken from the stopped instance
+    response = ec2_client.run_instances(
+        ImageId=plan.base_image_id,
+        InstanceType=plan.instance_type,
+        MinCount=1,
+        MaxCount=1,
+        KeyName=props["keyName"],
+        IamInstanceProfile={'Name': props["iamInstanceProfile"]},
+        SubnetId=topology.subnet_ids[0],
+        SecurityGroupIds=[topology.security_group_id],
+        InstanceInitiatedShutdownBehavior='stop',
+        UserData=plan.user_data,
+        TagSpecifications=[dict(ResourceType='instance', Tags=[
+            dict(Key='Name', Value="%s builder" % plan.name)])])
+    instance_id = response["Instances"][0]["InstanceId"]
+    click.echo("launched builder %s" % instance_id)
+    try:
+        wait_for_state(
+            "builder %s" % instance_id,
+            lambda: ec2_client.describe_instances(
+                InstanceIds=[instance_id])["Reservations"][0]["Instances"][0]
+                ["State"]["Name"],
+            'stopped', ['shutting-down', 'terminated'], timeout,
+            poll_interval)
+        image_id = ec2_client.create_image(
+            InstanceId=instance_id,
+            Name=plan.name,
+            Description="mill %s with puppet-duracloud-mill %s" %
+                        (props["jarVersion"],
+                         props["puppetDuracloudMillBranch"]),
+            TagSpecifications=[dict(ResourceType='image',
+                                    Tags=plan.tags)])["ImageId"]
+        click.echo("creating image %s" % image_id)
+        wait_for_state(
+            "image %s" % image_id,
+            lambda: ec2_client.describe_images(
+                ImageIds=[image_id])["Images"][0]["State"],
+            'available', ['failed', 'invalid', 'error', 'deregistered'],
+            timeout, poll_interval)
+        return image_id
+    finally:
+        click.echo("terminating builder %s" % instance_id)
+        ec2_client.terminate_instances(InstanceIds=[instance_id])
+
+def wait_for_state(what, get_state, done, failed, timeout, poll_interval):
+    deadline = time.time() + timeout
+    state = None
+    while True:
+        previous, state = state, get_state()
+        if state != previous:
+            click.echo("%s: %s" % (what, state))
+        if state == done:
+            return
+        if state in failed:
+            raise click.ClickException("%s is %s" % (what, state))
+        if time.time() >= deadline:
+            raise click.ClickException("%s still %s after %d seconds" %
+                                       (what, state, timeout))
+        time.sleep(poll_interval)
+
+def describe_baked_images(ec2_client, tags):
+    return paginate(ec2_client, 'describe_images', 'Images', Owners=['self'],
+                    Filters=[dict(Name='tag:%s' % k, Values=[v])
+                             for k, v in tags.items()])
+
+def get_image_tag(image, key):
+    return next((t["Value"] for t in image.get("Tags", [])
+                 if t["Key"] == key), None)
+
+def get_bake_tags(props, user_data):
+    # the tags of every input of a bake, which a deploy finds it by
+    return collections.OrderedDict([
+        ('milldeploy:jar-version', props["jarVersion"]),
+        ('milldeploy:puppet-branch', props["puppetDuracloudMillBranch"]),
+        ('milldeploy:base-image', props["amiId"]),
+        ('milldeploy:bake-script',
+         hashlib.sha256(user_data.encode("utf-8")).hexdigest()[:12])])
+
+def find_baked_image(ec2_client, props, bake_script):
+    # the newest available bake of this jar version and puppet branch,
+    # from the current amiId and bake.sh
+    user_data = render_bake_template(bake_script, props, BAKE_SCRIPT_FILE)
+    images = [image for image in describe_baked_images(
+                  ec2_client, get_bake_tags(props, user_data))
+              if image.get("State") == "available"]
+    if not images:
+        return None
+    return max(images, key=lambda image: image["CreationDate"])["ImageId"]
 
-    image_id = props["amiId"]
+def deploy(aws_profile, config_dir, cache_dir, mill_init_url, mill_init_ref,
+           mill_init_commit, mill_init_seed, offline, trace_file, verbose,
+           environment_parallelism, log_dir, apply_changes, **options):
+    global verbosity
+    verbosity = verbose
+    environments = get_environments(config_dir, aws_profile)
+    tracer = Tracer()
+    try:
+        # mill-init and cloud-init are built here, once, for every
+        # environment; only the AWS side runs per environment
+        prepare_environments(tracer, environments, cache_dir, mill_init_url,
+                             mill_init_ref, mill_init_commit, mill_init_seed,
+                             offline)
+        if len(environments) == 1:
+            deploy_environment(tracer, environments[0], cache_dir,
+                               apply_changes, **options)
+        else:
+            deploy_environments(environments, cache_dir, trace_file,
+                                environment_parallelism,
+                                log_dir or os.path.join(cache_dir, "logs"),
+                                apply_changes, options)
+    finally:
+        tracer.report()
+        if trace_file:
+            tracer.export(trace_file)
+
+def get_environments(config_dirs, aws_profiles):
+    # one profile for every config dir, or one profile per config dir
+    if len(aws_profiles) == 1:
+        aws_profiles = aws_profiles * len(config_dirs)
+    if len(aws_profiles) != len(config_dirs):
+        raise click.UsageError(
+            "Pass one --aws_profile, or one per --config_dir (%d "
+            "profiles for %d config dirs)." %
+            (len(aws_profiles), len(config_dirs)))
+    environments = [Environment(config_dir, aws_profile)
+                    for config_dir, aws_profile
+                    in zip(config_dirs, aws_profiles)]
+    names = collections.Counter(env.name for env in environments)
+    duplicates = sorted(name for name, count in names.items() if count > 1)
+    if duplicates:
+        raise click.UsageError("More than one --config_dir deploys %s." %
+                               ", ".join(duplicates))
+    return environments
+
+def prepare_environments(tracer, environments, cache_dir, mill_init_url,
+                         mill_init_ref, mill_init_commit, mill_init_seed,
+                         offline):
+    # the cached clone holds one ref at a time, so environments are grouped
+    # by the ref they use and each ref is checked out once
+    refs = collections.OrderedDict()
+    for env in environments:
+        # fit the fleets to the database first, as max-workers feeds into
+        # the generated cloud-init
+        apply_connection_budget(env, cache_dir)
+        ref = mill_init_ref or env.props.get("millInitRef",
+                                             DEFAULT_MILL_INIT_REF)
+        refs.setdefault(ref, []).append(env)
+
+    for ref, ref_environments in refs.items():
+        # check out mill-init from the local cache
+        with tracer.span('mill-init', 'checkout', ref=ref) as span:
+            mill_init = checkout_mill_init(
+                mill_init_url,
+                ref,
+                cache_dir,
+                offline=offline,
+                seed=mill_init_seed,
+                expected_commit=mill_init_commit)
+            span['commit'] = mill_init.commit
+
+        # generate cloud init scripts
+        for env in ref_environments:
+            with tracer.span('cloud-init', 'generate',
+                             resource=env.name) as span:
+                env.cloud_init = generate_cloud_init(
+                    mill_init, env.cloud_init_config_dir, cache_dir)
+                span['bytes'] = sum(len(script)
+                                    for script in env.cloud_init.values())
+
+def apply_connection_budget(env, cache_dir):
+    # caps the fleets before their groups are configured, and stages a
+    # mill-config.properties with a lower max-workers for cloud-init
+    budget = plan_connection_budget(env.props, env.mill_props, env.fleets)
+    env.connection_budget = budget
+    if budget is None:
+        return
+    for fleet in env.fleets:
+        fleet.max_size = budget.max_sizes[fleet.role]
+    if budget.max_workers != budget.original_max_workers:
+        overrides = {'max-workers': str(budget.max_workers)}
+        env.mill_props.update(overrides)
+        env.cloud_init_config_dir = stage_config_dir(env.config_dir,
+                                                     cache_dir, overrides)
+
+def get_int_property(props, name, default, minimum=0):
+    value = props.get(name)
+    if value is None or value.strip() == "":
+        return default
+    if not value.strip().isdigit() or int(value) < minimum:
+        raise click.ClickException("invalid value for %s: %s" % (name, value))
+    return int(value)
+
+def plan_connection_budget(props, mill_props, fleets):
+    # every instance of a fleet at its max size running max-workers workers
+    # is the worst case fan-in; None when no dbMaxConnections is configured
+    limit = get_int_property(props, "dbMaxConnections", None, minimum=1)
+    if limit is None:
+        return None
+    strategy = props.get("dbBudgetStrategy", "").strip() or "max-size"
+    if strategy not in DB_BUDGET_STRATEGIES:
+        raise click.ClickException("dbBudgetStrategy must be one of %s: %s" %
+                                   (", ".join(DB_BUDGET_STRATEGIES), strategy))
+    max_workers = get_int_property(mill_props, "max-workers",
+                                   DEFAULT_MAX_WORKERS, minimum=1)
+    # the mill and duracloud databases each get their own pools, which land
+    # on the same server when they share a host; with either host unset
+    # nothing says they do
+    databases = 1
+    mill_db_host = mill_props.get("mill.db.host")
+    if mill_db_host and mill_db_host == mill_props.get("db.host"):
+        databases = 2
+
+    budget = ConnectionBudget(
+        limit,
+        get_int_property(props, "dbReservedConnections", 0),
+        strategy,
+        max_workers,
+        databases,
+        get_int_property(props, "dbConnectionsPerWorker", 1),
+        dict((f.role, get_role_property(props, "dbExtraConnections", f.role,
+                                        0, int)) for f in fleets),
+        [(f.role, f.max_size) for f in fleets],
+        # the sentinel runs no workers
+        [f.role for f in fleets if f.queue is not None])
+    if budget.fan_in() <= limit:
+        return budget
+
+    if strategy == 'max-workers':
+        # the largest worker count all instances at max size can run
+        instances = sum(size for role, size in budget.max_sizes.items()
+                        if role in budget.worker_roles)
+        available = (limit - budget.reserved) // databases - sum(
+            size * budget.extra[role]
+            for role, size in budget.max_sizes.items())
+        if instances == 0 or available < instances * budget.per_worker:
+            raise click.ClickException(
+                "dbMaxConnections of %d cannot fit %d worker instances at "
+                "their max sizes even with one worker each" %
+                (limit, instances))
+        budget.max_workers = available // (instances * budget.per_worker)
+        return budget
+
+    # cap worker fleets from the least important up, each no lower than
+    # its min size; fleets missing from the priority list go first
+    priority = [role.strip() for role in props.get(
+        "dbBudgetPriority", ",".join(DEFAULT_DB_BUDGET_PRIORITY)).split(",")
+        if role.strip()]
+    workers = [f for f in fleets if f.queue is not None]
+    unlisted = [f for f in workers if f.role not in priority]
+    listed = sorted([f for f in workers if f.role in priority],
+                    key=lambda f: priority.index(f.role))
+    for fleet in unlisted[::-1] + listed[::-1]:
+        excess = budget.fan_in() - limit
+        if excess <= 0:
+            break
+        if budget.per_instance(fleet.role) == 0:
+            continue
+        cut = min(int(math.ceil(excess /
+                                float(budget.per_instance(fleet.role)))),
+                  budget.max_sizes[fleet.role] - fleet.min_size)
+        budget.max_sizes[fleet.role] -= cut
+    if budget.fan_in() > limit:
+        raise click.ClickException(
+            "dbMaxConnections of %d cannot fit the fleets' worst case of %d "
+            "connections even with every worker fleet at its min size; raise "
+            "the limit, lower max-workers or use dbBudgetStrategy=max-workers"
+            % (limit, budget.fan_in()))
+    return budget
 
-    sns_client = session.client('sns')
-    ec2_client = session.client('ec2')
+def report_connection_budget(budget, fleets):
+    click.echo("database connections at max size: %d of %d allowed%s" %
+               (budget.fan_in(), budget.limit,
+                "" if budget.fan_in() == budget.original_fan_in() else
+                " (%d as configured)" % budget.original_fan_in()))
+    if budget.max_workers != budget.original_max_workers:
+        click.echo("    max-workers: %d -> %d" % (budget.original_max_workers,
+                                                  budget.max_workers))
+    row = "    %-40s %9s %12s"
+    click.echo(row % ("fleet", "max size", "connections"))
+    for fleet in fleets:
+        size = budget.max_sizes[fleet.role]
+        if size != budget.original_max_sizes[fleet.role]:
+            size = "%d -> %d" % (budget.original_max_sizes[fleet.role], size)
+        click.echo(row % (fleet.name, size,
+                          budget.max_sizes[fleet.role] *
+                          budget.per_instance(fleet.role)))
 
-    subnet_ids = get_subnet_ids_as_string(ec2_client)
-    availability_zones = get_subnet_availability_zones(ec2_client);
+def stage_config_dir(config_dir, cache_dir, overrides):
+    # a copy of the cloud-init inputs with mill-config.properties keys
+    # replaced, under a directory named by its content
+    files = collections.OrderedDict()
+    for _, filename in CLOUD_INIT_INPUTS:
+        with open(os.path.join(config_dir, filename), 'r', newline='') as f:
+            files[filename] = f.read()
+    lines = []
+    replaced = set()
+    for line in files['mill-config.properties'].splitlines(True):
+        text = line.rstrip("\r\n")
+        key = text.split("=", 1)[0]
+        if "=" in text and not text.startswith("#") and key in overrides:
+            line = "%s=%s%s" % (key, overrides[key], line[len(text):])
+            replaced.add(key)
+        lines.append(line)
+    for key, value in overrides.items():
+        if key not in replaced:
+            lines.append("\n%s=%s\n" % (key, value))
+    files['mill-config.properties'] = "".join(lines)
 
-    security_group = get_security_group_id(ec2_client)
+    digest = hashlib.sha256()
+    for filename, content in files.items():
+        digest.update(("\0%s\0" % filename).encode("utf-8"))
+        digest.update(content.encode("utf-8"))
+    staged_dir = os.path.join(cache_dir, "staged-config", digest.hexdigest())
+    for filename, content in files.items():
+        path = os.path.join(staged_dir, filename)
+        if not os.path.exists(path):
+            os.makedirs(staged_dir, exist_ok=True)
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp_path, 'w', newline='') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+    return staged_dir
 
+def deploy_environments(environments, cache_dir, trace_file, parallelism,
+                        log_dir, apply_changes, options):
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    jobs = collections.OrderedDict()
+    for env in environments:
+        log_path = os.path.join(log_dir, "%s-%s.log" % (env.name, stamp))
+        env_trace_file = None
+        if trace_file:
+            root, ext = os.path.splitext(trace_file)
+            env_trace_file = "%s-%s%s" % (root, env.name, ext)
+        jobs[env.name] = (env, log_path, env_trace_file)
+
+    os.makedirs(log_dir, exist_ok=True)
+    click.echo("deploying %d environments, logging to %s" %
+               (len(environments), log_dir))
+    outcomes = collections.OrderedDict()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=parallelism) as executor:
+        futures = dict(
+            (executor.submit(deploy_environment_logged, env, log_path,
+                             env_trace_file, cache_dir, verbosity,
+                             apply_changes, options), name)
+            for name, (env, log_path, env_trace_file) in jobs.items())
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                outcomes[name] = future.result()
+            except Exception as e:
+                outcomes[name] = EnvironmentOutcome(False, str(e), 0)
+            click.echo("%s: %s" % (name, outcomes[name].status))
+
+    click.echo("%-20s %-15s %-12s %-8s %8s  %s" %
+               ("environment", "profile", "region", "result", "seconds",
+                "log"))
+    failed = 0
+    for name, (env, log_path, _) in jobs.items():
+        outcome = outcomes[name]
+        failed += not outcome.ok
+        click.echo("%-20s %-15s %-12s %-8s %8.0f  %s" %
+                   (name, env.aws_profile, env.region or "-",
+                    "ok" if outcome.ok else "FAILED", outcome.seconds,
+                    log_path))
+        click.echo("    %s" % outcome.status)
+    if failed:
+        raise click.ClickException("%d of %d environments failed" %
+                                   (failed, len(environments)))
+
+def deploy_environment_logged(env, log_path, trace_file, cache_dir, verbose,
+                              apply_changes, options):
+    # runs in a worker process with its output going to the environment's
+    # own log file
+    global verbosity
+    verbosity = verbose
+    tracer = Tracer()
+    start = time.time()
+    with open(log_path, 'w') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            status = deploy_environment(tracer, env, cache_dir,
+                                        apply_changes, **options)
+            ok = True
+        except click.ClickException as e:
+            status, ok = e.format_message(), False
+        except Exception as e:
+            status, ok = "%s: %s" % (type(e).__name__, e), False
+        click.echo(status)
+        tracer.report()
+        if trace_file:
+            tracer.export(trace_file)
+    return EnvironmentOutcome(ok, status, time.time() - start)
+
+def deploy_environment(tracer, env, cache_dir, apply_changes, topology_ttl,
+                       launch_config_retention, parallelism,
+                       max_pool_connections, max_attempts, connect_timeout,
+                       read_timeout, instance_refresh, min_healthy_percentage,
+                       refresh_warmup, refresh_checkpoints, checkpoint_delay,
+                       refresh_poll_interval):
+    refresh_preferences = get_refresh_preferences(
+        min_healthy_percentage, refresh_warmup, refresh_checkpoints,
+        checkpoint_delay)
+
+    click.echo('MillDeploy')
+    click.echo('AWS Profile: %s' % env.aws_profile)
+    click.echo('Config Directory: %s' % env.config_dir)
+
+    # validate existence of version in maven central
+
+    props = env.props
+    jar_version = props["jarVersion"]
     env_prefix = props["instancePrefix"]
-    iam_instance_profile=props["iamInstanceProfile"]
+
+    session = boto3.Session(profile_name=env.aws_profile,
+                            region_name=env.region)
+    clients = AwsClients(
+        session,
+        max_pool_connections=max_pool_connections or max(parallelism, 10),
+        max_attempts=max_attempts,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        tracer=tracer)
 
     click.echo('Mill Version: %s' % jar_version)
+    if env.connection_budget is not None:
+        report_connection_budget(env.connection_budget, env.fleets)
+
+    topology = resolve_vpc_topology(
+        clients.ec2,
+        get_topology_cache_file(cache_dir, env.aws_profile,
+                                session.region_name),
+        topology_ttl)
 
+    baked_image = None
+    if props.get("useBakedImage", "false").lower() == "true":
+        bake_script = read_bake_template(env.config_dir, BAKE_SCRIPT_FILE)
+        if bake_script is None:
+            raise click.ClickException(
+                "useBakedImage needs the %s the images were baked with in %s"
+                % (BAKE_SCRIPT_FILE, env.config_dir))
+        baked_image = find_baked_image(clients.ec2, props, bake_script)
+        if baked_image is None:
+            click.echo("no baked image of mill %s with puppet %s from %s "
+                       "and the current %s, booting from %s" %
+                       (jar_version, props["puppetDuracloudMillBranch"],
+                        props["amiId"], BAKE_SCRIPT_FILE, props["amiId"]))
+        else:
+            click.echo("using baked image %s" % baked_image)
+
+    groups = create_group_configs(
+        props, session.region_name, env.fleets, topology, env.cloud_init,
+        baked_image, read_bake_template(env.config_dir, FIRST_BOOT_FILE),
+        env.mill_props)
+    queues = create_queue_configs(env_prefix, env.queue_specs)
+
+    inventory = AutoScaleInventory.load(clients.autoscaling,
+                                        clients.cloudwatch,
+                                        clients.ec2)
+    inventory.load_lifecycle_hooks(
+        clients.autoscaling,
+        [i.autoscale_group["AutoScalingGroupName"] for i in groups
+         if i.warm_pool is not None or inventory.get_warm_pool(
+             i.autoscale_group["AutoScalingGroupName"]) is not None])
+    inventory.load_user_data_objects(
+        clients.s3, [i.user_data_upload for i in groups
+                     if i.user_data_upload is not None])
+    queue_inventory = QueueInventory.load(clients.sqs, env_prefix, queues)
+
+    deploy_plan = plan_changes(clients, inventory, queue_inventory, queues,
+                               groups, launch_config_retention)
+    deploy_plan.report()
+
+    refreshes = collections.OrderedDict()
+    if instance_refresh:
+        refreshes = plan_instance_refreshes(inventory, groups)
+        for asg_name, (stale, total, uses_template) in refreshes.items():
+            click.echo("instance refresh %s: %d of %d instances on an old "
+                       "launch config" % (asg_name, stale, total))
+
+    if not apply_changes or not (deploy_plan.changes or refreshes):
+        clients.report()
+        if not deploy_plan.changes and not refreshes:
+            return "no changes"
+        return "%d changes and %d instance refreshes planned" % (
+            len(deploy_plan.changes), len(refreshes))
 
-    # create queues
-    sqs_client = session.client('sqs')
-    put_sqs_queues(sqs_client, env_prefix)
+    if deploy_plan.changes:
+        graph = deploy_plan.to_graph()
+        result = graph.run(parallelism, tracer)
+        result.report()
+        if result.failures:
+            clients.report()
+            raise click.ClickException(
+                "%d of %d deploy steps failed" %
+                (len(result.failures), len(graph.nodes)))
 
-    d = datetime.datetime.utcnow()
-    time = d.strftime("%Y-%m-%d-%H%M%S")
+    if refreshes:
+        with tracer.span('rollout', 'instance-refresh',
+                         groups=len(refreshes)):
+            run_instance_refreshes(clients.autoscaling, refreshes,
+                                   refresh_preferences,
+                                   refresh_poll_interval)
+    clients.report()
+    return "%d changes applied, %d groups refreshed" % (
+        len(deploy_plan.changes), len(refreshes))
+
+def get_refresh_preferences(min_healthy_percentage, warmup, checkpoints,
+                            checkpoint_delay):
+    preferences = dict(MinHealthyPercentage=min_healthy_percentage,
+                       InstanceWarmup=warmup)
+    if checkpoints:
+        try:
+            percentages = sorted(set(int(p) for p in checkpoints.split(",")))
+        except ValueError:
+            raise click.BadParameter("not a list of percentages: %s" %
+                                     checkpoints,
+                                     param_hint="--refresh_checkpoints")
+        if percentages[0] < 1 or percentages[-1] > 100:
+            raise click.BadParameter("percentages must be from 1 to 100",
+                                     param_hint="--refresh_checkpoints")
+        # a refresh stops at its last checkpoint, so it always ends at 100
+        if percentages[-1] != 100:
+            percentages.append(100)
+        preferences["CheckpointPercentages"] = percentages
+        preferences["CheckpointDelay"] = checkpoint_delay
+    return preferences
+
+
+def create_group_configs(props, region, fleets, topology, cloud_init,
+                         baked_image=None, first_boot=None, mill_props=None):
+    jar_version = props["jarVersion"]
+    env_prefix = props["instancePrefix"]
 
     base_launch_config = dict(
-        ImageId=image_id,
-        IamInstanceProfile=iam_instance_profile,
-        SecurityGroups=[security_group],
-        KeyName=key_name)
+        ImageId=props["amiId"] if baked_image is None else baked_image,
+        IamInstanceProfile=props["iamInstanceProfile"],
+        SecurityGroups=[topology.security_group_id],
+        KeyName=props["keyName"])
 
+    use_launch_templates = \
+        props.get("useLaunchTemplates", "false").lower() == "true"
 
     groups = []
+    for fleet in fleets:
+        user_data = cloud_init[fleet.cloud_init]
+        if baked_image is not None and first_boot is not None:
+            # a baked image is already provisioned, its instances only
+            # configure their role on first boot
+            user_data = build_baked_user_data(
+                user_data,
+                render_bake_template(first_boot,
+                                     dict(props, role=fleet.cloud_init),
+                                     FIRST_BOOT_FILE),
+                fleet.cloud_init)
+        user_data, upload = build_user_data(
+            user_data, "cloud-init-%s.txt" % fleet.cloud_init, props, region,
+            fleet.name if fleet.warm_pool is not None else None)
+        group = create_group_config(fleet, jar_version, env_prefix, topology,
+                                    base_launch_config, user_data)
+        group.user_data_upload = upload
+        groups.append(group)
+        if fleet.warm_pool is not None:
+            if use_launch_templates and fleet.queue is not None:
+                raise click.ClickException(
+                    "%s: fleets.%s.warmPool cannot be used with "
+                    "useLaunchTemplates; warm pools do not support mixed "
+                    "instances policies" % (FLEET_SPEC_FILE, fleet.role))
+            use_warm_pool(group, fleet.warm_pool)
+        if fleet.queue is None:
+            continue
 
-    groups.append(create_sentinel_config(jar_version,
-                                                     time,
-                                                     subnet_ids,
-                                                     availability_zones,
-                                                     base_launch_config))
-
-    groups.append(create_storage_stats_worker_config(jar_version,
-                                                     time,
-                                                     subnet_ids,
-                                                     availability_zones,
-                                                     env_prefix,
-                                                     base_launch_config))
-
-    groups.append(create_audit_worker_config(jar_version,
-                                                     time,
-                                                     subnet_ids,
-                                                     availability_zones,
-                                                     env_prefix,
-                                                     base_launch_config))
-
-    groups.append(create_low_priority_dup_worker_config(jar_version,
-                                                     time,
-                                                     subnet_ids,
-                                                     availability_zones,
-                                                     env_prefix,
-                                                     base_launch_config))
-
-    groups.append(create_high_priority_dup_worker_config(jar_version,
-                                                     time,
-                                                     subnet_ids,
-                                                     availability_zones,
-                                                     env_prefix,
-                                                     base_launch_config))
-
-    groups.append(create_bit_worker_config(jar_version,
-                                                     time,
-                                                     subnet_ids,
-                                                     availability_zones,
-                                                     env_prefix,
-                                                     base_launch_config))
-
-    groups.append(create_bit_report_worker_config(jar_version,
-                                                     time,
-                                                     subnet_ids,
-                                                     availability_zones,
-                                                     env_prefix,
-                                                     base_launch_config))
-
-    # create autoscale and cloudwatch clients
-    autoscale_client = session.client('autoscaling')
-    cloudwatch_client = session.client('cloudwatch')
-
-    # for each auotscale group that should exist
-    for i in groups:
-        # create a launch config
-        launch_config = i.launch_config
-        response = create_launch_config(autoscale_client, launch_config)
+        # environment-account.properties may still override the spec
+        if use_launch_templates:
+            pools = get_role_property(props, "instancePools", fleet.role,
+                                      None)
+            use_launch_template(
+                group, jar_version,
+                fleet.instance_pools if pools is None else
+                parse_instance_pools(pools.split(","),
+                                     "instancePools.%s" % fleet.role),
+                get_role_property(props, "onDemandBaseCapacity", fleet.role,
+                                  fleet.on_demand_base_capacity, int))
 
-        # if autoscale group already exists
-        asg = i.autoscale_group
-        if not autoscale_exists(autoscale_client, asg):
-            # create an autoscale group with launch config
-            create_autoscale_group(autoscale_client, asg, launch_config)
-        else:
-            #update autoscale group with new launch config
-            update_existing_autoscale_group(autoscale_client, asg,
-                                            launch_config)
-
-        # scale down
-        put_scaling_policy(autoscale_client,
-                           cloudwatch_client,
-                           i.scale_down_policy,
-                           i.scale_down_alarm)
-
-        # scale up
-        put_scaling_policy(autoscale_client,
-                           cloudwatch_client,
-                           i.scale_up_policy,
-                           i.scale_up_alarm)
-
-        setup_autoscale_notifications(sns_client, autoscale_client,asg["AutoScalingGroupName"])
-
-def get_security_group_id(ec2_client):
-    response = ec2_client.describe_security_groups(
-        Filters=[
+        scaling_mode = get_role_property(props, "scalingMode", fleet.role,
+                                         fleet.scaling_mode)
+        if scaling_mode not in SCALING_MODES:
+            raise click.ClickException("unknown scalingMode for %s: %s" %
+                                       (fleet.role, scaling_mode))
+        if scaling_mode == "step":
+            steps = get_role_property(props, "scaleUpSteps", fleet.role, None)
+            use_step_scaling(
+                group,
+                fleet.scale_up_steps if steps is None else
+                parse_scale_up_steps(steps.split(","),
+                                     "scaleUpSteps.%s" % fleet.role,
+                                     fleet.scale_up),
+                fleet.scale_up.latency_slo)
+        elif scaling_mode == "target-tracking":
+            use_target_tracking(
+                group,
+                get_role_property(props, "targetBacklogPerInstance",
+                                  fleet.role,
+                                  fleet.target_backlog_per_instance, float),
+                get_role_property(props, "instanceWarmup", fleet.role,
+                                  fleet.instance_warmup, int),
+                fleet.scale_up.latency_slo)
+
+        prescale_time = get_role_property(props, "prescaleTime", fleet.role,
+                                          None)
+        if mill_props is not None and prescale_time is not None:
+            use_prescaling(group, fleet, mill_props, prescale_time,
+                           get_role_property(props, "prescaleDuration",
+                                             fleet.role, 120, int),
+                           get_role_property(props, "prescaleCapacity",
+                                             fleet.role, None, int))
+    return groups
+
+def build_user_data(script, filename, props, region, bootstrap_group=None):
+    # gzipped multipart cloud-init, byte for byte the same for the same
+    # script so launch config names stay stable; returns the user data and
+    # the bootstrapBucket object it fetches, if any.  region is where the
+    # instances call AWS from, bootstrap_group the group whose bootstrap
+    # hook they complete
+    content = script.encode("utf-8") if isinstance(script, str) else script
+    parts = []
+    if bootstrap_group is not None:
+        hook_script = BOOTSTRAP_HOOK_SCRIPT % dict(
+            region=region, group=bootstrap_group,
+            hook=BOOTSTRAP_HOOK)
+        parts.append((hook_script.encode("utf-8"),
+                      "%s.sh" % BOOTSTRAP_HOOK))
+    user_data = compress_user_data([(content, filename)] + parts)
+    threshold = int(props.get("userDataOffloadThreshold",
+                              DEFAULT_USER_DATA_OFFLOAD_THRESHOLD))
+    upload = None
+    # the fetch script runs shell scripts and cloud-configs; boothooks and
+    # includes stay inline
+    offloadable = (content.startswith(b"#!") or
+                   content.startswith(b"#cloud-config"))
+    if (len(user_data) > threshold and offloadable and
+            props.get("bootstrapBucket")):
+        digest = hashlib.sha256(content).hexdigest()
+        upload = dict(Bucket=props["bootstrapBucket"],
+                      Key="milldeploy/user-data/%s" % digest,
+                      Body=content)
+        stub = USER_DATA_FETCH_STUB % dict(region=region,
+                                           bucket=upload["Bucket"],
+                                           key=upload["Key"], digest=digest)
+        user_data = compress_user_data(
+            [(stub.encode("utf-8"), "fetch-%s" % filename)] + parts)
+    if len(user_data) > USER_DATA_LIMIT:
+        raise click.ClickException(
+            "%s is %d bytes compressed, over the %d byte user data limit; %s" %
+            (filename, len(user_data), USER_DATA_LIMIT,
+             "set bootstrapBucket to store it there" if offloadable else
+             "only shell scripts and cloud-configs can be stored in "
+             "bootstrapBucket"))
+    return user_data, upload
+
+def compress_user_data(parts):
+    # parts are (content, filename) pairs
+    # 8bit rather than base64 so the script itself is what gets gzipped
+    charset = email.charset.Charset("utf-8")
+    charset.body_encoding = None
+    # a boundary derived from the content instead of a random one
+    digest = hashlib.sha256()
+    for content, _ in parts:
+        digest.update(content)
+    message = email.mime.multipart.MIMEMultipart(
+        boundary="==milldeploy-%s==" % digest.hexdigest()[:16])
+    for content, filename in parts:
+        first_line = content.split(b"\n", 1)[0].decode("utf-8", "replace")
+        subtype = next((t for prefix, t in USER_DATA_TYPES
+                        if first_line.startswith(prefix)), 'x-shellscript')
+        part = email.mime.text.MIMEText(content.decode("utf-8"), subtype,
+                                        charset)
+        part.add_header('Content-Disposition', 'attachment',
+                        filename=filename)
+        message.attach(part)
+    return gzip.compress(message.as_bytes(), mtime=0)
+
+def create_group_config(fleet, jar_version, env_prefix, topology,
+                        base_launch_config, user_data):
+    launch_config = dict(
+        InstanceType=fleet.instance_type,
+        UserData=user_data)
+    if fleet.spot_price is not None:
+        launch_config["SpotPrice"] = fleet.spot_price
+    if fleet.volume_size is not None:
+        launch_config["BlockDeviceMappings"] = [
             {
-                'Name': 'group-name',
-                'Values': [
-                    'mill-vpc',
-                ]
+                'DeviceName': '/dev/sda1',
+                'Ebs': {
+                    'VolumeSize': fleet.volume_size,
+                    'VolumeType': 'gp2',
+                }
+            },
+        ]
+    launch_config.update(base_launch_config)
+    name_launch_config(launch_config, fleet.launch_config_role, jar_version)
+
+    asg = dict(
+         AutoScalingGroupName=fleet.name,
+         LaunchConfigurationName=get_name(launch_config),
+         MinSize=fleet.min_size,
+         MaxSize=fleet.max_size,
+         AvailabilityZones=topology.availability_zones,
+         VPCZoneIdentifier=topology.subnet_ids_as_string())
+
+    if fleet.queue is None:
+        return AutoScaleGroupConfig(asg, launch_config, None, None, None,
+                                    None, role=fleet.role)
+
+    queue_name = QueueNames().format(env_prefix, fleet.queue)
+    return AutoScaleGroupConfig(
+        asg,
+        launch_config,
+        create_simple_policy(fleet.name, 'Scale Up', 1, fleet.scale_up),
+        create_queue_alarm(queue_name, fleet.scale_up),
+        create_simple_policy(fleet.name, 'Scale Down', -1, fleet.scale_down),
+        create_queue_alarm(queue_name, fleet.scale_down),
+        role=fleet.role)
+
+def create_simple_policy(scaling_group_name, policy_name, adjustment, alarm):
+    return dict(AutoScalingGroupName=scaling_group_name,
+        PolicyName=policy_name,
+        PolicyType='SimpleScaling',
+        Cooldown=alarm.cooldown,
+        ScalingAdjustment=adjustment,
+        AdjustmentType='ChangeInCapacity')
+
+def create_queue_alarm(queue_name, alarm):
+    if alarm.latency_slo is not None:
+        return create_queue_latency_alarm(queue_name, alarm)
+    return dict(
+        AlarmName=alarm.alarm_name,
+        AlarmDescription=alarm.description,
+        ActionsEnabled=True,
+        AlarmActions=[],
+        MetricName=alarm.metric,
+        Namespace='AWS/SQS',
+        Statistic='Average',
+        Dimensions=[
+            {
+                'Name': 'QueueName',
+                'Value': queue_name
             },
         ],
+        Period=alarm.period,
+        Threshold=alarm.threshold,
+        EvaluationPeriods=alarm.evaluation_periods,
+        ComparisonOperator=alarm.comparison
     )
 
-    check_response(response)
+def create_queue_latency_alarm(queue_name, alarm):
+    # metric math, as composite alarms cannot trigger scaling policies
+    def queue_metric(metric_id, metric_name, stat):
+        return dict(Id=metric_id,
+                    MetricStat=dict(
+                        Metric=dict(Namespace='AWS/SQS',
+                                    MetricName=metric_name,
+                                    Dimensions=[dict(Name='QueueName',
+                                                     Value=queue_name)]),
+                        Period=alarm.period,
+                        Stat=stat),
+                    ReturnData=False)
 
-    group_id =  response["SecurityGroups"][0]["GroupId"]
-    click.echo("security group id found: %s" % group_id)
-    return group_id
+    return dict(
+        AlarmName=alarm.alarm_name,
+        AlarmDescription=alarm.description,
+        ActionsEnabled=True,
+        AlarmActions=[],
+        Metrics=[
+            queue_metric('depth', alarm.metric, 'Average'),
+            queue_metric('age', 'ApproximateAgeOfOldestMessage', 'Maximum'),
+            dict(Id='backlog',
+                 Expression=get_latency_expression(alarm.threshold,
+                                                   alarm.latency_slo),
+                 Label='%s backlog or latency' % queue_name,
+                 ReturnData=True),
+        ],
+        Threshold=alarm.threshold,
+        EvaluationPeriods=alarm.evaluation_periods,
+        ComparisonOperator=alarm.comparison
+    )
+
+def get_latency_expression(threshold, latency_slo, depth='depth'):
+    return 'MAX([%s, age * %s / %d])' % (depth, threshold, latency_slo)
+
+def get_alarm_period(alarm):
+    if "Period" in alarm:
+        return alarm["Period"]
+    return next(m["MetricStat"]["Period"] for m in alarm["Metrics"]
+                if "MetricStat" in m)
+
+def read_fleet_spec(config_dir):
+    path = os.path.join(config_dir, FLEET_SPEC_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            spec = json.load(f)
+    except ValueError as e:
+        raise click.ClickException("%s: %s" % (path, e))
+    if not isinstance(spec, dict):
+        raise click.ClickException("%s: expected an object" % path)
+    top = SpecValues(spec, "")
+    top.get('fleets', dict, {})
+    top.get('queues', dict, {})
+    top.check_unused()
+    return spec
+
+def merge_spec(defaults, overrides, section):
+    # overrides replace single settings of a default, one level deep
+    merged = collections.OrderedDict(
+        (name, dict(values)) for name, values in defaults.items())
+    for name, values in (overrides or {}).items():
+        if not isinstance(values, dict):
+            raise click.ClickException("%s: %s.%s must be an object"
+                                       % (FLEET_SPEC_FILE, section, name))
+        entry = merged.setdefault(name, {})
+        for key, value in values.items():
+            if isinstance(value, dict) and isinstance(entry.get(key), dict):
+                value = dict(entry[key], **value)
+            entry[key] = value
+    return merged
+
+def load_fleet_specs(config_dir):
+    fleets = merge_spec(DEFAULT_FLEETS,
+                        read_fleet_spec(config_dir).get('fleets'), 'fleets')
+    specs = [FleetSpec(role, values) for role, values in fleets.items()]
+    names = [f.name for f in specs]
+    for name in set(names):
+        if names.count(name) > 1:
+            raise click.ClickException("%s: more than one fleet is named %s"
+                                       % (FLEET_SPEC_FILE, name))
+    return specs
+
+def load_queue_specs(config_dir):
+    queues = merge_spec(DEFAULT_QUEUES,
+                        read_fleet_spec(config_dir).get('queues'), 'queues')
+    for queue in queues:
+        if queue not in QueueNames.ALL:
+            raise click.ClickException("%s: queues.%s is not a mill queue"
+                                       % (FLEET_SPEC_FILE, queue))
+    specs = [QueueSpec(queue, values) for queue, values in queues.items()]
+    redriven = dict((s.queue, s.dead_letter_queue) for s in specs)
+    for spec in specs:
+        if redriven.get(spec.dead_letter_queue):
+            raise click.ClickException(
+                "%s: queues.%s.deadLetterQueue %s has a dead letter queue "
+                "itself" % (FLEET_SPEC_FILE, spec.queue,
+                            spec.dead_letter_queue))
+    return specs
+
+def get_role_property(props, name, role, default, convert=str):
+    # "<name>.<role>" overrides "<name>", which overrides the default
+    value = props.get("%s.%s" % (name, role), props.get(name))
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return convert(value.strip())
+    except ValueError:
+        raise click.ClickException("invalid value for %s.%s: %s" %
+                                   (name, role, value))
+
+def parse_instance_pools(entries, source):
+    # "instance type[:weight]" entries
+    pools = []
+    for entry in entries:
+        instance_type, _, weight = str(entry).strip().partition(":")
+        if not weight.strip():
+            weight = "1"
+        if not weight.strip().isdigit() or int(weight) < 1:
+            raise click.ClickException("invalid weight in %s: %s" %
+                                       (source, entry))
+        pools.append((instance_type.strip(), int(weight)))
+    return pools
+
+def parse_scale_up_steps(entries, source, scale_up):
+    # each step is (threshold, adjustment type, adjustment, warmup); the
+    # fleet's own scale up threshold stays the first step unless the
+    # entries list every step themselves
+    if scale_up is None:
+        return []
+    steps = []
+    if entries is None:
+        steps.append((scale_up.threshold, 'ChangeInCapacity', 1,
+                      scale_up.cooldown))
+        entries = DEFAULT_SCALE_UP_STEPS.split(",")
+    for entry in entries:
+        parts = [p.strip() for p in str(entry).split(":")]
+        try:
+            if len(parts) not in (2, 3):
+                raise ValueError(entry)
+            threshold = int(parts[0])
+            adjustment = parts[1]
+            adjustment_type = 'ChangeInCapacity'
+            if adjustment.endswith("%"):
+                adjustment = adjustment[:-1]
+                adjustment_type = 'PercentChangeInCapacity'
+            adjustment = int(adjustment)
+            warmup = int(parts[2]) if len(parts) == 3 else scale_up.cooldown
+        except ValueError:
+            raise click.ClickException("invalid step in %s: %s" %
+                                       (source, entry))
+        if adjustment < 1:
+            raise click.ClickException("%s must scale up: %s" %
+                                       (source, entry))
+        steps.append((threshold, adjustment_type, adjustment, warmup))
+    steps.sort(key=lambda s: s[0])
+    # only the first band at a threshold is kept
+    return [s for n, s in enumerate(steps)
+            if n == 0 or s[0] != steps[n - 1][0]]
+
+def create_queue_configs(env_prefix, queue_specs):
+    queues = collections.OrderedDict()
+    for spec in queue_specs:
+        qname = QueueNames().format(env_prefix, spec.queue)
+        attributes = {
+            'VisibilityTimeout': str(spec.visibility_timeout),
+            'ReceiveMessageWaitTimeSeconds': str(spec.wait_time),
+            'MessageRetentionPeriod': str(spec.retention)
+        }
+        if spec.dead_letter_queue is None:
+            queues[qname] = QueueConfig(attributes)
+        else:
+            queues[qname] = QueueConfig(
+                attributes,
+                QueueNames().format(env_prefix, spec.dead_letter_queue),
+                spec.max_receive_count)
+    return queues
+
+def plan_changes(clients, inventory, queue_inventory, queues, groups,
+                 launch_config_retention):
+    deploy_plan = DeployPlan()
+
+    queue_nodes = {}
+    # dead letter queues go first, the queues redriving to them need
+    # their arns
+    for qname in sorted(queues, key=lambda q:
+                        queues[q].dead_letter_queue is not None):
+        queue = queues[qname]
+        live = queue_inventory.get_attributes(qname)
+        get_attributes = lambda results, queue=queue: queue.attributes
+        deps = []
+        desired = queue.attributes
+        if queue.dead_letter_queue is not None:
+            live_dead_letter = queue_inventory.get_attributes(
+                queue.dead_letter_queue)
+            if live_dead_letter is None:
+                arn_node = "queue-arn:%s" % queue.dead_letter_queue
+                if not deploy_plan.has(arn_node):
+                    deploy_plan.support(
+                        "queue-arn", queue.dead_letter_queue,
+                        lambda results, node=queue_nodes[
+                            queue.dead_letter_queue]:
+                            get_queue_arn(clients.sqs, results[node]),
+                        [queue_nodes[queue.dead_letter_queue]])
+                get_attributes = (lambda results, queue=queue, node=arn_node:
+                                  queue.redrive_attributes(results[node]))
+                deps = [arn_node]
+            else:
+                desired = queue.redrive_attributes(
+                    live_dead_letter["QueueArn"])
+                get_attributes = lambda results, desired=desired: desired
+
+        if live is None:
+            queue_nodes[qname] = deploy_plan.create(
+                "queue", qname,
+                lambda results, qname=qname, get_attributes=get_attributes:
+                    create_sqs_queue(clients.sqs, qname,
+                                     get_attributes(results)),
+                deps)
+            continue
+        diffs = diff_attributes(desired, live)
+        if diffs:
+            queue_nodes[qname] = deploy_plan.update(
+                "queue", qname,
+                lambda results, qname=qname, get_attributes=get_attributes:
+                    update_sqs_queue(clients.sqs,
+                                     queue_inventory.get_url(qname),
+                                     get_attributes(results)),
+                deps, diffs)
+        else:
+            deploy_plan.unchanged("queue", qname)
+
+    topic_node = "topic:%s" % NOTIFICATION_TOPIC
+    desired_alarms = set(a["AlarmName"] for i in groups
+                         for p, a in i.scaling_policies() if a is not None)
+
+    for i in groups:
+        asg = i.autoscale_group
+        asg_name = asg["AutoScalingGroupName"]
+        launch_config = i.launch_config
+        lc_name = get_name(launch_config)
+
+        # user data stored in bootstrapBucket goes up before anything that
+        # can launch an instance fetching it
+        upload_nodes = []
+        upload = i.user_data_upload
+        if upload is not None:
+            # fleets sharing a cloud-init script share the object
+            upload_name = "s3://%s/%s" % (upload["Bucket"], upload["Key"])
+            upload_node = "user-data:%s" % upload_name
+            if deploy_plan.has(upload_node):
+                upload_nodes = [upload_node]
+            elif inventory.user_data_object_exists(upload["Bucket"],
+                                                   upload["Key"]):
+                if upload_node not in deploy_plan.unchanged_resources:
+                    deploy_plan.unchanged("user-data", upload_name)
+            else:
+                upload_nodes = [deploy_plan.create(
+                    "user-data", upload_name,
+                    lambda results, upload=upload: put_user_data_object(
+                        clients.s3, upload))]
+
+        if i.launch_template is not None:
+            launch_config = i.launch_template
+            lt_name = get_name(launch_config)
+            if inventory.launch_template_exists(lt_name):
+                deploy_plan.unchanged("launch-template", lt_name)
+                launch_config_nodes = []
+            else:
+                launch_config_nodes = [deploy_plan.create(
+                    "launch-template", lt_name,
+                    lambda results, lt=launch_config: create_launch_template(
+                        clients.ec2, lt),
+                    upload_nodes)]
+        elif inventory.launch_config_exists(lc_name):
+            deploy_plan.unchanged("launch-config", lc_name)
+            launch_config_nodes = []
+        else:
+            launch_config_nodes = [deploy_plan.create(
+                "launch-config", lc_name,
+                lambda results, lc=launch_config: create_launch_config(
+                    clients.autoscaling, lc),
+                upload_nodes)]
+
+        live_group = inventory.get_group(asg_name)
+        if live_group is None:
+            asg_nodes = [deploy_plan.create(
+                "autoscale-group", asg_name,
+                lambda results, asg=asg, lc=launch_config:
+                    create_autoscale_group(clients.autoscaling, asg, lc),
+                launch_config_nodes)]
+        else:
+            diffs = diff_attributes(asg, live_group)
+            if diffs:
+                asg_nodes = [deploy_plan.update(
+                    "autoscale-group", asg_name,
+                    lambda results, asg=asg, lc=launch_config:
+                        update_existing_autoscale_group(clients.autoscaling,
+                                                        asg, lc),
+                    launch_config_nodes, diffs)]
+            else:
+                deploy_plan.unchanged("autoscale-group", asg_name)
+                asg_nodes = []
+
+        for stale in get_stale_launch_configs(inventory, asg_name, lc_name,
+                                              launch_config_retention):
+            deploy_plan.delete(
+                "launch-config", stale,
+                lambda results, name=stale: delete_launch_config(
+                    clients.autoscaling, name),
+                asg_nodes)
+
+        if i.role != "sentinel":
+            lt_name = (i.launch_template or {}).get("LaunchTemplateName")
+            for stale in get_stale_launch_templates(inventory, asg_name,
+                                                    i.role, lt_name,
+                                                    launch_config_retention):
+                deploy_plan.delete(
+                    "launch-template", stale,
+                    lambda results, name=stale: delete_launch_template(
+                        clients.ec2, name),
+                    asg_nodes)
+
+        hook_nodes = []
+        for hook in i.lifecycle_hooks:
+            hook_name = "%s:%s" % (asg_name, hook["LifecycleHookName"])
+            live_hook = inventory.get_lifecycle_hook(
+                asg_name, hook["LifecycleHookName"])
+            diffs = diff_attributes(hook, live_hook or {})
+            if live_hook is None:
+                hook_nodes.append(deploy_plan.create(
+                    "lifecycle-hook", hook_name,
+                    lambda results, hook=hook: put_lifecycle_hook(
+                        clients.autoscaling, hook),
+                    asg_nodes))
+            elif diffs:
+                hook_nodes.append(deploy_plan.update(
+                    "lifecycle-hook", hook_name,
+                    lambda results, hook=hook: put_lifecycle_hook(
+                        clients.autoscaling, hook),
+                    asg_nodes, diffs))
+            else:
+                deploy_plan.unchanged("lifecycle-hook", hook_name)
+
+        live_pool = inventory.get_warm_pool(asg_name)
+        if i.warm_pool is not None:
+            # a pool without a prepared capacity reports none
+            live_pool = dict(live_pool or {})
+            live_pool.setdefault("MaxGroupPreparedCapacity", -1)
+            diffs = diff_attributes(i.warm_pool, live_pool)
+            if "PoolState" not in live_pool:
+                deploy_plan.create(
+                    "warm-pool", asg_name,
+                    lambda results, asg_name=asg_name, pool=i.warm_pool:
+                        put_warm_pool(clients.autoscaling, asg_name, pool),
+                    asg_nodes + hook_nodes)
+            elif diffs:
+                deploy_plan.update(
+                    "warm-pool", asg_name,
+                    lambda results, asg_name=asg_name, pool=i.warm_pool:
+                        put_warm_pool(clients.autoscaling, asg_name, pool),
+                    asg_nodes + hook_nodes, diffs)
+            else:
+                deploy_plan.unchanged("warm-pool", asg_name)
+        else:
+            pool_nodes = []
+            if live_pool is not None and \
+                    live_pool.get("Status") != "PendingDelete":
+                pool_nodes = [deploy_plan.delete(
+                    "warm-pool", asg_name,
+                    lambda results, asg_name=asg_name: delete_warm_pool(
+                        clients.autoscaling, asg_name))]
+            if inventory.get_lifecycle_hook(asg_name, BOOTSTRAP_HOOK):
+                deploy_plan.delete(
+                    "lifecycle-hook", "%s:%s" % (asg_name, BOOTSTRAP_HOOK),
+                    lambda results, asg_name=asg_name:
+                        delete_lifecycle_hook(clients.autoscaling, asg_name,
+                                              BOOTSTRAP_HOOK),
+                    pool_nodes)
+
+        desired_actions = set()
+        for action in i.scheduled_actions:
+            action_name = action["ScheduledActionName"]
+            desired_actions.add(action_name)
+            live_action = inventory.scheduled_actions.get(
+                (asg_name, action_name))
+            put_action = (lambda results, action=action:
+                          put_scheduled_action(clients.autoscaling, action))
+            diffs = diff_attributes(action, live_action or {})
+            if live_action is None:
+                deploy_plan.create("scheduled-action",
+                                   "%s:%s" % (asg_name, action_name),
+                                   put_action, asg_nodes)
+            elif diffs:
+                deploy_plan.update("scheduled-action",
+                                   "%s:%s" % (asg_name, action_name),
+                                   put_action, asg_nodes, diffs)
+            else:
+                deploy_plan.unchanged("scheduled-action",
+                                      "%s:%s" % (asg_name, action_name))
+        for live_action in inventory.get_scheduled_actions(asg_name):
+            action_name = live_action["ScheduledActionName"]
+            if action_name in desired_actions or \
+                    not action_name.startswith(SCHEDULED_ACTION_PREFIX):
+                continue
+            deploy_plan.delete(
+                "scheduled-action", "%s:%s" % (asg_name, action_name),
+                lambda results, asg_name=asg_name, name=action_name:
+                    delete_scheduled_action(clients.autoscaling, asg_name,
+                                            name))
+
+        live_metrics = set(m["Metric"] for m in
+                           (live_group or {}).get("EnabledMetrics", []))
+        missing_metrics = [m for m in i.enabled_metrics
+                           if m not in live_metrics]
+        if missing_metrics:
+            deploy_plan.add(Change(
+                Change.CREATE if live_group is None else Change.UPDATE,
+                "metrics-collection", asg_name,
+                lambda results, asg_name=asg_name, metrics=missing_metrics:
+                    enable_metrics_collection(clients.autoscaling, asg_name,
+                                              metrics),
+                asg_nodes, [("EnabledMetrics", sorted(live_metrics),
+                             sorted(live_metrics.union(missing_metrics)))]))
+
+        desired_policies = set(p["PolicyName"]
+                               for p, a in i.scaling_policies())
+        for live_policy in inventory.get_policies(asg_name):
+            if live_policy["PolicyName"] in desired_policies:
+                continue
+            deploy_plan.delete(
+                "scaling-policy",
+                "%s:%s" % (asg_name, live_policy["PolicyName"]),
+                lambda results, asg_name=asg_name,
+                       name=live_policy["PolicyName"]:
+                    delete_scaling_policy(clients.autoscaling, asg_name,
+                                          name))
+            for live_alarm in live_policy.get("Alarms", []):
+                alarm_name = live_alarm["AlarmName"]
+                # target tracking alarms are removed along with the policy
+                if (alarm_name in desired_alarms
+                        or alarm_name.startswith("TargetTracking-")
+                        or deploy_plan.has("alarm:%s" % alarm_name)):
+                    continue
+                deploy_plan.delete(
+                    "alarm", alarm_name,
+                    lambda results, name=alarm_name: delete_metric_alarm(
+                        clients.cloudwatch, name))
+
+        for policy, alarm in i.scaling_policies():
+            policy_name = "%s:%s" % (asg_name, policy["PolicyName"])
+            live_policy = inventory.get_policy(asg_name, policy["PolicyName"])
+            policy_node = None
+            if live_policy is None:
+                policy_node = deploy_plan.create(
+                    "scaling-policy", policy_name,
+                    lambda results, policy=policy: put_scaling_policy(
+                        clients.autoscaling, policy),
+                    asg_nodes)
+            else:
+                diffs = diff_attributes(policy, live_policy)
+                if diffs:
+                    policy_node = deploy_plan.update(
+                        "scaling-policy", policy_name,
+                        lambda results, policy=policy: put_scaling_policy(
+                            clients.autoscaling, policy),
+                        asg_nodes, diffs)
+                else:
+                    deploy_plan.unchanged("scaling-policy", policy_name)
+
+            if alarm is None:
+                continue
+
+            if policy_node is None:
+                get_policy_arn = (lambda results, arn=live_policy["PolicyARN"]:
+                                  arn)
+                alarm_deps = []
+            else:
+                get_policy_arn = (lambda results, node=policy_node:
+                                  results[node])
+                alarm_deps = [policy_node]
+            alarm_deps.extend(queue_nodes[q] for q in get_alarm_queues(alarm)
+                              if q in queue_nodes)
+
+            put_alarm = (lambda results, alarm=alarm, arn=get_policy_arn:
+                         put_metric_alarm(clients.cloudwatch, alarm,
+                                          arn(results)))
+            live_alarm = inventory.get_alarm(alarm["AlarmName"])
+            if live_alarm is None:
+                deploy_plan.create("alarm", alarm["AlarmName"], put_alarm,
+                                   alarm_deps)
+                continue
+
+            desired_alarm = dict(alarm)
+            if live_policy is not None:
+                desired_alarm["AlarmActions"] = [live_policy["PolicyARN"]]
+            diffs = diff_attributes(desired_alarm, live_alarm)
+            # a put replaces the whole alarm, so a unit we no longer set is
+            # only cleared by one
+            if live_alarm.get("Unit") and "Unit" not in alarm:
+                diffs.append(("Unit", live_alarm["Unit"], None))
+            if diffs:
+                deploy_plan.update("alarm", alarm["AlarmName"], put_alarm,
+                                   alarm_deps, diffs)
+            else:
+                deploy_plan.unchanged("alarm", alarm["AlarmName"])
+
+        live_types = inventory.get_notification_types(asg_name,
+                                                      NOTIFICATION_TOPIC)
+        if set(live_types) == set(NOTIFICATION_TYPES):
+            deploy_plan.unchanged("notifications", asg_name)
+            continue
+
+        if not deploy_plan.has(topic_node):
+            deploy_plan.support(
+                "topic", NOTIFICATION_TOPIC,
+                lambda results: get_notification_topic_arn(clients.sns))
+        put_notifications = (lambda results, asg_name=asg_name:
+                             setup_autoscale_notifications(
+                                 clients.autoscaling, results[topic_node],
+                                 asg_name))
+        deps = asg_nodes + [topic_node]
+        if live_group is None:
+            deploy_plan.create("notifications", asg_name, put_notifications,
+                               deps)
+        else:
+            deploy_plan.update("notifications", asg_name, put_notifications,
+                               deps, [("NotificationTypes", sorted(live_types),
+                                       sorted(NOTIFICATION_TYPES))])
+
+    return deploy_plan
+
+def checkout_mill_init(url, ref, cache_dir, offline=False, seed=None,
+                       expected_commit=None):
+    # one shallow clone per repository url, refetched only when the ref changes
+    url_key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    path = os.path.join(cache_dir, "mill-init", url_key, "mill-init")
 
-def get_subnets(ec2_client):
+    if not os.path.isdir(os.path.join(path, ".git")):
+        shutil.rmtree(path, ignore_errors=True)
+        if seed:
+            click.echo("seeding mill-init cache from %s" % seed)
+            seed_mill_init_cache(seed, path)
+            try:
+                seeded = Repo(path)
+            except (InvalidGitRepositoryError, NoSuchPathError):
+                shutil.rmtree(path, ignore_errors=True)
+                raise click.ClickException(
+                    "mill-init seed %s is not a git repository" % seed)
+            # later fetches go to --mill_init_url, not wherever the seed
+            # was cloned from
+            if 'origin' in [remote.name for remote in seeded.remotes]:
+                seeded.remote('origin').set_url(url)
+            else:
+                seeded.create_remote('origin', url)
+        elif offline:
+            raise click.ClickException(
+                "no cached mill-init in %s; pass --mill_init_seed to use a "
+                "pre-seeded copy offline" % path)
+        else:
+            click.echo("cloning %s into %s" % (url, path))
+            os.makedirs(path)
+            Repo.init(path).create_remote('origin', url)
+
+    repo = Repo(path)
+    marker = os.path.join(repo.git_dir, "milldeploy-ref")
+    cached_ref = None
+    if os.path.exists(marker):
+        with open(marker, 'r') as f:
+            cached_ref = f.read().strip()
+
+    if cached_ref != ref:
+        if offline:
+            click.echo("checking out mill-init %s offline" % ref)
+            try:
+                repo.git.checkout('--force', ref)
+            except GitCommandError:
+                raise click.ClickException(
+                    "mill-init %s is not in the cache in %s; run once "
+                    "without --offline to fetch it first" % (ref, path))
+        else:
+            click.echo("fetching mill-init %s" % ref)
+            try:
+                repo.git.fetch('--depth', '1', 'origin', ref)
+                repo.git.checkout('--force', 'FETCH_HEAD')
+            except GitCommandError as e:
+                raise click.ClickException(
+                    "could not fetch mill-init %s from %s: %s" %
+                    (ref, url, (e.stderr or str(e)).strip()))
+        with open(marker, 'w') as f:
+            f.write(ref)
+    else:
+        click.echo("using cached mill-init %s" % ref)
+
+    commit = repo.head.commit.hexsha
+    if expected_commit and not commit.startswith(expected_commit):
+        raise click.ClickException(
+            "mill-init %s is at commit %s, expected %s" %
+            (ref, commit, expected_commit))
+    click.echo("mill-init %s at commit %s" % (ref, commit))
+    return MillInitCheckout(path, ref, commit)
+
+def seed_mill_init_cache(seed, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.isdir(seed):
+        shutil.copytree(seed, path, symlinks=True)
+        return
+
+    extract_dir = tempfile.mkdtemp(dir=os.path.dirname(path))
+    try:
+        with tarfile.open(seed) as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(extract_dir, filter='data')
+            else:
+                tar.extractall(extract_dir)
+        root = extract_dir
+        entries = os.listdir(root)
+        # accept tarballs of the repository contents or of its directory
+        if len(entries) == 1 and not os.path.exists(os.path.join(root,
+                                                                 ".git")):
+            root = os.path.join(root, entries[0])
+        os.rename(root, path)
+    finally:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+
+def resolve_vpc_topology(ec2_client, cache_file=None, ttl=0):
+    if cache_file and ttl > 0:
+        topology = read_cached_topology(cache_file, ttl)
+        if topology is not None:
+            click.echo("using cached vpc topology from %s" % cache_file)
+            return topology
+
+    vpcs = paginate(ec2_client, 'describe_vpcs', 'Vpcs', Filters=[
+        {
+            'Name': 'tag-value',
+            'Values': [
+                'duracloud',
+            ]
+        },
+    ])
+    if not vpcs:
+        raise click.ClickException("no vpc tagged 'duracloud' was found")
+    vpc_id = vpcs[0]["VpcId"]
+    click.echo("retrieved vpc: %s" % vpc_id)
 
-    response = ec2_client.describe_vpcs(Filters=[
+    vpc_filter = {'Name': 'vpc-id', 'Values': [vpc_id]}
+    subnets = paginate(ec2_client, 'describe_subnets', 'Subnets',
+                       Filters=[vpc_filter])
+
+    subnet_ids = []
+    av_zones = []
+    for subnet in subnets:
+        subnet_ids.append(subnet["SubnetId"])
+        av_zone = subnet["AvailabilityZone"]
+        if av_zone not in av_zones:
+            av_zones.append(av_zone)
+    click.echo("retrieved subnet ids: %s" % subnet_ids)
+
+    security_groups = paginate(
+        ec2_client, 'describe_security_groups', 'SecurityGroups',
+        Filters=[
             {
-                'Name': 'tag-value',
+                'Name': 'group-name',
                 'Values': [
-                    'duracloud',
+                    'mill-vpc',
                 ]
             },
-        ],
-    )
-
-    check_response(response)
-    vpcId = response["Vpcs"][0]["VpcId"]
-    click.echo("retrieved vpc: %s" % vpcId)
-
-    response = ec2_client.describe_subnets()
-    check_response(response)
-    subnets = response["Subnets"]
-
-    vpc_subnets = []
-    for subnet in subnets:
-        if subnet["VpcId"] == vpcId:
-            vpc_subnets.append(subnet)
+            vpc_filter,
+        ])
+    if not security_groups:
+        raise click.ClickException("no security group named 'mill-vpc' was "
+                                   "found in %s" % vpc_id)
+    group_id = security_groups[0]["GroupId"]
+    click.echo("security group id found: %s" % group_id)
 
-    return vpc_subnets
+    topology = VpcTopology(vpc_id, subnet_ids, av_zones, group_id)
+    if cache_file and ttl > 0:
+        write_cached_topology(cache_file, topology)
+    return topology
 
-def get_subnet_availability_zones(ec2_client):
-    av_zones = []
-    subnets = get_subnets(ec2_client)
-    for subnet in subnets:
-        av_zone = subnet["AvailabilityZone"]
-        if av_zones not in av_zones:
-            av_zones.append(av_zone)
+def get_topology_cache_file(cache_dir, aws_profile, region):
+    return os.path.join(cache_dir, "vpc-topology-%s-%s.json" %
+                        (aws_profile, region))
 
-    return av_zones
+def read_cached_topology(cache_file, ttl):
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if time.time() - cached.get("resolved_at", 0) > ttl:
+        return None
+    return VpcTopology.from_dict(cached["topology"])
 
-def get_subnet_ids_as_string(ec2_client):
-    subnet_ids = []
-    subnets = get_subnets(ec2_client)
+def write_cached_topology(cache_file, topology):
+    write_json_atomically(cache_file, dict(resolved_at=time.time(),
+                                           topology=topology.to_dict()))
 
-    for subnet in subnets:
-        subnet_ids.append(subnet["SubnetId"])
+def write_json_atomically(path, data, sort_keys=True):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=sort_keys)
+    os.replace(tmp_path, path)
 
-    click.echo("retrieved subnet ids: %s" % subnet_ids)
-    return ",".join(subnet_ids)
+def get_notification_topic_arn(sns_client):
+    return sns_client.create_topic(Name=NOTIFICATION_TOPIC)['TopicArn']
 
-def setup_autoscale_notifications(sns_client, autoscale_client,
+def setup_autoscale_notifications(autoscale_client, topic_arn,
                                   autoscale_group_name):
-    topic_arn = sns_client.create_topic(Name='mill-notification')['TopicArn']
     response = autoscale_client.put_notification_configuration(
     AutoScalingGroupName=autoscale_group_name,
     TopicARN=topic_arn,
-    NotificationTypes=[
-        'autoscaling:EC2_INSTANCE_LAUNCH',
-        'autoscaling:EC2_INSTANCE_TERMINATE',
-        'autoscaling:EC2_INSTANCE_LAUNCH_ERROR',
-        'autoscaling:EC2_INSTANCE_TERMINATE_ERROR',
-    ])
-    check_response(response)
+    NotificationTypes=NOTIFICATION_TYPES)
+    check_response(response, "put_notification_configuration")
     click.echo("configured notifications on topic %s for %s" % (topic_arn,
                                                    autoscale_group_name))
 
@@ -291,675 +3464,748 @@ def read_properties_files_into_dict(path):
             myprops[k] = v
     return myprops
 
-def read_file_as_string(path):
-    return open(path, 'r').read()
+def generate_cloud_init(mill_init, config_dir, cache_dir):
+    # generated scripts are cached by a hash of the inputs and mill-init
+    # commit; each script is stored once under the hash of its content
+    cloud_init_dir = os.path.join(cache_dir, "cloud-init")
+    inputs_key = get_cloud_init_inputs_key(mill_init, config_dir)
+    manifest_path = os.path.join(cloud_init_dir, "manifests",
+                                 "%s.json" % inputs_key)
 
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if not all(os.path.exists(get_blob_path(cloud_init_dir, digest))
+                   for digest in manifest.values()):
+            manifest = None
 
-def autoscale_exists(client, asg):
-    click.echo("auto scaling groups: ")
-    groups = client.describe_auto_scaling_groups()
+    if manifest is None:
+        manifest = run_cloud_init_generator(mill_init, config_dir,
+                                            cloud_init_dir)
+        write_json_atomically(manifest_path, manifest)
+    else:
+        click.echo("cloud-init inputs unchanged, using cached scripts %s" %
+                   inputs_key)
 
-    #click.echo("keys: %s" % groups['AutoScalingGroups'])
-    autoscalingGroups = groups['AutoScalingGroups']
+    cloud_init = {}
+    for role, digest in manifest.items():
+        with open(get_blob_path(cloud_init_dir, digest), 'r') as f:
+            cloud_init[role] = f.read()
+    return cloud_init
 
-    for group in autoscalingGroups:
-        group_name = group["AutoScalingGroupName"]
-        if group_name == asg['AutoScalingGroupName']:
-            click.echo("%s already exists." % group_name)
-            return True
+def get_cloud_init_inputs_key(mill_init, config_dir):
+    digest = hashlib.sha256()
+    digest.update(mill_init.commit.encode("utf-8"))
+    for flag, filename in CLOUD_INIT_INPUTS:
+        with open(os.path.join(config_dir, filename), 'rb') as f:
+            content = f.read()
+        digest.update(("\0%s\0%s\0%d\0" %
+                       (flag, filename, len(content))).encode("utf-8"))
+        digest.update(content)
+    return digest.hexdigest()
 
-    return False
+def get_blob_path(cloud_init_dir, digest):
+    return os.path.join(cloud_init_dir, "blobs", digest[:2], digest)
+
+def run_cloud_init_generator(mill_init, config_dir, cloud_init_dir):
+    output_dir = tempfile.mkdtemp(prefix="cloud-init-")
+    try:
+        # run from the parent of the checkout as it was run from a
+        # ./mill-init clone before
+        args = [os.path.join(os.path.basename(mill_init.path),
+                             'generate-all-cloud-init.py')]
+        for flag, filename in CLOUD_INIT_INPUTS:
+            args.extend([flag, os.path.abspath(os.path.join(config_dir,
+                                                            filename))])
+        args.extend(['-o', output_dir])
+        click.echo("generating cloud-init scripts with mill-init %s" %
+                   mill_init.commit)
+        try:
+            subprocess.run(args, cwd=os.path.dirname(mill_init.path),
+                           check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise click.ClickException("cloud-init generation failed: %s" % e)
+
+        manifest = {}
+        for role in CLOUD_INIT_ROLES:
+            path = os.path.join(output_dir, "cloud-init-%s.txt" % role)
+            if not os.path.exists(path):
+                raise click.ClickException("mill-init did not generate %s" %
+                                           os.path.basename(path))
+            with open(path, 'rb') as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+            blob_path = get_blob_path(cloud_init_dir, digest)
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                tmp_path = "%s.%d.tmp" % (blob_path, os.getpid())
+                with open(tmp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, blob_path)
+            manifest[role] = digest
+        return manifest
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def paginate(client, operation, key, **kwargs):
+    items = []
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        items.extend(page.get(key, []))
+    return items
 
 def create_autoscale_group(client, asg, launch_config):
-    click.echo(("creating auto scale group %s and associating it with %s" %
-               (asg, get_name(launch_config))))
+    click.echo("creating auto scale group %s and associating it with %s" %
+               (asg["AutoScalingGroupName"], get_name(launch_config)))
+    echo_request(asg)
     response = client.create_auto_scaling_group(**asg)
-    check_response(response)
+    check_response(response, "create_auto_scaling_group")
     click.echo("created autoscale config: %s" % asg["AutoScalingGroupName"])
     return
 
 def update_existing_autoscale_group(client, asg, launch_config):
     name = get_name(launch_config)
-    click.echo(("updating existing auto scale group %s and linking it with "
-                "%s" %
-               (asg, name)))
+    click.echo("updating existing auto scale group %s and linking it with "
+               "%s" % (asg["AutoScalingGroupName"], name))
+    echo_request(asg)
 
     response = client.update_auto_scaling_group(**asg)
-    check_response(response)
-    click.echo("updated autoscale config: %s" % asg)
+    check_response(response, "update_auto_scaling_group")
+    click.echo("updated autoscale config: %s" % asg["AutoScalingGroupName"])
 
 def get_name(launch_config):
+    if "LaunchTemplateName" in launch_config:
+        return launch_config["LaunchTemplateName"]
     return launch_config["LaunchConfigurationName"]
 
-def check_response(response):
-    responseCode = response['ResponseMetadata']['HTTPStatusCode']
-    click.echo("responseCode = %s" % responseCode)
-    if responseCode < 200 and responseCode < 300:
-      raise(RuntimeError("failed to create launch config; response=%s" % (response)))
-    click.echo("response = %s" % response)
-
-def put_sqs_queues(sqs_client, env_prefix):
-    queue_names = QueueNames.ALL
-    for queue_name in queue_names:
-        #format name
-        qname = QueueNames().format(env_prefix, queue_name)
-        click.echo("creating queue %s" % qname)
-        #create queue
-        response = sqs_client.create_queue(
-            QueueName=qname,
-            Attributes={
-                'VisibilityTimeout': '1200',
-                'ReceiveMessageWaitTimeSeconds': '0',
-                'MessageRetentionPeriod': '1209600'
-            }
-        )
-        #verify result
-        check_response(response)
-        click.echo("created queue %s" % qname)
+def use_launch_template(group, jar_version, instance_pools,
+                        on_demand_base_capacity):
+    # moves a worker group from a single-type spot launch config to a
+    # launch template with a capacity-optimized mixed instances policy
+    launch_config = group.launch_config
+    user_data = launch_config["UserData"]
+    if not isinstance(user_data, bytes):
+        user_data = user_data.encode("utf-8")
 
+    template_data = dict(
+        ImageId=launch_config["ImageId"],
+        KeyName=launch_config["KeyName"],
+        IamInstanceProfile={'Name': launch_config["IamInstanceProfile"]},
+        SecurityGroupIds=launch_config["SecurityGroups"],
+        UserData=base64.b64encode(user_data).decode("ascii"))
+    if "BlockDeviceMappings" in launch_config:
+        template_data["BlockDeviceMappings"] = \
+            launch_config["BlockDeviceMappings"]
 
+    name = "mill-%s-%s" % (group.role, get_spec_digest(template_data))
+    group.launch_template = dict(
+        LaunchTemplateName=name,
+        VersionDescription="mill %s" % jar_version,
+        LaunchTemplateData=template_data)
 
-def create_launch_config(client, launch_config):
-    name = get_name(launch_config)
-    click.echo("creating launch config: %s" % name)
-    response = client.create_launch_configuration(**launch_config)
-    check_response(response)
-    click.echo("created launch config %s" % name)
-    return launch_config
+    instances_distribution = dict(
+        OnDemandBaseCapacity=on_demand_base_capacity,
+        OnDemandPercentageAboveBaseCapacity=0,
+        SpotAllocationStrategy='capacity-optimized')
+    if "SpotPrice" in launch_config:
+        # with weighted pools the max price applies per unit of capacity
+        instances_distribution["SpotMaxPrice"] = launch_config["SpotPrice"]
 
-def put_scaling_policy(auto_scaling_client,
-                       cloudwatch_client,
-                       scaling_policy,
-                       scaling_alarm):
-    if scaling_policy is None:
-        return
+    asg = group.autoscale_group
+    del asg["LaunchConfigurationName"]
+    asg["CapacityRebalance"] = True
+    asg["MixedInstancesPolicy"] = dict(
+        LaunchTemplate=dict(
+            LaunchTemplateSpecification=dict(LaunchTemplateName=name,
+                                             Version='$Default'),
+            Overrides=[dict(InstanceType=instance_type,
+                            WeightedCapacity=str(weight))
+                       for instance_type, weight in instance_pools]),
+        InstancesDistribution=instances_distribution)
 
-    click.echo("put scaling policy: %s" % scaling_policy)
-    response = auto_scaling_client.put_scaling_policy(**scaling_policy)
-    check_response(response)
-    policy_arn = response["PolicyARN"]
-    click.echo("successfully put scaling policy with PolicyArn: %s" % policy_arn)
+def use_warm_pool(group, warm_pool):
+    # the pool's instances bootstrap once and then wait stopped (or running);
+    # the launch hook keeps them from being stopped before cloud-init is done
+    group.warm_pool = dict(
+        PoolState=warm_pool.pool_state,
+        MinSize=warm_pool.min_size,
+        MaxGroupPreparedCapacity=(-1 if warm_pool.max_prepared_capacity is
+                                  None else warm_pool.max_prepared_capacity),
+        InstanceReusePolicy=dict(
+            ReuseOnScaleIn=warm_pool.reuse_on_scale_in))
+    group.lifecycle_hooks.append(dict(
+        AutoScalingGroupName=group.autoscale_group["AutoScalingGroupName"],
+        LifecycleHookName=BOOTSTRAP_HOOK,
+        LifecycleTransition='autoscaling:EC2_INSTANCE_LAUNCHING',
+        HeartbeatTimeout=warm_pool.bootstrap_timeout,
+        DefaultResult='CONTINUE'))
 
-    scaling_alarm["AlarmActions"]=[policy_arn]
+def use_prescaling(group, fleet, mill_props, start, duration, capacity):
+    # holds the fleet at a larger minimum size from start (UTC) for
+    # duration minutes of every run of the looping producer filling its
+    # queue, so the workers are up before the tasks arrive
+    asg_name = group.autoscale_group["AutoScalingGroupName"]
+    for producer, queue in LOOPING_PRODUCERS:
+        if queue != fleet.queue:
+            continue
+        frequency = parse_looping_frequency(
+            mill_props.get("looping.%s.frequency" % producer, "1m"),
+            "looping.%s.frequency" % producer)
+        if frequency is None:
+            continue
+        hold = capacity
+        if hold is None:
+            # enough workers to drain a full task queue in the window
+            tasks = int(mill_props.get(
+                "looping.%s.max-task-queue-size" % producer, 200000))
+            hold = fleet.max_size
+            if fleet.throughput:
+                hold = int(math.ceil(tasks / (fleet.throughput * duration)))
+        hold = min(hold, fleet.max_size)
+        if hold <= fleet.min_size:
+            continue
+        prescale, release = get_prescale_recurrences(
+            frequency, parse_time_of_day(start, "prescaleTime"), duration,
+            "looping.%s.frequency" % producer)
+        name = "%s%s" % (SCHEDULED_ACTION_PREFIX, producer)
+        group.scheduled_actions.append(dict(
+            AutoScalingGroupName=asg_name,
+            ScheduledActionName="%s-prescale" % name,
+            Recurrence=prescale,
+            MinSize=hold,
+            DesiredCapacity=hold))
+        group.scheduled_actions.append(dict(
+            AutoScalingGroupName=asg_name,
+            ScheduledActionName="%s-release" % name,
+            Recurrence=release,
+            MinSize=fleet.min_size))
 
-    cloudwatch_client.put_metric_alarm(**scaling_alarm)
-    click.echo("successfully put metric alarm %s" % scaling_alarm)
+def parse_looping_frequency(value, source):
+    # (count, unit) of a mill frequency such as 3h, 1d or 1m; None when
+    # the producer is off
+    match = re.match(r'^\s*(\d+)\s*([hdm])\s*$', value)
+    if match is None:
+        raise click.ClickException("invalid %s: %s" % (source, value))
+    count = int(match.group(1))
+    if count == 0:
+        return None
+    return count, match.group(2)
 
-def create_storage_stats_worker_config(jar_version, time,
-                                       subnet_id,
-                                       availability_zones,
-                                       env_prefix, base_launch_config):
-        # storage stats worker config
-    launch_config = dict(
-        LaunchConfigurationName=("storage stats worker %s %s" % (jar_version,
-                                                            time)),
-        InstanceType="m5.large",
-        SpotPrice="0.08",
-        UserData=read_file_as_string('output/cloud-init-storage-stats-worker.txt'))
-    launch_config.update(base_launch_config)
+def parse_time_of_day(value, source):
+    match = re.match(r'^(\d{1,2}):(\d{2})$', value)
+    if match is None or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise click.ClickException("invalid %s, expected HH:MM: %s" %
+                                   (source, value))
+    return int(match.group(1)) * 60 + int(match.group(2))
 
-    scaling_group_name = 'Storage Stats Worker'
-    asg = dict(
-         AutoScalingGroupName=scaling_group_name,
-         LaunchConfigurationName=get_name(launch_config),
-         MinSize=0,
-         MaxSize=1,
-         AvailabilityZones=availability_zones,
-         VPCZoneIdentifier=subnet_id)
+def get_prescale_recurrences(frequency, start, duration, source):
+    # cron expressions (UTC) for the start and end of every hold window
+    count, unit = frequency
+    period = count * {'h': 60, 'd': 1440, 'm': 28 * 1440}[unit]
+    if not 0 < duration < min(period, 1440):
+        raise click.ClickException(
+            "prescaleDuration of %d minutes must be positive and shorter "
+            "than a day and than %s" % (duration, source))
+    end = start + duration
 
-    scale_up_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Up',
-        PolicyType='SimpleScaling',
-        Cooldown=300,
-        ScalingAdjustment=1,
-        AdjustmentType='ChangeInCapacity')
-    scale_down_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Down',
-        PolicyType='SimpleScaling',
-        Cooldown=300,
-        ScalingAdjustment=-1,
-        AdjustmentType='ChangeInCapacity')
+    if unit == 'h':
+        # cron restarts the hours every day, so the runs must too
+        if 24 % count:
+            raise click.ClickException(
+                "%s of %dh does not divide a day and cannot be prescaled" %
+                (source, count))
 
-    scale_up_alarm = dict(
-        AlarmName='non-empty-storage-stats-queue',
-        AlarmDescription='storage stats queue is not empty',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.STORAGE_STATS)
-            },
-        ],
-        Period=60,
-        Threshold=0,
-        EvaluationPeriods=30,
-        ComparisonOperator='GreaterThanThreshold'
-    )
+        def hours(minute_of_day):
+            if count == 1:
+                return "*"
+            return ",".join(str(h) for h in sorted(
+                (minute_of_day // 60 + n * count) % 24
+                for n in range(24 // count)))
+        return ("%d %s * * *" % (start % 60, hours(start)),
+                "%d %s * * *" % (end % 60, hours(end)))
 
-    scale_down_alarm = dict(
-        AlarmName='empty-storage-stats-queue',
-        AlarmDescription='storage stats are empty',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.STORAGE_STATS)
-            },
-        ],
-        Period=300,
-        Threshold=0,
-        EvaluationPeriods=6,
-        ComparisonOperator='LessThanOrEqualToThreshold'
-    )
+    def day_field(day):
+        # the window may end on the day after it starts
+        if unit == 'd' and count == 1:
+            return "*"
+        if unit == 'm':
+            return str(day)
+        return "*/%d" % count if day == 1 else "%d-31/%d" % (day, count)
+    month = "*" if unit == 'd' or count == 1 else "*/%d" % count
+    return ("%d %d %s %s *" % (start % 60, start // 60, day_field(1), month),
+            "%d %d %s %s *" % (end % 60, end // 60 % 24,
+                               day_field(1 + end // 1440), month))
 
-    return AutoScaleGroupConfig(asg,
-                                launch_config,
-                                scale_up_policy,
-                                scale_up_alarm,
-                                scale_down_policy,
-                                scale_down_alarm)
-
-def create_audit_worker_config(jar_version, time,
-                                       subnet_id,
-                                       availability_zones,
-                                       env_prefix, base_launch_config):
-        # storage stats worker config
-    launch_config = dict(
-        LaunchConfigurationName=("audit worker %s %s" % (jar_version,
-                                                            time)),
-        InstanceType="m5.large",
-        SpotPrice="0.08",
-        UserData=read_file_as_string('output/cloud-init-audit-worker.txt'),
-        BlockDeviceMappings=[
-        {
-            'DeviceName': '/dev/sda1',
-            'Ebs': {
-                'VolumeSize': 60,
-                'VolumeType': 'gp2',
-            }
-        }])
+def use_step_scaling(group, steps, latency_slo=None):
+    # one step scaling policy and alarm per band, so each band has its own
+    # warmup; when several band alarms fire auto scaling applies the policy
+    # giving the largest capacity
+    asg_name = group.autoscale_group["AutoScalingGroupName"]
+    max_size = group.autoscale_group["MaxSize"]
+    base_alarm = group.scale_up_alarm
+    group.scale_up_steps = []
+    # the largest fixed step of the bands so far; a band is left out when
+    # it cannot add more than that, e.g. every band past the first of a
+    # group with maxSize 1
+    largest = 0
+    for threshold, adjustment_type, adjustment, warmup in steps:
+        if largest >= max_size:
+            break
+        if adjustment_type == 'ChangeInCapacity':
+            if min(adjustment, max_size) <= largest:
+                continue
+            largest = min(adjustment, max_size)
+        else:
+            # MinAdjustmentMagnitude makes it at least one instance
+            largest = max(largest, 1)
+        policy = dict(
+            AutoScalingGroupName=asg_name,
+            PolicyName='Scale Up Above %d' % threshold,
+            PolicyType='StepScaling',
+            AdjustmentType=adjustment_type,
+            MetricAggregationType='Average',
+            EstimatedInstanceWarmup=warmup,
+            StepAdjustments=[dict(MetricIntervalLowerBound=0,
+                                  ScalingAdjustment=adjustment)])
+        if adjustment_type == 'PercentChangeInCapacity':
+            policy["MinAdjustmentMagnitude"] = 1
+        alarm = dict(base_alarm)
+        alarm["AlarmName"] = "%s-above-%d" % (base_alarm["AlarmName"],
+                                              threshold)
+        alarm["AlarmDescription"] = "%s above %d" % (
+            base_alarm["AlarmDescription"], threshold)
+        alarm["Threshold"] = threshold
+        if latency_slo is not None and "Metrics" in base_alarm:
+            # the latency term scales with the band's own threshold
+            alarm["Metrics"] = [
+                dict(m, Expression=get_latency_expression(threshold,
+                                                          latency_slo))
+                if "Expression" in m else m
+                for m in base_alarm["Metrics"]]
+        group.scale_up_steps.append((policy, alarm))
+    group.scale_up_policy = None
+    group.scale_up_alarm = None
 
-    launch_config.update(base_launch_config)
+def use_target_tracking(group, target_backlog, instance_warmup,
+                        latency_slo=None):
+    # replaces the +/-1 simple scaling pair with a single target tracking
+    # policy on "visible messages / in service capacity" for the queue
+    queue_name = get_alarm_queues(group.scale_up_alarm)[0]
+    asg_name = group.autoscale_group["AutoScalingGroupName"]
 
-    scaling_group_name = 'Audit Worker'
-    asg = dict(
-         AutoScalingGroupName=scaling_group_name,
-         LaunchConfigurationName=get_name(launch_config),
-         MinSize=1,
-         MaxSize=10,
-         AvailabilityZones=availability_zones,
-         VPCZoneIdentifier=subnet_id)
-    scale_up_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Up',
-        PolicyType='SimpleScaling',
-        Cooldown=900,
-        ScalingAdjustment=1,
-        AdjustmentType='ChangeInCapacity')
-    scale_down_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Down',
-        PolicyType='SimpleScaling',
-        Cooldown=900,
-        ScalingAdjustment=-1,
-        AdjustmentType='ChangeInCapacity')
+    metrics = [
+        dict(Id='backlog',
+             MetricStat=dict(
+                 Metric=dict(
+                     Namespace='AWS/SQS',
+                     MetricName='ApproximateNumberOfMessagesVisible',
+                     Dimensions=[dict(Name='QueueName',
+                                      Value=queue_name)]),
+                 Stat='Sum'),
+             ReturnData=False),
+        # capacity rather than instance count so weighted
+        # launch template pools are accounted for
+        dict(Id='capacity',
+             MetricStat=dict(
+                 Metric=dict(
+                     Namespace='AWS/AutoScaling',
+                     MetricName='GroupInServiceCapacity',
+                     Dimensions=[dict(Name='AutoScalingGroupName',
+                                      Value=asg_name)]),
+                 Stat='Average'),
+             ReturnData=False),
+    ]
+    expression = 'backlog / IF(capacity > 0, capacity, 1)'
+    if latency_slo is not None:
+        # an oldest message latency_slo seconds old counts as being on
+        # target, so the group grows with latency even on a short queue
+        metrics.append(dict(
+            Id='age',
+            MetricStat=dict(
+                Metric=dict(Namespace='AWS/SQS',
+                            MetricName='ApproximateAgeOfOldestMessage',
+                            Dimensions=[dict(Name='QueueName',
+                                             Value=queue_name)]),
+                Stat='Maximum'),
+            ReturnData=False))
+        expression = get_latency_expression(target_backlog, latency_slo,
+                                            '(%s)' % expression)
+    metrics.append(dict(Id='backlog_per_instance',
+                        Expression=expression,
+                        Label='%s messages per instance' % queue_name,
+                        ReturnData=True))
 
-    scale_up_alarm = dict(
-        AlarmName='large-audit-queue',
-        AlarmDescription='large audit queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.AUDIT)
-            },
-        ],
-        Period=300,
-        Threshold=1000,
-        EvaluationPeriods=2,
-        ComparisonOperator='GreaterThanThreshold'
-    )
+    group.scale_up_policy = dict(
+        AutoScalingGroupName=asg_name,
+        PolicyName='Backlog Per Instance',
+        PolicyType='TargetTrackingScaling',
+        EstimatedInstanceWarmup=instance_warmup,
+        TargetTrackingConfiguration=dict(
+            CustomizedMetricSpecification=dict(Metrics=metrics),
+            TargetValue=target_backlog))
+    group.scale_up_alarm = None
+    group.scale_down_policy = None
+    group.scale_down_alarm = None
+    group.enabled_metrics = ['GroupInServiceCapacity']
 
-    scale_down_alarm = dict(
-        AlarmName='small-audit-queue',
-        AlarmDescription='small audit queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.AUDIT)
-            },
-        ],
-        Period=300,
-        Threshold=500,
-        EvaluationPeriods=4,
-        ComparisonOperator='LessThanOrEqualToThreshold'
-    )
+def enable_metrics_collection(client, autoscale_group_name, metrics):
+    click.echo("enabling %s metrics for %s" % (metrics, autoscale_group_name))
+    response = client.enable_metrics_collection(
+        AutoScalingGroupName=autoscale_group_name,
+        Metrics=metrics,
+        Granularity='1Minute')
+    check_response(response, "enable_metrics_collection")
 
-    return AutoScaleGroupConfig(asg,
-                                launch_config,
-                                scale_up_policy,
-                                scale_up_alarm,
-                                scale_down_policy,
-                                scale_down_alarm)
+def put_warm_pool(client, autoscale_group_name, warm_pool):
+    click.echo("putting warm pool of %s" % autoscale_group_name)
+    echo_request(warm_pool)
+    response = client.put_warm_pool(AutoScalingGroupName=autoscale_group_name,
+                                    **warm_pool)
+    check_response(response, "put_warm_pool")
 
+def delete_warm_pool(client, autoscale_group_name):
+    click.echo("deleting warm pool of %s" % autoscale_group_name)
+    response = client.delete_warm_pool(
+        AutoScalingGroupName=autoscale_group_name)
+    check_response(response, "delete_warm_pool")
 
+def put_lifecycle_hook(client, hook):
+    click.echo("putting lifecycle hook %s of %s" %
+               (hook["LifecycleHookName"], hook["AutoScalingGroupName"]))
+    echo_request(hook)
+    response = client.put_lifecycle_hook(**hook)
+    check_response(response, "put_lifecycle_hook")
 
-def create_high_priority_dup_worker_config(jar_version, time,
-                                       subnet_ids,
-                                       availability_zones,
-                                       env_prefix, base_launch_config):
-        # storage stats worker config
-    launch_config = dict(
-        LaunchConfigurationName=("high priority dup worker %s %s" % (
-            jar_version,
-                                                            time)),
-        InstanceType="m5.large",
-        SpotPrice="0.08",
-        UserData=read_file_as_string(
-            'output/cloud-init-dup-worker.txt'),
-        BlockDeviceMappings=[
-            {
-                'DeviceName': '/dev/sda1',
-                'Ebs': {
-                    'VolumeSize': 60,
-                    'VolumeType': 'gp2',
-                }
-            },
-        ]
-    )
+def delete_lifecycle_hook(client, autoscale_group_name, hook_name):
+    click.echo("deleting lifecycle hook %s of %s" % (hook_name,
+                                                     autoscale_group_name))
+    response = client.delete_lifecycle_hook(
+        AutoScalingGroupName=autoscale_group_name, LifecycleHookName=hook_name)
+    check_response(response, "delete_lifecycle_hook")
 
-    launch_config.update(base_launch_config)
+def put_scheduled_action(client, action):
+    click.echo("putting scheduled action %s of %s" %
+               (action["ScheduledActionName"], action["AutoScalingGroupName"]))
+    echo_request(action)
+    response = client.put_scheduled_update_group_action(**action)
+    check_response(response, "put_scheduled_update_group_action")
 
-    scaling_group_name = 'High Priority Dup Worker'
-    asg = dict(
-         AutoScalingGroupName=scaling_group_name,
-         LaunchConfigurationName=get_name(launch_config),
-         MinSize=0,
-         MaxSize=10,
-         AvailabilityZones=availability_zones,
-         VPCZoneIdentifier=subnet_ids)
-    scale_up_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Up',
-        PolicyType='SimpleScaling',
-        Cooldown=300,
-        ScalingAdjustment=1,
-        AdjustmentType='ChangeInCapacity')
-    scale_down_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Down',
-        PolicyType='SimpleScaling',
-        Cooldown=900,
-        ScalingAdjustment=-1,
-        AdjustmentType='ChangeInCapacity')
+def delete_scheduled_action(client, autoscale_group_name, action_name):
+    click.echo("deleting scheduled action %s of %s" % (action_name,
+                                                       autoscale_group_name))
+    response = client.delete_scheduled_action(
+        AutoScalingGroupName=autoscale_group_name,
+        ScheduledActionName=action_name)
+    check_response(response, "delete_scheduled_action")
 
-    scale_up_alarm = dict(
-        AlarmName='large-high-priority-dup-queue',
-        AlarmDescription='large high priority dup queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.DUP_HIGH)
-            },
-        ],
-        Period=300,
-        Unit='Seconds',
-        Threshold=500,
-        EvaluationPeriods=2,
-        ComparisonOperator='GreaterThanThreshold'
-    )
+def delete_scaling_policy(client, autoscale_group_name, policy_name):
+    click.echo("deleting scaling policy %s of %s" % (policy_name,
+                                                     autoscale_group_name))
+    response = client.delete_policy(AutoScalingGroupName=autoscale_group_name,
+                                    PolicyName=policy_name)
+    check_response(response, "delete_policy")
 
-    scale_down_alarm = dict(
-        AlarmName='small-high-priority-dup-queue',
-        AlarmDescription='small high priority dup queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.DUP_HIGH)
-            },
-        ],
-        Period=300,
-        Threshold=100,
-        EvaluationPeriods=4,
-        ComparisonOperator='LessThanOrEqualToThreshold'
-    )
+def delete_metric_alarm(cloudwatch_client, alarm_name):
+    click.echo("deleting metric alarm %s" % alarm_name)
+    response = cloudwatch_client.delete_alarms(AlarmNames=[alarm_name])
+    check_response(response, "delete_alarms")
 
-    return AutoScaleGroupConfig(asg,
-                                launch_config,
-                                scale_up_policy,
-                                scale_up_alarm,
-                                scale_down_policy,
-                                scale_down_alarm)
+def get_launch_template_role(name):
+    # "mill-<role>-<digest>"
+    return name.rsplit("-", 1)[0]
 
+def get_group_launch_template(group):
+    policy = group.get("MixedInstancesPolicy", {})
+    spec = (policy.get("LaunchTemplate", {})
+                  .get("LaunchTemplateSpecification")
+            or group.get("LaunchTemplate") or {})
+    return spec.get("LaunchTemplateName")
 
-def create_low_priority_dup_worker_config(jar_version, time,
-                                       subnet_ids,
-                                       availability_zones,
-                                       env_prefix, base_launch_config):
-        # storage stats worker config
-    launch_config = dict(
-        LaunchConfigurationName=("low priority dup worker %s %s" % (
-            jar_version,
-                                                            time)),
-        InstanceType="m5.large",
-        SpotPrice="0.08",
-        UserData=read_file_as_string(
-            'output/cloud-init-dup-worker.txt'),
-        BlockDeviceMappings=[
-            {
-                'DeviceName': '/dev/sda1',
-                'Ebs': {
-                    'VolumeSize': 60,
-                    'VolumeType': 'gp2',
-                }
-            },
-        ]
-    )
+def get_instance_launch_source(instance):
+    return (instance.get("LaunchTemplate", {}).get("LaunchTemplateName")
+            or instance.get("LaunchConfigurationName"))
 
-    launch_config.update(base_launch_config)
+def plan_instance_refreshes(inventory, groups):
+    # groups with instances launched from anything but the launch config or
+    # template the group is deployed with
+    refreshes = collections.OrderedDict()
+    for i in groups:
+        asg = i.autoscale_group
+        asg_name = asg["AutoScalingGroupName"]
+        live_group = inventory.get_group(asg_name)
+        if live_group is None:
+            continue
+        launch_template = get_group_launch_template(asg)
+        desired = launch_template or asg.get("LaunchConfigurationName")
+        instances = live_group.get("Instances", [])
+        stale = [instance for instance in instances
+                 if get_instance_launch_source(instance) != desired]
+        if stale:
+            refreshes[asg_name] = (len(stale), len(instances),
+                                   launch_template is not None)
+    return refreshes
 
-    scaling_group_name = 'Low Priority Dup Worker'
-    asg = dict(
-         AutoScalingGroupName=scaling_group_name,
-         LaunchConfigurationName=get_name(launch_config),
-         MinSize=0,
-         MaxSize=10,
-         AvailabilityZones=availability_zones,
-         VPCZoneIdentifier=subnet_ids)
-    scale_up_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Up',
-        PolicyType='SimpleScaling',
-        Cooldown=300,
-        ScalingAdjustment=1,
-        AdjustmentType='ChangeInCapacity')
-    scale_down_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Down',
-        PolicyType='SimpleScaling',
-        Cooldown=900,
-        ScalingAdjustment=-1,
-        AdjustmentType='ChangeInCapacity')
+def run_instance_refreshes(client, refreshes, preferences, poll_interval):
+    refresh_ids = collections.OrderedDict()
+    failed = []
+    for asg_name, (stale, total, uses_template) in refreshes.items():
+        group_preferences = dict(preferences)
+        if uses_template:
+            # instances already on the desired template are left alone
+            group_preferences["SkipMatching"] = True
+        try:
+            refresh_ids[asg_name] = start_instance_refresh(
+                client, asg_name, group_preferences)
+        except botocore.exceptions.ClientError as e:
+            click.echo("instance refresh of %s failed to start: %s" %
+                       (asg_name, e))
+            failed.append(asg_name)
 
-    scale_up_alarm = dict(
-        AlarmName='large-low-priority-dup-queue',
-        AlarmDescription='large high priority dup queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.DUP_LOW)
-            },
-        ],
-        Period=300,
-        Threshold=5000,
-        EvaluationPeriods=2,
-        ComparisonOperator='GreaterThanOrEqualToThreshold'
-    )
+    # the refreshes run side by side; each round polls every group at once
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(refresh_ids), 1)) as executor:
+        while refresh_ids:
+            names = list(refresh_ids)
+            statuses = executor.map(
+                lambda name: describe_instance_refresh(
+                    client, name, refresh_ids[name]), names)
+            for asg_name, refresh in zip(names, statuses):
+                click.echo("instance refresh %s: %s %d%% (%d instances to "
+                           "update)" %
+                           (asg_name, refresh["Status"],
+                            refresh.get("PercentageComplete", 0),
+                            refresh.get("InstancesToUpdate", 0)))
+                if refresh["Status"] in INSTANCE_REFRESH_DONE:
+                    del refresh_ids[asg_name]
+                    if refresh["Status"] != "Successful":
+                        failed.append(asg_name)
+            if refresh_ids:
+                time.sleep(poll_interval)
 
-    scale_down_alarm = dict(
-        AlarmName='small-low-priority-dup-queue',
-        AlarmDescription='small low priority dup queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.DUP_LOW)
-            },
-        ],
-        Period=300,
-        Threshold=100,
-        EvaluationPeriods=4,
-        ComparisonOperator='LessThanOrEqualToThreshold'
-    )
+    if failed:
+        raise click.ClickException("instance refresh failed for %s" %
+                                   ", ".join(failed))
 
-    return AutoScaleGroupConfig(asg,
-                                launch_config,
-                                scale_up_policy,
-                                scale_up_alarm,
-                                scale_down_policy,
-                                scale_down_alarm)
+def start_instance_refresh(client, asg_name, preferences):
+    try:
+        response = client.start_instance_refresh(
+            AutoScalingGroupName=asg_name,
+            Strategy='Rolling',
+            Preferences=preferences)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] != "InstanceRefreshInProgress":
+            raise
+        # follow the refresh that is already running
+        response = client.describe_instance_refreshes(
+            AutoScalingGroupName=asg_name, MaxRecords=1)
+        refresh_id = response["InstanceRefreshes"][0]["InstanceRefreshId"]
+        click.echo("following instance refresh %s of %s already in "
+                   "progress" % (refresh_id, asg_name))
+        return refresh_id
+    check_response(response, "start_instance_refresh")
+    click.echo("started instance refresh %s of %s" %
+               (response["InstanceRefreshId"], asg_name))
+    return response["InstanceRefreshId"]
 
+def describe_instance_refresh(client, asg_name, refresh_id):
+    response = client.describe_instance_refreshes(
+        AutoScalingGroupName=asg_name, InstanceRefreshIds=[refresh_id])
+    return response["InstanceRefreshes"][0]
 
-def create_bit_worker_config(jar_version, time,
-                                       subnet_ids,
-                                       availability_zones,
-                                       env_prefix, base_launch_config):
-        # storage stats worker config
-    launch_config = dict(
-        LaunchConfigurationName=("bit worker worker %s %s" % (
-            jar_version,
-                                                            time)),
-        InstanceType="m5.large",
-        SpotPrice="0.08",
-        UserData=read_file_as_string(
-            'output/cloud-init-bit-worker.txt'),
-        BlockDeviceMappings=[
-            {
-                'DeviceName': '/dev/sda1',
-                'Ebs': {
-                    'VolumeSize': 60,
-                    'VolumeType': 'gp2',
-                }
-            },
-        ]
-    )
+def get_stale_launch_templates(inventory, asg_name, role, launch_template_name,
+                               retention):
+    prefix = "mill-%s" % role
+    referenced = set(get_group_launch_template(g)
+                     for name, g in inventory.groups.items()
+                     if name != asg_name)
+    candidates = [lt for name, lt in inventory.launch_templates.items()
+                  if name != launch_template_name
+                  and name not in referenced
+                  and get_launch_template_role(name) == prefix]
+    candidates.sort(key=lambda lt: lt["CreateTime"], reverse=True)
+    return [lt["LaunchTemplateName"] for lt in candidates[retention:]]
 
-    launch_config.update(base_launch_config)
+def create_launch_template(ec2_client, launch_template):
+    name = launch_template["LaunchTemplateName"]
+    click.echo("creating launch template: %s" % name)
+    response = ec2_client.create_launch_template(**launch_template)
+    check_response(response, "create_launch_template")
+    click.echo("created launch template %s" % name)
+    return launch_template
 
-    scaling_group_name = 'Bit Worker'
-    asg = dict(
-         AutoScalingGroupName=scaling_group_name,
-         LaunchConfigurationName=get_name(launch_config),
-         MinSize=0,
-         MaxSize=10,
-         AvailabilityZones=availability_zones,
-         VPCZoneIdentifier=subnet_ids)
-    scale_up_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Up',
-        PolicyType='SimpleScaling',
-        Cooldown=300,
-        ScalingAdjustment=1,
-        AdjustmentType='ChangeInCapacity')
-    scale_down_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Down',
-        PolicyType='SimpleScaling',
-        Cooldown=900,
-        ScalingAdjustment=-1,
-        AdjustmentType='ChangeInCapacity')
+def delete_launch_template(ec2_client, name):
+    click.echo("deleting launch template: %s" % name)
+    response = ec2_client.delete_launch_template(LaunchTemplateName=name)
+    check_response(response, "delete_launch_template")
+    click.echo("deleted launch template %s" % name)
 
-    scale_up_alarm = dict(
-        AlarmName='non-empty-bit-queue',
-        AlarmDescription='non-empty-bit-queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.BIT)
-            },
-        ],
-        Period=300,
-        Threshold=1,
-        EvaluationPeriods=2,
-        ComparisonOperator='GreaterThanOrEqualToThreshold'
-    )
+def name_launch_config(launch_config, role, jar_version):
+    # launch configs are named after a hash of their effective spec so that
+    # identical specs map to the same, already existing, launch config
+    launch_config["LaunchConfigurationName"] = "%s %s %s" % (
+        role, jar_version, get_spec_digest(launch_config))
 
-    scale_down_alarm = dict(
-        AlarmName='small-bit-queue',
-        AlarmDescription='small bit queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesNotVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.BIT)
-            },
-        ],
-        Period=900,
-        Threshold=1,
-        EvaluationPeriods=4,
-        ComparisonOperator='LessThanThreshold'
-    )
+def get_spec_digest(spec):
+    spec = dict((k, v) for k, v in spec.items()
+                if k != "LaunchConfigurationName")
+    # compressed user data is hashed in its base64 form
+    encoded = json.dumps(spec, sort_keys=True, default=lambda v:
+                         base64.b64encode(v).decode("ascii")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
 
-    return AutoScaleGroupConfig(asg,
-                                launch_config,
-                                scale_up_policy,
-                                scale_up_alarm,
-                                scale_down_policy,
-                                scale_down_alarm)
+def get_launch_config_role(name):
+    # "<role> <jar version> <digest or timestamp>"
+    return name.rsplit(" ", 2)[0]
 
+def get_stale_launch_configs(inventory, asg_name, launch_config_name,
+                             retention):
+    role = get_launch_config_role(launch_config_name)
+    referenced = set(g.get("LaunchConfigurationName")
+                     for name, g in inventory.groups.items()
+                     if name != asg_name)
+    candidates = [lc for name, lc in inventory.launch_configs.items()
+                  if name != launch_config_name
+                  and name not in referenced
+                  and get_launch_config_role(name) == role]
+    candidates.sort(key=lambda lc: lc["CreatedTime"], reverse=True)
+    return [get_name(lc) for lc in candidates[retention:]]
 
-def create_bit_report_worker_config(jar_version, time,
-                                       subnet_ids,
-                                       availability_zones,
-                                       env_prefix, base_launch_config):
-        # storage stats worker config
-    launch_config = dict(
-        LaunchConfigurationName=("bit report worker %s %s" % (
-            jar_version,
-                                                            time)),
-        InstanceType="m5.large",
-        SpotPrice="0.08",
-        UserData=read_file_as_string(
-            'output/cloud-init-bit-report-worker.txt'),
-        BlockDeviceMappings=[
-            {
-                'DeviceName': '/dev/sda1',
-                'Ebs': {
-                    'VolumeSize': 20,
-                    'VolumeType': 'gp2',
-                }
-            },
-        ]
-    )
+# number of -v options given; responses are only printed when verbose
+verbosity = 0
 
-    launch_config.update(base_launch_config)
+def echo_request(request):
+    # whole requests are as noisy as the responses
+    if verbosity > 1:
+        click.echo("request = %s" % request)
 
-    scaling_group_name = 'Bit Report Worker'
-    asg = dict(
-         AutoScalingGroupName=scaling_group_name,
-         LaunchConfigurationName=get_name(launch_config),
-         MinSize=0,
-         MaxSize=1,
-         AvailabilityZones=availability_zones,
-         VPCZoneIdentifier=subnet_ids)
-    scale_up_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Up',
-        PolicyType='SimpleScaling',
-        Cooldown=300,
-        ScalingAdjustment=1,
-        AdjustmentType='ChangeInCapacity')
-    scale_down_policy =  dict(AutoScalingGroupName=scaling_group_name,
-        PolicyName='Scale Down',
-        PolicyType='SimpleScaling',
-        Cooldown=300,
-        ScalingAdjustment=-1,
-        AdjustmentType='ChangeInCapacity')
+def check_response(response, operation):
+    responseCode = response['ResponseMetadata']['HTTPStatusCode']
+    if verbosity:
+        click.echo("responseCode = %s" % responseCode)
+    if responseCode < 200 or responseCode >= 300:
+      raise(RuntimeError("%s failed; response=%s" % (operation, response)))
+    if verbosity > 1:
+        click.echo("response = %s" % response)
 
-    scale_up_alarm = dict(
-        AlarmName='non-empty-bit-report-queue',
-        AlarmDescription='non-empty-bit-report-queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.BIT_REPORT)
-            },
-        ],
-        Period=300,
-        Threshold=1,
-        EvaluationPeriods=1,
-        ComparisonOperator='GreaterThanOrEqualToThreshold'
+def create_sqs_queue(sqs_client, qname, attributes):
+    click.echo("creating queue %s" % qname)
+    #create queue
+    response = sqs_client.create_queue(
+        QueueName=qname,
+        Attributes=attributes
     )
+    #verify result
+    check_response(response, "create_queue")
+    click.echo("created queue %s" % qname)
+    return response["QueueUrl"]
 
-    scale_down_alarm = dict(
-        AlarmName='bit-report-queue-empty',
-        AlarmDescription='empty bit report queue',
-        ActionsEnabled=True,
-        AlarmActions=[],
-        MetricName='ApproximateNumberOfMessagesVisible',
-        Namespace='AWS/SQS',
-        Statistic='Average',
-        Dimensions=[
-            {
-                'Name': 'QueueName',
-                'Value': QueueNames().format(env_prefix, QueueNames.BIT_REPORT)
-            },
-        ],
-        Period=3600,
-        Threshold=0,
-        EvaluationPeriods=6,
-        ComparisonOperator='LessThanOrEqualToThreshold'
-    )
+def get_queue_arn(sqs_client, queue_url):
+    response = sqs_client.get_queue_attributes(QueueUrl=queue_url,
+                                               AttributeNames=['QueueArn'])
+    check_response(response, "get_queue_attributes")
+    return response["Attributes"]["QueueArn"]
 
-    return AutoScaleGroupConfig(asg,
-                                launch_config,
-                                scale_up_policy,
-                                scale_up_alarm,
-                                scale_down_policy,
-                                scale_down_alarm)
+def update_sqs_queue(sqs_client, queue_url, attributes):
+    click.echo("updating queue attributes of %s" % queue_url)
+    response = sqs_client.set_queue_attributes(QueueUrl=queue_url,
+                                               Attributes=attributes)
+    check_response(response, "set_queue_attributes")
+    click.echo("updated queue %s" % queue_url)
+    return queue_url
 
-def create_sentinel_config(jar_version, time, subnet_ids,
-                           availability_zones, base_launch_config):
 
-    # sentinel config
-    launch_config = dict(
-        LaunchConfigurationName=("sentinel %s %s" % (jar_version, time)),
-        InstanceType="t3.medium",
-        UserData=read_file_as_string('output/cloud-init-sentinel.txt'))
-    launch_config.update(base_launch_config)
 
-    asg = dict(
-         AutoScalingGroupName='Sentinel',
-         LaunchConfigurationName=get_name(launch_config),
-         MinSize=1,
-         MaxSize=1,
-         AvailabilityZones=availability_zones,
-         VPCZoneIdentifier=subnet_ids)
-
-    return AutoScaleGroupConfig(asg,
-                                launch_config,
-                                None,
-                                None,
-                                None,
-                                None)
+def delete_launch_config(client, name):
+    click.echo("deleting launch config: %s" % name)
+    response = client.delete_launch_configuration(
+        LaunchConfigurationName=name)
+    check_response(response, "delete_launch_configuration")
+    click.echo("deleted launch config %s" % name)
+
+def put_user_data_object(s3_client, upload):
+    click.echo("storing user data in s3://%s/%s" % (upload["Bucket"],
+                                                    upload["Key"]))
+    response = s3_client.put_object(ContentType='text/plain', **upload)
+    check_response(response, "put_object")
+
+def create_launch_config(client, launch_config):
+    name = get_name(launch_config)
+    click.echo("creating launch config: %s" % name)
+    response = client.create_launch_configuration(**launch_config)
+    check_response(response, "create_launch_configuration")
+    click.echo("created launch config %s" % name)
+    return launch_config
+
+def put_scaling_policy(auto_scaling_client, scaling_policy):
+    click.echo("put scaling policy %s of %s" %
+               (scaling_policy["PolicyName"],
+                scaling_policy["AutoScalingGroupName"]))
+    echo_request(scaling_policy)
+    response = auto_scaling_client.put_scaling_policy(**scaling_policy)
+    check_response(response, "put_scaling_policy")
+    policy_arn = response["PolicyARN"]
+    click.echo("successfully put scaling policy with PolicyArn: %s" % policy_arn)
+    return policy_arn
+
+def put_metric_alarm(cloudwatch_client, scaling_alarm, policy_arn):
+    scaling_alarm = dict(scaling_alarm, AlarmActions=[policy_arn])
+    echo_request(scaling_alarm)
+    response = cloudwatch_client.put_metric_alarm(**scaling_alarm)
+    check_response(response, "put_metric_alarm")
+    click.echo("successfully put metric alarm %s" % scaling_alarm["AlarmName"])
+
+def diff_attributes(desired, live):
+    # (key, live value, desired value) for every desired key that differs
+    diffs = []
+    for key, value in desired.items():
+        live_value = live.get(key)
+        if not attribute_matches(key, value, live_value):
+            diffs.append((key, live_value, value))
+    if all(key in SECONDARY_ATTRIBUTES for key, _, _ in diffs):
+        return []
+    return diffs
+
+def attribute_matches(key, desired, live):
+    # nested dicts only need to agree on the keys we set; AWS fills in
+    # defaults for the rest
+    if isinstance(desired, dict) and isinstance(live, dict):
+        return all(attribute_matches(k, v, live.get(k))
+                   for k, v in desired.items())
+    if (isinstance(desired, list) and isinstance(live, list)
+            and len(desired) == len(live)
+            and all(attribute_matches(key, d, l)
+                    for d, l in zip(desired, live))):
+        return True
+    return normalize_attribute(key, desired) == normalize_attribute(key, live)
+
+def normalize_attribute(key, value):
+    if key == 'VPCZoneIdentifier' and value:
+        return sorted(value.split(","))
+    if key == 'RedrivePolicy' and isinstance(value, str):
+        return normalize_attribute(key, json.loads(value))
+    if isinstance(value, str) and key in ('VisibilityTimeout',
+                                          'ReceiveMessageWaitTimeSeconds',
+                                          'MessageRetentionPeriod'):
+        return float(value)
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return dict((k, normalize_attribute(k, v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sorted((normalize_attribute(key, v) for v in value),
+                      key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+def get_alarm_queues(alarm):
+    dimensions = list(alarm.get("Dimensions", []))
+    for metric in alarm.get("Metrics", []):
+        if "MetricStat" in metric:
+            dimensions.extend(metric["MetricStat"]["Metric"]["Dimensions"])
+    queues = []
+    for d in dimensions:
+        if d["Name"] == "QueueName" and d["Value"] not in queues:
+            queues.append(d["Value"])
+    return queues
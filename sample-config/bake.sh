@@ -0,0 +1,38 @@
+#!/bin/bash
+# Provisions the builder instance of "milldeploy bake".  It runs once as
+# user data on a fresh amiId instance and powers the instance off when done;
+# the image is then taken from the stopped instance.
+#
+# Each {{ }} placeholder names a property of environment-account.properties
+# and is replaced with its value.  Only install what every role needs: the
+# image is shared by all of them, and anything specific to an environment
+# or role belongs in first-boot.sh.
+set -euxo pipefail
+
+export DEBIAN_FRONTEND=noninteractive
+apt-get update
+apt-get install -y puppet git maven default-jre-headless
+
+# the puppet module, at the branch this image is keyed by
+git clone --depth 1 --branch {{puppetDuracloudMillBranch}} \
+    https://github.com/{{puppetDuracloudMillRepoOwner}}/puppet-duracloud-mill.git \
+    /etc/puppet/modules/duracloud_mill
+
+# the mill jars, at the version this image is keyed by; adjust the list to
+# the artifacts your puppet-duracloud-mill branch runs
+MILL_ARTIFACTS="workman loopingduptaskproducer loopingbittaskproducer loopingstoragestatstaskproducer manifest-cleaner storage-reporter"
+REPOSITORIES=https://repo1.maven.org/maven2,https://oss.sonatype.org/content/repositories/snapshots
+mkdir -p /opt/mill/jars
+for artifact in $MILL_ARTIFACTS; do
+    mvn -q dependency:copy \
+        -Dartifact=org.duracloud.mill:$artifact:{{jarVersion}} \
+        -DremoteRepositories=$REPOSITORIES \
+        -DoutputDirectory=/opt/mill/jars
+done
+rm -rf /root/.m2
+
+echo "mill {{jarVersion}} puppet {{puppetDuracloudMillBranch}}" > /etc/mill-baked
+
+# let cloud-init run again on instances started from the image
+cloud-init clean --logs
+poweroff
@@ -0,0 +1,26 @@
+#!/bin/bash
+# User data of instances started from an image baked by "milldeploy bake"
+# (run in place of the mill-init cloud-init's install steps when
+# useBakedImage=true, after the files it writes are in place).  The image
+# already has puppet, the duracloud_mill module and the mill jars, so first
+# boot only configures this instance's role.
+#
+# {{role}} is the mill-init role (sentinel, audit-worker, ...); any other
+# {{ }} placeholder names a property of environment-account.properties.
+set -euxo pipefail
+
+INSTANCE_ID=$(curl -s http://169.254.169.254/latest/meta-data/instance-id)
+hostnamectl set-hostname {{instancePrefix}}-{{role}}-$INSTANCE_ID.{{instanceDomain}}
+
+mkdir -p /etc/facter/facts.d
+cat > /etc/facter/facts.d/mill.txt <<FACTS
+mill_role={{role}}
+mill_version={{jarVersion}}
+mill_jar_dir=/opt/mill/jars
+instance_prefix={{instancePrefix}}
+bootstrap_bucket={{bootstrapBucket}}
+efs_dns_name={{efsDnsName}}
+aws_region={{awsRegion}}
+FACTS
+
+puppet apply -e "include duracloud_mill"
@@ -9,6 +9,7 @@ setup(
         'Click',
         'gitpython',
         'boto3 >= 1.4.6',
+        'PyYAML',
     ],
     entry_points='''
         [console_scripts]
@@ -0,0 +1,110 @@
+import boto3
+import click
+import pytest
+import yaml
+
+import milldeploy
+
+moto = pytest.importorskip("moto")
+
+
+CLOUD_INIT = '''#cloud-config
+write_files:
+  - path: /home/duracloud/mill-config.properties
+    content: |
+      max-workers=11
+  - path: /home/duracloud/bit-inclusion.txt
+    content: ""
+runcmd:
+  - [sh, -c, "install puppet and the mill jars"]
+'''
+
+
+def test_baked_user_data_keeps_mill_init_files():
+    user_data = milldeploy.build_baked_user_data(
+        CLOUD_INIT, "#!/bin/bash\npuppet apply\n", "audit-worker")
+    assert user_data.startswith("#cloud-config\n")
+    config = yaml.safe_load(user_data)
+    paths = [f["path"] for f in config["write_files"]]
+    assert paths == ['/home/duracloud/mill-config.properties',
+                     '/home/duracloud/bit-inclusion.txt',
+                     '/var/lib/milldeploy/first-boot.sh']
+    assert config["write_files"][0]["content"] == "max-workers=11\n"
+    assert config["write_files"][2]["content"] == "#!/bin/bash\npuppet apply\n"
+    # the install steps are left to the bake
+    assert config["runcmd"] == [['/var/lib/milldeploy/first-boot.sh']]
+
+
+def test_baked_user_data_is_stable():
+    first = milldeploy.build_baked_user_data(CLOUD_INIT, "#!/bin/bash\n",
+                                             "sentinel")
+    assert first == milldeploy.build_baked_user_data(CLOUD_INIT,
+                                                     "#!/bin/bash\n",
+                                                     "sentinel")
+
+
+def test_baked_user_data_needs_mill_init_files():
+    with pytest.raises(click.ClickException):
+        milldeploy.build_baked_user_data(
+            "#cloud-config\nruncmd:\n  - echo\n", "#!/bin/bash\n",
+            "sentinel")
+    with pytest.raises(click.ClickException):
+        milldeploy.build_baked_user_data("#!/bin/bash\necho\n",
+                                         "#!/bin/bash\n", "sentinel")
+
+
+BAKE_SCRIPT = "#!/bin/bash\ninstall mill {{jarVersion}}\npoweroff\n"
+
+
+def bake_props(ami_id):
+    return {'amiId': ami_id, 'jarVersion': '7.1.0',
+            'puppetDuracloudMillBranch': 'master'}
+
+
+def bake_image(ec2, props, bake_script):
+    # what run_bake leaves behind: an image of a builder, tagged by the plan
+    plan = milldeploy.plan_bake(props, bake_script, [], 't3.small')
+    instance = ec2.run_instances(ImageId=props["amiId"], MinCount=1,
+                                 MaxCount=1)["Instances"][0]["InstanceId"]
+    image_id = ec2.create_image(InstanceId=instance,
+                                Name=plan.name)["ImageId"]
+    ec2.create_tags(Resources=[image_id], Tags=plan.tags)
+    return plan, image_id
+
+
+def base_images(ec2):
+    return [image["ImageId"] for image in ec2.describe_images()["Images"]
+            if image.get("State") == "available"][:2]
+
+
+@moto.mock_aws
+def test_bake_is_reused_only_for_the_same_inputs():
+    ec2 = boto3.client('ec2', region_name='us-east-1')
+    ami_id = base_images(ec2)[0]
+    props = bake_props(ami_id)
+    plan, image_id = bake_image(ec2, props, BAKE_SCRIPT)
+    images = milldeploy.describe_baked_images(ec2, {
+        'milldeploy:jar-version': '7.1.0',
+        'milldeploy:puppet-branch': 'master'})
+    assert milldeploy.plan_bake(props, BAKE_SCRIPT, images,
+                                't3.small').image_id == image_id
+    changed = milldeploy.plan_bake(props, BAKE_SCRIPT + "# more\n", images,
+                                   't3.small')
+    assert changed.image_id is None
+    assert changed.key != plan.key
+
+
+@moto.mock_aws
+def test_find_baked_image_matches_base_image_and_bake_script():
+    ec2 = boto3.client('ec2', region_name='us-east-1')
+    ami_id, other_ami_id = base_images(ec2)
+    props = bake_props(ami_id)
+    image_id = bake_image(ec2, props, BAKE_SCRIPT)[1]
+    assert milldeploy.find_baked_image(ec2, props, BAKE_SCRIPT) == image_id
+    # a new base image or bake.sh needs a new bake
+    assert milldeploy.find_baked_image(ec2, bake_props(other_ami_id),
+                                       BAKE_SCRIPT) is None
+    assert milldeploy.find_baked_image(ec2, props,
+                                       BAKE_SCRIPT + "# more\n") is None
+    assert milldeploy.find_baked_image(
+        ec2, dict(props, jarVersion='7.2.0'), BAKE_SCRIPT) is None
@@ -0,0 +1,19 @@
+import pytest
+
+import milldeploy
+
+
+def test_failure_names_the_operation():
+    response = dict(ResponseMetadata=dict(HTTPStatusCode=500))
+    with pytest.raises(RuntimeError, match="^put_metric_alarm failed"):
+        milldeploy.check_response(response, "put_metric_alarm")
+
+
+def test_put_metric_alarm_checks_its_response():
+    class CloudWatch:
+        def put_metric_alarm(self, **alarm):
+            return dict(ResponseMetadata=dict(HTTPStatusCode=400))
+
+    with pytest.raises(RuntimeError, match="^put_metric_alarm failed"):
+        milldeploy.put_metric_alarm(CloudWatch(), dict(AlarmName='audit-up'),
+                                    'arn:policy')
@@ -0,0 +1,73 @@
+import click
+import pytest
+
+import milldeploy
+
+
+class Fleet:
+    def __init__(self, role, queue, min_size, max_size):
+        self.role = role
+        self.name = role
+        self.queue = queue
+        self.min_size = min_size
+        self.max_size = max_size
+
+
+MILL_PROPS = {'max-workers': '10', 'mill.db.host': 'mill-db',
+              'db.host': 'accounts-db'}
+
+
+def fleets():
+    return [Fleet('sentinel', None, 1, 1),
+            Fleet('audit', 'audit', 0, 10),
+            Fleet('bit', 'bit', 0, 10)]
+
+
+def test_sentinel_counts_no_workers():
+    props = {'dbMaxConnections': '1000', 'dbExtraConnections': '2'}
+    budget = milldeploy.plan_connection_budget(props, MILL_PROPS, fleets())
+    assert budget.per_instance('sentinel') == 2
+    assert budget.per_instance('audit') == 12
+    assert budget.fan_in() == 2 + 20 * 12
+
+
+def test_sentinel_does_not_shrink_worker_caps():
+    # 200 connections fit both worker fleets at max size only when the
+    # sentinel is left out of the worker threads
+    props = {'dbMaxConnections': '200'}
+    budget = milldeploy.plan_connection_budget(props, MILL_PROPS, fleets())
+    assert budget.max_sizes == {'sentinel': 1, 'audit': 10, 'bit': 10}
+
+
+def test_max_workers_ignores_sentinel_instances():
+    props = {'dbMaxConnections': '100', 'dbBudgetStrategy': 'max-workers'}
+    budget = milldeploy.plan_connection_budget(props, MILL_PROPS, fleets())
+    assert budget.max_workers == 5
+
+
+def test_max_size_caps_least_important_fleet_first():
+    props = {'dbMaxConnections': '150', 'dbBudgetPriority': 'audit,bit'}
+    budget = milldeploy.plan_connection_budget(props, MILL_PROPS, fleets())
+    assert budget.max_sizes == {'sentinel': 1, 'audit': 10, 'bit': 5}
+
+
+def test_shared_host_counts_both_pools():
+    props = {'dbMaxConnections': '1000'}
+    mill_props = dict(MILL_PROPS, **{'db.host': 'mill-db'})
+    budget = milldeploy.plan_connection_budget(props, mill_props, fleets())
+    assert budget.databases == 2
+    assert budget.per_instance('audit') == 20
+
+
+def test_unset_hosts_are_not_shared():
+    props = {'dbMaxConnections': '1000'}
+    budget = milldeploy.plan_connection_budget(
+        props, {'max-workers': '10'}, fleets())
+    assert budget.databases == 1
+    assert budget.per_instance('audit') == 10
+
+
+def test_unfittable_budget_fails():
+    props = {'dbMaxConnections': '5', 'dbExtraConnections': '10'}
+    with pytest.raises(click.ClickException):
+        milldeploy.plan_connection_budget(props, MILL_PROPS, fleets())
@@ -0,0 +1,53 @@
+import json
+
+import milldeploy
+
+
+def test_matching_attributes_have_no_diffs():
+    desired = dict(MinSize=0, MaxSize=10,
+                   VPCZoneIdentifier='subnet-a,subnet-b')
+    live = dict(MinSize=0, MaxSize=10, VPCZoneIdentifier='subnet-b,subnet-a',
+                DefaultCooldown=300)
+    # keys only the live side has are left alone
+    assert milldeploy.diff_attributes(desired, live) == []
+
+
+def test_diffs_are_key_live_desired():
+    assert milldeploy.diff_attributes(dict(MaxSize=10, MinSize=1),
+                                      dict(MaxSize=5)) == [
+        ('MaxSize', 5, 10), ('MinSize', None, 1)]
+
+
+def test_nested_dicts_only_compare_desired_keys():
+    desired = dict(InstancesDistribution=dict(OnDemandBaseCapacity=0))
+    live = dict(InstancesDistribution=dict(
+        OnDemandBaseCapacity=0, OnDemandAllocationStrategy='prioritized'))
+    assert milldeploy.diff_attributes(desired, live) == []
+
+
+def test_list_order_does_not_matter():
+    desired = dict(Dimensions=[dict(Name='QueueName', Value='audit'),
+                               dict(Name='Stage', Value='prod')])
+    live = dict(Dimensions=[dict(Name='Stage', Value='prod'),
+                            dict(Name='QueueName', Value='audit')])
+    assert milldeploy.diff_attributes(desired, live) == []
+
+
+def test_numbers_compare_by_value():
+    assert milldeploy.normalize_attribute('Threshold', 10) == 10.0
+    assert milldeploy.normalize_attribute('VisibilityTimeout', '30') == 30.0
+    # other strings stay strings
+    assert milldeploy.normalize_attribute('SpotPrice', '0.08') == '0.08'
+    assert milldeploy.normalize_attribute('ActionsEnabled', True) is True
+
+
+def test_redrive_policy_is_compared_as_json():
+    desired = dict(RedrivePolicy=dict(deadLetterTargetArn='arn:dlq',
+                                      maxReceiveCount=3))
+    live = dict(RedrivePolicy=json.dumps(dict(maxReceiveCount=3,
+                                              deadLetterTargetArn='arn:dlq')))
+    assert milldeploy.diff_attributes(desired, live) == []
+    live = dict(RedrivePolicy=json.dumps(dict(maxReceiveCount=5,
+                                              deadLetterTargetArn='arn:dlq')))
+    assert milldeploy.diff_attributes(desired, live) == [
+        ('RedrivePolicy', live["RedrivePolicy"], desired["RedrivePolicy"])]
@@ -0,0 +1,94 @@
+import json
+import os
+
+import click
+import pytest
+
+import milldeploy
+
+SAMPLE_CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'sample-config')
+
+
+def load_fleets(tmp_path, fleets):
+    (tmp_path / milldeploy.FLEET_SPEC_FILE).write_text(
+        json.dumps(dict(fleets=fleets)))
+    return dict((f.role, f) for f in milldeploy.load_fleet_specs(
+        str(tmp_path)))
+
+
+def spec_error(tmp_path, fleets):
+    with pytest.raises(click.ClickException) as e:
+        load_fleets(tmp_path, fleets)
+    return e.value.message
+
+
+def test_sample_bit_steps():
+    fleets = dict((f.role, f) for f in milldeploy.load_fleet_specs(
+        SAMPLE_CONFIG_DIR))
+    assert fleets['bit'].scale_up_steps == [
+        (1, 'ChangeInCapacity', 1, 300),
+        (10000, 'ChangeInCapacity', 3, 300),
+        (100000, 'PercentChangeInCapacity', 50, 300)]
+
+
+def test_steps_parse_percent_and_warmup(tmp_path):
+    fleets = load_fleets(tmp_path, {'audit': {
+        'scaleUpSteps': ["100000:50%", "5000:2:600"]}})
+    # the listed steps replace the defaults and are sorted by threshold
+    assert fleets['audit'].scale_up_steps == [
+        (5000, 'ChangeInCapacity', 2, 600),
+        (100000, 'PercentChangeInCapacity', 50, 900)]
+
+
+def test_default_steps_start_at_scale_up_threshold(tmp_path):
+    fleets = load_fleets(tmp_path, {'audit': {'scaleUp': {'threshold': 20}}})
+    assert fleets['audit'].scale_up_steps[0] == (20, 'ChangeInCapacity', 1,
+                                                 900)
+    assert [s[0] for s in fleets['audit'].scale_up_steps] == [
+        20, 10000, 100000]
+
+
+def test_only_first_step_at_a_threshold_is_kept():
+    scale_up = milldeploy.AlarmSpec(
+        dict(alarmName='up', comparison='GreaterThanThreshold', threshold=10,
+             period=60, evaluationPeriods=1, cooldown=300), 'up')
+    steps = milldeploy.parse_scale_up_steps(["100:2", "100:5", "10:1"],
+                                            "scaleUpSteps", scale_up)
+    assert steps == [(10, 'ChangeInCapacity', 1, 300),
+                     (100, 'ChangeInCapacity', 2, 300)]
+
+
+@pytest.mark.parametrize('step', ["lots:2", "100", "100:2:3:4", "100:x%"])
+def test_invalid_step(tmp_path, step):
+    message = spec_error(tmp_path, {'audit': {'scaleUpSteps': [step]}})
+    assert message == ("invalid step in fleets.audit.scaleUpSteps: %s" %
+                       step)
+
+
+def test_step_must_scale_up(tmp_path):
+    message = spec_error(tmp_path, {'audit': {'scaleUpSteps': ["100:0"]}})
+    assert message == "fleets.audit.scaleUpSteps must scale up: 100:0"
+
+
+@pytest.mark.parametrize('fleet, expected', [
+    ({'maxSize': "10"}, "fleets.audit.maxSize must be a whole number"),
+    ({'minSize': 5, 'maxSize': 2}, "fleets.audit.maxSize must be at least 5"),
+    ({'scalingMode': 'fast'},
+     "fleets.audit.scalingMode must be one of simple, step, "
+     "target-tracking"),
+    ({'maxSzie': 10}, "fleets.audit.maxSzie is not a known setting"),
+    ({'scaleUp': {'threshold': 0, 'latencySlo': 600}},
+     "fleets.audit.scaleUp.latencySlo needs a threshold of at least 1"),
+    ({'warmPool': {}},
+     "fleets.audit.warmPool cannot be used with spot instances; set "
+     "spotPrice to null"),
+])
+def test_invalid_fleet(tmp_path, fleet, expected):
+    assert spec_error(tmp_path, {'audit': fleet}) == "%s: %s" % (
+        milldeploy.FLEET_SPEC_FILE, expected)
+
+
+def test_fleet_names_must_be_unique(tmp_path):
+    message = spec_error(tmp_path, {'bit': {'name': 'Audit Worker'}})
+    assert "more than one fleet is named Audit Worker" in message
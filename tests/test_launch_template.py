@@ -0,0 +1,60 @@
+import boto3
+import pytest
+
+import milldeploy
+
+moto = pytest.importorskip("moto")
+
+
+def describe_group(autoscaling, name):
+    return autoscaling.describe_auto_scaling_groups(
+        AutoScalingGroupNames=[name])["AutoScalingGroups"][0]
+
+
+@moto.mock_aws
+def test_launch_config_to_launch_template_converges():
+    ec2 = boto3.client('ec2', region_name='us-east-1')
+    autoscaling = boto3.client('autoscaling', region_name='us-east-1')
+    image_id = ec2.describe_images()["Images"][0]["ImageId"]
+    subnet_id = ec2.describe_subnets()["Subnets"][0]["SubnetId"]
+
+    launch_config = dict(InstanceType='m5.large', UserData=b'#!/bin/bash\n',
+                         SpotPrice='0.05', ImageId=image_id,
+                         IamInstanceProfile='mill', SecurityGroups=[],
+                         KeyName='mill')
+    milldeploy.name_launch_config(launch_config, 'audit', '7.0.0')
+    asg = dict(AutoScalingGroupName='audit',
+               LaunchConfigurationName=launch_config[
+                   "LaunchConfigurationName"],
+               MinSize=0, MaxSize=10, VPCZoneIdentifier=subnet_id)
+    group = milldeploy.AutoScaleGroupConfig(asg, launch_config, None, None,
+                                            None, None, role='audit')
+    milldeploy.create_launch_config(autoscaling, launch_config)
+    milldeploy.create_autoscale_group(autoscaling, asg, launch_config)
+    assert milldeploy.diff_attributes(
+        asg, describe_group(autoscaling, 'audit')) == []
+
+    milldeploy.use_launch_template(group, '7.0.0',
+                                   [('m5.large', 1), ('m5a.large', 1)], 0)
+    assert milldeploy.diff_attributes(
+        asg, describe_group(autoscaling, 'audit')) != []
+    milldeploy.create_launch_template(ec2, group.launch_template)
+    milldeploy.update_existing_autoscale_group(autoscaling, asg,
+                                               group.launch_template)
+    # the plan after the migration finds nothing to change
+    assert milldeploy.diff_attributes(
+        asg, describe_group(autoscaling, 'audit')) == []
+
+
+def test_capacity_rebalance_alone_is_no_change():
+    asg = dict(AutoScalingGroupName='audit', MaxSize=10,
+               CapacityRebalance=True)
+    assert milldeploy.diff_attributes(
+        asg, dict(AutoScalingGroupName='audit', MaxSize=10)) == []
+    assert milldeploy.diff_attributes(
+        asg, dict(AutoScalingGroupName='audit', MaxSize=10,
+                  CapacityRebalance=False)) == []
+    assert milldeploy.diff_attributes(
+        asg, dict(AutoScalingGroupName='audit', MaxSize=5,
+                  CapacityRebalance=False)) == [
+            ('MaxSize', 5, 10), ('CapacityRebalance', False, True)]
@@ -0,0 +1,56 @@
+import os
+
+import click
+import pytest
+from git import Repo
+
+import milldeploy
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    path = str(tmp_path / "upstream")
+    repo = Repo.init(path)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "mill")
+        config.set_value("user", "email", "mill@example.org")
+    with open(os.path.join(path, "README"), "w") as f:
+        f.write("mill-init\n")
+    repo.index.add(["README"])
+    repo.index.commit("initial")
+    repo.create_tag("release-1.0.0")
+    return path
+
+
+def test_checkout_fetches_ref(upstream, tmp_path):
+    checkout = milldeploy.checkout_mill_init(
+        "file://%s" % upstream, "release-1.0.0", str(tmp_path / "cache"))
+    assert checkout.commit == Repo(upstream).head.commit.hexsha
+
+
+def test_unknown_ref_fails_cleanly(upstream, tmp_path):
+    with pytest.raises(click.ClickException) as e:
+        milldeploy.checkout_mill_init("file://%s" % upstream,
+                                      "release-9.9.9", str(tmp_path / "cache"))
+    assert "release-9.9.9" in e.value.message
+
+
+def test_seed_fetches_from_mill_init_url(upstream, tmp_path):
+    seed = str(tmp_path / "seed")
+    Repo.clone_from(upstream, seed).remote('origin').set_url(
+        "file:///nowhere")
+    url = "file://%s" % upstream
+    checkout = milldeploy.checkout_mill_init(url, "release-1.0.0",
+                                             str(tmp_path / "cache"),
+                                             seed=seed)
+    assert Repo(checkout.path).remote('origin').url == url
+
+
+def test_seed_must_be_a_git_repository(tmp_path):
+    seed = tmp_path / "seed"
+    seed.mkdir()
+    (seed / "README").write_text("not a checkout\n")
+    with pytest.raises(click.ClickException) as e:
+        milldeploy.checkout_mill_init("file:///nowhere", "release-1.0.0",
+                                      str(tmp_path / "cache"), seed=str(seed))
+    assert "not a git repository" in e.value.message
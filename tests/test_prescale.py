@@ -0,0 +1,84 @@
+import click
+import pytest
+
+import milldeploy
+
+
+@pytest.mark.parametrize('frequency, start, duration, expected', [
+    ((1, 'h'), 30, 20, ("30 * * * *", "50 * * * *")),
+    ((6, 'h'), 120, 120, ("0 2,8,14,20 * * *", "0 4,10,16,22 * * *")),
+    # a window that runs past midnight ends on the next day
+    ((1, 'd'), 23 * 60, 120, ("0 23 * * *", "0 1 * * *")),
+    ((3, 'd'), 0, 60, ("0 0 */3 * *", "0 1 */3 * *")),
+    ((3, 'd'), 23 * 60, 120, ("0 23 */3 * *", "0 1 2-31/3 * *")),
+    ((1, 'm'), 90, 30, ("30 1 1 * *", "0 2 1 * *")),
+    ((2, 'm'), 90, 30, ("30 1 1 */2 *", "0 2 1 */2 *")),
+])
+def test_prescale_recurrences(frequency, start, duration, expected):
+    assert milldeploy.get_prescale_recurrences(
+        frequency, start, duration, "looping.bit.frequency") == expected
+
+
+@pytest.mark.parametrize('frequency, duration', [
+    ((5, 'h'), 30),
+    ((1, 'h'), 60),
+    ((1, 'd'), 0),
+    ((1, 'm'), 1440),
+])
+def test_unschedulable_prescale_fails(frequency, duration):
+    with pytest.raises(click.ClickException):
+        milldeploy.get_prescale_recurrences(frequency, 0, duration,
+                                            "looping.bit.frequency")
+
+
+def test_looping_frequency():
+    assert milldeploy.parse_looping_frequency(" 3h ", "f") == (3, 'h')
+    assert milldeploy.parse_looping_frequency("0d", "f") is None
+    with pytest.raises(click.ClickException):
+        milldeploy.parse_looping_frequency("3w", "f")
+
+
+def test_time_of_day():
+    assert milldeploy.parse_time_of_day("23:59", "prescaleTime") == 1439
+    with pytest.raises(click.ClickException):
+        milldeploy.parse_time_of_day("24:00", "prescaleTime")
+
+
+class Fleet:
+    def __init__(self, queue, min_size, max_size, throughput=None):
+        self.queue = queue
+        self.min_size = min_size
+        self.max_size = max_size
+        self.throughput = throughput
+
+
+def prescaled(fleet, mill_props, capacity=None):
+    asg = dict(AutoScalingGroupName='bit')
+    group = milldeploy.AutoScaleGroupConfig(asg, {}, None, None, None, None,
+                                            role='bit')
+    milldeploy.use_prescaling(group, fleet, mill_props, "01:00", 120,
+                              capacity)
+    return group.scheduled_actions
+
+
+def test_prescale_holds_enough_workers_for_the_task_queue():
+    actions = prescaled(Fleet('bit', 0, 10, throughput=500),
+                        {'looping.bit.frequency': '1d',
+                         'looping.bit.max-task-queue-size': '300000'})
+    # 300000 tasks at 500 a minute per worker in 120 minutes
+    assert actions == [
+        dict(AutoScalingGroupName='bit',
+             ScheduledActionName='looping-bit-prescale',
+             Recurrence="0 1 * * *", MinSize=5, DesiredCapacity=5),
+        dict(AutoScalingGroupName='bit',
+             ScheduledActionName='looping-bit-release',
+             Recurrence="0 3 * * *", MinSize=0)]
+
+
+def test_prescale_is_capped_and_skipped():
+    actions = prescaled(Fleet('bit', 0, 4), {'looping.bit.frequency': '1d'},
+                        capacity=8)
+    assert actions[0]["MinSize"] == 4
+    # nothing to hold above the minimum size, or the producer is off
+    assert prescaled(Fleet('bit', 4, 4), {'looping.bit.frequency': '1d'}) == []
+    assert prescaled(Fleet('bit', 0, 4), {'looping.bit.frequency': '0d'}) == []
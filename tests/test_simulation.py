@@ -0,0 +1,73 @@
+import milldeploy
+
+
+STEPS = [(10, 'ChangeInCapacity', 1, 300),
+         (1000, 'ChangeInCapacity', 3, 300),
+         (10000, 'PercentChangeInCapacity', 50, 300)]
+
+
+def alarm(name, comparison, threshold, evaluation_periods):
+    return milldeploy.AlarmSpec(
+        dict(alarmName=name, comparison=comparison, threshold=threshold,
+             period=60, evaluationPeriods=evaluation_periods, cooldown=300),
+        name)
+
+
+def worker_group(min_size, max_size, steps=None):
+    up = alarm('audit-up', 'GreaterThanThreshold', 10, 1)
+    down = alarm('audit-down', 'LessThanOrEqualToThreshold', 0, 5)
+    asg = dict(AutoScalingGroupName='audit', MinSize=min_size,
+               MaxSize=max_size)
+    group = milldeploy.AutoScaleGroupConfig(
+        asg, {},
+        milldeploy.create_simple_policy('audit', 'Scale Up', 1, up),
+        milldeploy.create_queue_alarm('audit-queue', up),
+        milldeploy.create_simple_policy('audit', 'Scale Down', -1, down),
+        milldeploy.create_queue_alarm('audit-queue', down),
+        role='audit')
+    if steps is not None:
+        milldeploy.use_step_scaling(group, steps)
+    return group
+
+
+def simulate(group, arrivals, throughput=60, boot_time=300):
+    return milldeploy.FleetSimulation(group, throughput, boot_time,
+                                      0.1).run(arrivals, 48 * 3600)
+
+
+def test_idle_fleet_stays_at_min_size():
+    result = simulate(worker_group(0, 10), [])
+    assert (result.messages, result.max_instances, result.instance_hours) == \
+        (0, 0, 0.0)
+
+
+def test_single_instance_drains_backlog():
+    result = simulate(worker_group(0, 1), [(0, 6000)])
+    # the first alarm period launches the instance at 60s, it takes work
+    # after booting and works off a message a second
+    assert result.messages == 6000
+    assert result.peak_backlog == 6000
+    assert result.max_instances == 1
+    assert result.drain_time == 60 + 300 + 6000
+    assert result.cost == result.instance_hours * 0.1
+
+
+def test_fleet_is_capped_at_max_size():
+    capped = simulate(worker_group(0, 2), [(0, 50000)])
+    assert capped.max_instances == 2
+    assert capped.drain_time > simulate(worker_group(0, 10),
+                                        [(0, 50000)]).drain_time
+
+
+def test_step_bands_drain_faster_than_simple_policies():
+    simple = simulate(worker_group(0, 10), [(0, 50000)])
+    step = simulate(worker_group(0, 10, STEPS), [(0, 50000)])
+    assert step.max_instances == simple.max_instances == 10
+    assert step.drain_time < simple.drain_time
+
+
+def test_fleet_scales_back_in_after_draining():
+    group = worker_group(1, 10)
+    simulation = milldeploy.FleetSimulation(group, 60, 300, 0.1)
+    simulation.run([(0, 20000)], 48 * 3600)
+    assert len(simulation.instances) == 1
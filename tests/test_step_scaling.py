@@ -0,0 +1,68 @@
+import milldeploy
+
+
+SCALE_UP = dict(alarmName='audit-up', comparison='GreaterThanThreshold',
+                threshold=10, period=60, evaluationPeriods=2, cooldown=300,
+                latencySlo=600)
+
+
+def step_group(max_size, scale_up=SCALE_UP):
+    alarm = milldeploy.AlarmSpec(scale_up, 'audit.scaleUp')
+    asg = dict(AutoScalingGroupName='audit', MinSize=0, MaxSize=max_size)
+    return milldeploy.AutoScaleGroupConfig(
+        asg, {}, milldeploy.create_simple_policy('audit', 'Scale Up', 1,
+                                                 alarm),
+        milldeploy.create_queue_alarm('audit-queue', alarm), None, None,
+        role='audit')
+
+
+def band_expressions(group):
+    return [next(m["Expression"] for m in alarm["Metrics"]
+                 if "Expression" in m)
+            for policy, alarm in group.scale_up_steps]
+
+
+STEPS = [(10, 'ChangeInCapacity', 1, 300),
+         (1000, 'ChangeInCapacity', 3, 300),
+         (100000, 'PercentChangeInCapacity', 50, 300)]
+
+
+def test_band_latency_expression_uses_band_threshold():
+    group = step_group(10)
+    milldeploy.use_step_scaling(group, STEPS, 600)
+    assert [a["Threshold"] for p, a in group.scale_up_steps] == [
+        10, 1000, 100000]
+    assert band_expressions(group) == [
+        'MAX([depth, age * 10 / 600])',
+        'MAX([depth, age * 1000 / 600])',
+        'MAX([depth, age * 100000 / 600])']
+    assert group.scale_up_policy is None and group.scale_up_alarm is None
+
+
+def test_band_without_latency_slo_keeps_queue_metric():
+    scale_up = dict(SCALE_UP)
+    del scale_up["latencySlo"]
+    group = step_group(10, scale_up)
+    milldeploy.use_step_scaling(group, STEPS)
+    assert [a["Threshold"] for p, a in group.scale_up_steps] == [
+        10, 1000, 100000]
+    assert all("Metrics" not in a for p, a in group.scale_up_steps)
+
+
+def test_single_instance_group_keeps_first_band():
+    group = step_group(1)
+    milldeploy.use_step_scaling(group, STEPS, 600)
+    assert [p["PolicyName"] for p, a in group.scale_up_steps] == [
+        'Scale Up Above 10']
+
+
+def test_band_that_cannot_add_capacity_is_left_out():
+    group = step_group(3)
+    milldeploy.use_step_scaling(
+        group, [(10, 'ChangeInCapacity', 2, 300),
+                (100, 'ChangeInCapacity', 2, 300),
+                (1000, 'ChangeInCapacity', 5, 300),
+                (10000, 'PercentChangeInCapacity', 50, 300)], 600)
+    # the third band already fills the group from empty
+    assert [p["PolicyName"] for p, a in group.scale_up_steps] == [
+        'Scale Up Above 10', 'Scale Up Above 1000']
@@ -0,0 +1,83 @@
+import email
+import gzip
+import hashlib
+import os
+
+import click
+import pytest
+
+import milldeploy
+
+
+PROPS = {'awsRegion': 'us-east-1', 'bootstrapBucket': 'bootstrap'}
+REGION = 'eu-west-1'
+
+
+def parts(user_data):
+    message = email.message_from_bytes(gzip.decompress(user_data))
+    return [(part.get_content_type(), part.get_filename(),
+             part.get_payload()) for part in message.get_payload()]
+
+
+def oversized(header):
+    # random bytes do not compress, so this is well over the 16 KB limit
+    return "%s\n# %s\n" % (header, os.urandom(20000).hex())
+
+
+def test_small_user_data_stays_inline():
+    script = "#cloud-config\nruncmd:\n  - echo audit\n"
+    user_data, upload = milldeploy.build_user_data(script, "cloud-init.txt",
+                                                   PROPS, REGION)
+    assert upload is None
+    assert parts(user_data) == [('text/cloud-config', 'cloud-init.txt',
+                                 script)]
+
+
+def test_oversized_cloud_config_is_offloaded():
+    script = oversized("#cloud-config")
+    user_data, upload = milldeploy.build_user_data(script, "cloud-init.txt",
+                                                   PROPS, REGION)
+    digest = hashlib.sha256(script.encode("utf-8")).hexdigest()
+    assert upload == dict(Bucket='bootstrap',
+                          Key='milldeploy/user-data/%s' % digest,
+                          Body=script.encode("utf-8"))
+    assert len(user_data) < milldeploy.USER_DATA_LIMIT
+    [(content_type, filename, stub)] = parts(user_data)
+    assert (content_type, filename) == ('text/x-shellscript',
+                                        'fetch-cloud-init.txt')
+    assert 's3://bootstrap/milldeploy/user-data/%s' % digest in stub
+    assert 'cloud-init --file $dir/user-data single' in stub
+    # the session's region, not awsRegion
+    assert '--region eu-west-1' in stub
+
+
+def test_oversized_script_is_offloaded():
+    script = oversized("#!/bin/bash")
+    user_data, upload = milldeploy.build_user_data(script, "first-boot.sh",
+                                                   PROPS, REGION)
+    assert upload is not None
+    assert parts(user_data)[0][1] == 'fetch-first-boot.sh'
+
+
+def test_oversized_user_data_without_bucket_fails():
+    with pytest.raises(click.ClickException):
+        milldeploy.build_user_data(oversized("#cloud-config"),
+                                   "cloud-init.txt",
+                                   dict(PROPS, bootstrapBucket=""), REGION)
+
+
+def test_oversized_boothook_fails():
+    with pytest.raises(click.ClickException):
+        milldeploy.build_user_data(oversized("#cloud-boothook"),
+                                   "cloud-init.txt", PROPS, REGION)
+
+
+def test_bootstrap_hook_uses_session_region():
+    script = "#cloud-config\nruncmd:\n  - echo audit\n"
+    user_data, upload = milldeploy.build_user_data(
+        script, "cloud-init.txt", PROPS, REGION, "mill-audit")
+    [_, (content_type, filename, hook)] = parts(user_data)
+    assert filename == '%s.sh' % milldeploy.BOOTSTRAP_HOOK
+    assert '--region eu-west-1' in hook
+    assert '"mill-audit"' in hook
+    assert 'us-east-1' not in hook